@@ -210,9 +210,22 @@ class AutoGPTApiTools(AutoGPTPluginTemplate):
         prompt.add_command( # type: ignore
             "api",
             "API Call",
-            {"host": "<str>", "endpoint": "<str>", "mthd": "<str>", "params": "<dict>", "body": "<str>", "hdrs": "<dict>", "timeout": "<int>"},
+            {"host": "<str>", "endpoint": "<str>", "mthd": "<str>", "params": "<dict>", "body": "<str>", "hdrs": "<dict>", "timeout": "<int>", "projection": "<str>"},
             self.plugin_class.make_api_call
         )
+        prompt.add_command( # type: ignore
+            "api_batch",
+            "Batch API Call",
+            {"calls": "<list of {host, endpoint, mthd, params, body, hdrs, timeout, projection}>"},
+            self.plugin_class.make_api_calls
+        )
+        prompt.add_command( # type: ignore
+            "api_crawl",
+            "Paginated API Call",
+            {"host": "<str>", "endpoint": "<str>", "params": "<dict>", "hdrs": "<dict>", "timeout": "<int>",
+             "max_pages": "<int>", "max_items": "<int>", "skip": "<int>"},
+            self.plugin_class.crawl_api
+        )
         return prompt
     
     def can_handle_user_input(self, user_input: str) -> bool:
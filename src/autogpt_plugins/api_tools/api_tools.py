@@ -1,18 +1,228 @@
 """API Call command for Autogpt."""
 
+import asyncio
+import codecs
 import json
+import mimetypes
+import os
 import re
+import tempfile
+import threading
+import time
 import requests
-from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 from urllib.parse import urljoin, urlparse
 from urllib.parse import urljoin
 from validators import url as is_valid_url
+try:
+    from .cassette import Cassette, CassetteAdapter
+    from .http_cache import ResponseCache
+    from .pagination import extract_items, next_link, next_page
+    from .projection import parse_projection, project_json
+    from .rate_limit import TokenBucketLimiter
+    from .resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+except ImportError:
+    from cassette import Cassette, CassetteAdapter
+    from http_cache import ResponseCache
+    from pagination import extract_items, next_link, next_page
+    from projection import parse_projection, project_json
+    from rate_limit import TokenBucketLimiter
+    from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+# The characters sanitize_string() keeps
+_ALLOWED_CHARACTER = re.compile(r'[a-zA-Z0-9_: -{}[\],"]')
+_DISALLOWED_ASCII = bytes(c for c in range(128) if not _ALLOWED_CHARACTER.match(chr(c)))
+_JSON_OBJECT_START = re.compile(r"[ \t\n\r]*\{")
 
 class ApiCallCommand:
     """
     A class used to make API calls.
+
+    Requests are sent through one `requests.Session` per host, so repeated calls
+    to the same host reuse their keep-alive connections instead of repeating the
+    DNS lookup and the TCP and TLS handshakes. The pools are configured with the
+    API_TOOLS_POOL_MAXSIZE and API_TOOLS_SESSION_IDLE_TIMEOUT environment
+    variables.
+
+    GET and HEAD responses are cached when a ResponseCache is given or enabled
+    with API_TOOLS_CACHE / API_TOOLS_CACHE_DIR.
+
+    Response bodies are streamed and only their first API_TOOLS_MAX_RESPONSE_BYTES
+    are kept. If API_TOOLS_SPILL_DIR is set, larger bodies are written to a file
+    in that directory, up to API_TOOLS_MAX_SPILL_BYTES. Bodies are projected up
+    to API_TOOLS_MAX_PROJECTION_BYTES.
+
+    Failed requests are retried according to a RetryPolicy, and a per-host
+    CircuitBreaker rejects requests to hosts that keep failing. Requests are
+    paced per host by a TokenBucketLimiter, configured with API_TOOLS_RATE_LIMIT
+    and API_TOOLS_HOST_RATE_LIMITS.
+
+    The traffic can be recorded to a Cassette and replayed from it offline,
+    see API_TOOLS_CASSETTE.
     """
 
+    def __init__(self, pool_maxsize: Optional[int] = None, idle_timeout: Optional[float] = None,
+                 cache: Optional[ResponseCache] = None, max_response_bytes: Optional[int] = None,
+                 spill_dir: Optional[str] = None, retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 rate_limiter: Optional[TokenBucketLimiter] = None, cassette: Optional[Cassette] = None,
+                 max_projection_bytes: Optional[int] = None):
+        """
+        Initialize the per-host sessions.
+
+        Args:
+            pool_maxsize (int): The number of connections kept alive per host.
+            idle_timeout (float): Seconds after which an unused session is closed.
+            cache (ResponseCache): The response cache, configured from the
+                environment by default.
+            max_response_bytes (int): The number of bytes of a response body
+                returned to the agent.
+            spill_dir (str): The directory large response bodies are written to.
+            retry_policy (RetryPolicy): When to send failed requests again,
+                configured from the environment by default.
+            circuit_breaker (CircuitBreaker): The breaker of every host,
+                configured from the environment by default.
+            rate_limiter (TokenBucketLimiter): The pacing of every host,
+                configured from the environment by default.
+            cassette (Cassette): The file requests are recorded to or replayed
+                from, configured from the environment by default.
+            max_projection_bytes (int): The number of bytes of a response body
+                read to be projected.
+        """
+
+        if pool_maxsize is None:
+            pool_maxsize = int(os.getenv("API_TOOLS_POOL_MAXSIZE", "10"))
+        if idle_timeout is None:
+            idle_timeout = float(os.getenv("API_TOOLS_SESSION_IDLE_TIMEOUT", "300"))
+        self.pool_maxsize = max(1, pool_maxsize)
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, requests.Session] = {}
+        self._last_used: Dict[str, float] = {}
+        self._request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        if max_response_bytes is None:
+            max_response_bytes = int(os.getenv("API_TOOLS_MAX_RESPONSE_BYTES", str(1024 * 1024)))
+        self.max_response_bytes = max(0, max_response_bytes)
+        self.spill_dir = spill_dir if spill_dir is not None else os.getenv("API_TOOLS_SPILL_DIR") or None
+        self.max_spill_bytes = int(os.getenv("API_TOOLS_MAX_SPILL_BYTES", str(100 * 1024 * 1024)))
+        if max_projection_bytes is None:
+            max_projection_bytes = int(os.getenv("API_TOOLS_MAX_PROJECTION_BYTES", str(8 * 1024 * 1024)))
+        self.max_projection_bytes = max(0, max_projection_bytes)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy.from_env()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker.from_env()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucketLimiter.from_env()
+        self.cassette = cassette if cassette is not None else Cassette.from_env()
+
+    # End of __init__()
+
+
+    def get_session(self, url: str) -> requests.Session:
+        """
+        Return the session of the host of a URL, creating it if needed.
+
+        Sessions that were not used for longer than the idle timeout are closed
+        first, since servers drop idle keep-alive connections anyway.
+
+        Args:
+            url (str): The URL about to be requested.
+
+        Returns:
+            requests.Session: The session of the URL's scheme and host.
+        """
+
+        host_key = self.host_key(url)
+        now = time.monotonic()
+        with self._lock:
+            for key, last_used in list(self._last_used.items()):
+                if key != host_key and now - last_used > self.idle_timeout:
+                    self._sessions.pop(key).close()
+                    del self._last_used[key]
+            session = self._sessions.get(host_key)
+            if session is None:
+                session = requests.Session()
+                if self.cassette is not None:
+                    adapter = CassetteAdapter(self.cassette, pool_connections=1, pool_maxsize=self.pool_maxsize)
+                else:
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host_key] = session
+            self._last_used[host_key] = now
+            self._request_counts[host_key] = self._request_counts.get(host_key, 0) + 1
+        return session
+
+    # End of get_session()
+
+
+    def host_key(self, url: str) -> str:
+        """
+        Return the scheme and host of a URL, the key of its session and limits.
+
+        Args:
+            url (str): A URL.
+
+        Returns:
+            str: The lower-cased scheme://netloc of the URL.
+        """
+
+        parsed_url = urlparse(url)
+        return f"{parsed_url.scheme}://{parsed_url.netloc}".lower()
+
+    # End of host_key()
+
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return connection reuse metrics of every host called so far.
+
+        Returns:
+            dict: For every host, the number of requests sent, of connections
+                opened and of requests that reused an open connection, the
+                counters of the circuit breaker and the seconds requests were
+                delayed by the rate limiter.
+        """
+
+        metrics = {}
+        with self._lock:
+            for host_key, count in self._request_counts.items():
+                connections = 0
+                session = self._sessions.get(host_key)
+                if session is not None:
+                    pool_manager = session.get_adapter(host_key).poolmanager
+                    for pool_key in pool_manager.pools.keys():
+                        pool = pool_manager.pools.get(pool_key)
+                        if pool is not None:
+                            connections += pool.num_connections
+                metrics[host_key] = {
+                    "requests": count,
+                    "connections": connections,
+                    "reused_connections": max(count - connections, 0),
+                }
+        for host_key, host_metrics in metrics.items():
+            host_metrics.update(self.circuit_breaker.get_metrics(host_key))
+            host_metrics["rate_limit_wait"] = self.rate_limiter.waited(urlparse(host_key).hostname or "")
+        return metrics
+
+    # End of get_metrics()
+
+
+    def close(self) -> None:
+        """
+        Close the sessions of every host.
+        """
+
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._last_used.clear()
+
+    # End of close()
+
+
     def sanitize_string(self, input_string: str) -> str:
         """
         Remove potentially harmful characters from the string.
@@ -24,7 +234,9 @@ class ApiCallCommand:
             str: The sanitized string.
         """
 
-        return re.sub(r'[^a-zA-Z0-9_: -{}[\],"]', '', input_string)
+        # Every allowed character is ASCII, so the others are dropped by the
+        # encoding before the rest are deleted with the precomputed table
+        return input_string.encode("ascii", "ignore").translate(None, _DISALLOWED_ASCII).decode("ascii")
     
     # End of sanitize_string()
 
@@ -41,7 +253,9 @@ class ApiCallCommand:
         """
 
         data = json.loads(input_string)
-        sanitized_data = {self.sanitize_string(k): self.sanitize_string(str(v)) for k, v in data.items()}
+        sanitize_string = self.sanitize_string
+        sanitized_data = {sanitize_string(k): sanitize_string(v if isinstance(v, str) else str(v))
+                          for k, v in data.items()}
         return json.dumps(sanitized_data)
     
     # End of sanitize_json()
@@ -58,6 +272,9 @@ class ApiCallCommand:
             str: The sanitized string.
         """
 
+        # Only JSON objects are sanitized as JSON, anything else skips the parser
+        if not _JSON_OBJECT_START.match(input_string):
+            return self.sanitize_string(input_string)
         try:
             sanitized_string = self.sanitize_json(input_string)
         except json.JSONDecodeError:
@@ -68,7 +285,7 @@ class ApiCallCommand:
 
 
     def make_api_call(self, host = "", endpoint = "", mthd = "GET", params = {}, body = "", 
-                      hdrs = {"Content-Type": "application/json"}, timeout = 60) -> str:
+                      hdrs = {"Content-Type": "application/json"}, timeout = 60, projection = "") -> str:
         """
         Return the results of an API call
         
@@ -80,6 +297,10 @@ class ApiCallCommand:
             body (str): The body to use.
             hdrs (dict): The headers to use.
             timeout (int): The timeout to use.
+            projection (str): The fields of a JSON response to return, such as
+                `data(id,name,owner.login),meta.total`. See parse_projection().
+                The body is projected up to max_projection_bytes, and the
+                projected fields are capped to max_response_bytes.
 
         Returns:
             str: A JSON string containing the results of the API 
@@ -87,8 +308,68 @@ class ApiCallCommand:
                 {"status": "success|error", "status_code": int, "response": str, "response": str}
         """
 
-        # Initialize variables  
-        response = {}
+        # Type-check inputs - projection
+        tree = None
+        if projection:
+            if not isinstance(projection, str):
+                raise ValueError("projection must be a string")
+            tree = parse_projection(projection)
+
+        sanitized_method, url, params, body, hdrs, timeout = self.validate_api_call(
+            host, endpoint, mthd, params, body, hdrs, timeout)
+        if tree is None:
+            response, _ = self.call_api(sanitized_method, url, params, body, hdrs, timeout)
+            return json.dumps(response)
+
+        # The body is read up to its own cap, held in memory while it is
+        # projected, and the cap on the response size applies to the projected
+        # fields instead
+        max_bytes = max(self.max_response_bytes, self.max_projection_bytes)
+        response, _ = self.call_api(sanitized_method, url, params, body, hdrs, timeout, max_bytes)
+        if response["status"] != "success":
+            return json.dumps(response)
+        if "truncated" in response:
+            response["projection_error"] = "The response is larger than the maximum size to project"
+        else:
+            # Keep only the projected fields, without decoding the others
+            try:
+                response["response"] = json.dumps(project_json(response["response"], tree))
+            except ValueError as e:
+                response["projection_error"] = "The response is not JSON: " + str(e)
+
+        response["response"], size = self.truncate_text(response["response"], self.max_response_bytes)
+        returned_bytes = len(response["response"].encode("utf-8"))
+        if "truncated" in response:
+            response["truncated"]["returned_bytes"] = returned_bytes
+        elif returned_bytes < size:
+            key = "read_bytes" if "projection_error" in response else "projected_bytes"
+            response["truncated"] = {"returned_bytes": returned_bytes, key: size}
+        return json.dumps(response)
+    
+    # End of make_api_call()
+
+
+    def validate_api_call(self, host, endpoint, mthd, params, body, hdrs,
+                          timeout) -> Tuple[str, str, Dict[str, Any], str, Dict[str, Any], int]:
+        """
+        Validate and normalize the arguments of an API call
+
+        Args:
+            host (str): The host to call.
+            endpoint (str): The endpoint to call.
+            mthd (str): The HTTP method to use.
+            params (dict): The query parameters to use.
+            body (str): The body to use.
+            hdrs (dict): The headers to use.
+            timeout (int): The timeout to use.
+
+        Returns:
+            tuple: The sanitized method and URL, and the query parameters, body,
+                headers and timeout to use.
+
+        Raises:
+            ValueError: If an argument is invalid.
+        """
 
         # Type-check inputs - host
         if not isinstance(host, str):
@@ -182,32 +463,77 @@ class ApiCallCommand:
         # Validate timeout_secs
         if not timeout > 0:
             raise ValueError("timeout_secs must be a positive integer")
-        
+
+        return sanitized_method, url, params, body, hdrs, timeout
+
+    # End of validate_api_call()
+
+
+    def call_api(self, sanitized_method: str, url: str, params: Dict[str, Any], body: str, hdrs: Dict[str, Any],
+                 timeout: int, max_bytes: Optional[int] = None) -> Tuple[Dict[str, Any], Any]:
+        """
+        Make a validated API call
+
+        Args:
+            sanitized_method (str): The HTTP method, from validate_api_call().
+            url (str): The URL, from validate_api_call().
+            params (dict): The query parameters to use.
+            body (str): The body to use.
+            hdrs (dict): The headers to use.
+            timeout (int): The timeout to use.
+            max_bytes (int): The number of bytes of the body to return,
+                max_response_bytes by default.
+
+        Returns:
+            tuple: The result in the format of make_api_call(), and the
+                response headers.
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_response_bytes
+
+        # Serve GET and HEAD requests from the cache, or revalidate them
+        cache_url = None
+        cached = None
+        if self.cache is not None:
+            if sanitized_method in ("GET", "HEAD"):
+                cache_url = requests.Request(sanitized_method, url, params=params).prepare().url
+                cached = self.cache.lookup(sanitized_method, cache_url, hdrs)
+                if cached is not None:
+                    if self.cache.is_fresh(cached, hdrs):
+                        return self._cached_response(cached, max_bytes), cached["headers"]
+                    hdrs = {**self.cache.conditional_headers(cached), **hdrs}
+
         # Make the request
         try:
-            if sanitized_method == "GET":
-                response = requests.get(url, params=params, headers=hdrs, timeout=timeout)
-            elif sanitized_method == "HEAD":
-                response = requests.head(url, params=params, headers=hdrs, timeout=timeout)
-            elif sanitized_method == "OPTIONS":
-                response = requests.options(url, params=params, headers=hdrs, timeout=timeout)
-            elif sanitized_method == "POST":
-                response = requests.post(url, params=params, json=body, headers=hdrs, timeout=timeout)
-            elif sanitized_method == "PUT":
-                response = requests.put(url, params=params, json=body, headers=hdrs, timeout=timeout)
-            elif sanitized_method == "DELETE":
-                response = requests.delete(url, params=params, json=body, headers=hdrs, timeout=timeout)
-            elif sanitized_method == "PATCH":
-                response = requests.patch(url, params=params, json=body, headers=hdrs, timeout=timeout)
+            if sanitized_method in ("GET", "HEAD", "OPTIONS"):
+                response = self.send_request(sanitized_method, url, params=params, headers=hdrs, timeout=timeout,
+                                             allow_redirects=sanitized_method != "HEAD")
             else:
-                raise ValueError("Invalid method: " + mthd)
+                response = self.send_request(sanitized_method, url, params=params, json=body, headers=hdrs,
+                                             timeout=timeout)
             
-            response_text = response.text
+            if cached is not None and response.status_code == 304:
+                # Not modified, the stored body is still valid
+                response.close()
+                self.cache.refresh(sanitized_method, cache_url, cached, response.headers)
+                return self._cached_response(cached, max_bytes), cached["headers"]
+
+            response_headers = response.headers
+            response_text, truncation = self.read_response_body(response, max_bytes)
+            if self.cache is not None:
+                if cache_url is not None and truncation is None:
+                    self.cache.store(sanitized_method, cache_url, hdrs, response.status_code, response.headers,
+                                     response_text)
+                elif sanitized_method not in ("OPTIONS",) and response.status_code < 400:
+                    self.cache.invalidate(requests.Request("GET", url, params=params).prepare().url)
             response = {
                 "status": "success",
                 "status_code": response.status_code,
                 "response": response_text
             }
+            if truncation is not None:
+                response["truncated"] = truncation
 
         except requests.exceptions.RequestException as e:
             response = {
@@ -215,9 +541,422 @@ class ApiCallCommand:
                 "status_code": None,
                 "response": str(e)
             }
+            response_headers = {}
 
-        return json.dumps(response)
+        return response, response_headers
     
     # End of call_api()
 
+
+    def _cached_response(self, cached: Dict[str, Any], max_bytes: int) -> Dict[str, Any]:
+        """
+        Return a cached response in the format of make_api_call(), capped to max_bytes.
+        """
+
+        text, size = self.truncate_text(cached["body"], max_bytes)
+        response = {
+            "status": "success",
+            "status_code": cached["status_code"],
+            "response": text
+        }
+        if len(text) < len(cached["body"]):
+            response["truncated"] = {"returned_bytes": len(text.encode("utf-8")), "read_bytes": size,
+                                     "content_length": size}
+        return response
+
+    # End of _cached_response()
+
+
+    def send_request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request on the host's session, retrying it if the policy allows.
+
+        Every attempt waits for the host's rate limiter first. Connection
+        errors, timeouts and 5xx responses count as failures of the host for
+        its circuit breaker.
+
+        Args:
+            method (str): The validated HTTP method.
+            url (str): The validated URL.
+            **kwargs: The arguments of requests.Session.request().
+
+        Returns:
+            requests.Response: The streamed response of the last attempt.
+
+        Raises:
+            CircuitOpenError: If the host's circuit is open.
+            requests.exceptions.RequestException: If the last attempt failed.
+        """
+
+        session = self.get_session(url)
+        host_key = self.host_key(url)
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow(host_key):
+                raise CircuitOpenError(f"Circuit open for {host_key} after repeated failures, "
+                                       f"retry in {self.circuit_breaker.retry_in(host_key):.0f} seconds")
+            self.rate_limiter.acquire(urlparse(url).hostname or "")
+            try:
+                response = session.request(method, url, stream=True, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.circuit_breaker.record_failure(host_key)
+                delay = self.retry_policy.delay(method, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                # Neither a success nor a failure of the host, but a trial
+                # request must not keep its circuit from being tried again
+                self.circuit_breaker.release_trial(host_key)
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.circuit_breaker.record_failure(host_key)
+                else:
+                    self.circuit_breaker.record_success(host_key)
+                delay = self.retry_policy.delay(method, attempt, response.status_code,
+                                                response.headers.get("Retry-After"))
+                if delay is None:
+                    return response
+                response.close()
+            self.circuit_breaker.record_retry(host_key)
+            time.sleep(delay)
+            attempt += 1
+
+    # End of send_request()
+
+
+    def read_response_body(self, response: requests.Response,
+                           max_bytes: Optional[int] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Read a streamed response body, up to the configured number of bytes.
+
+        The download stops as soon as the cap is reached, unless the body is
+        spilled to a file, in which case it goes on until the spill cap.
+
+        Args:
+            response (requests.Response): A response requested with stream=True.
+            max_bytes (int): The number of bytes to return, max_response_bytes
+                by default.
+
+        Returns:
+            tuple: The text of the body, and None if it is complete or a summary
+                of what was truncated: the number of bytes returned, the number of
+                bytes read, the Content-Length if known, and the path of the
+                file holding the body if it was spilled.
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_response_bytes
+        content = bytearray()
+        bytes_read = 0
+        spill_file = None
+        spill_path = None
+        try:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                bytes_read += len(chunk)
+                if len(content) < max_bytes:
+                    content += chunk[:max_bytes - len(content)]
+                if bytes_read > max_bytes:
+                    if spill_file is None and self.spill_dir:
+                        spill_file, spill_path = self._open_spill_file(response)
+                        spill_file.write(content)
+                        spill_file.write(chunk[len(content) - (bytes_read - len(chunk)):])
+                    elif spill_file is not None:
+                        spill_file.write(chunk)
+                    if spill_file is None or bytes_read >= self.max_spill_bytes:
+                        break
+        finally:
+            if spill_file is not None:
+                spill_file.close()
+            response.close()
+
+        if bytes_read <= max_bytes:
+            # Complete, decoded exactly like response.text, the buffer being
+            # freed before the text is decoded
+            response._content = bytes(content)
+            del content
+            return response.text, None
+
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        truncation = {
+            "returned_bytes": len(content),
+            "read_bytes": bytes_read,
+            "content_length": int(response.headers["Content-Length"])
+            if response.headers.get("Content-Length", "").isdigit() else None,
+        }
+        if spill_path is not None:
+            truncation["file"] = spill_path
+        return decoder.decode(content), truncation
+
+    # End of read_response_body()
+
+
+    def truncate_text(self, text: str, max_bytes: int) -> Tuple[str, int]:
+        """
+        Cut a text to at most max_bytes bytes of UTF-8, dropping the incomplete
+        character at the cut.
+
+        Args:
+            text (str): The text to cut.
+            max_bytes (int): The maximum number of bytes.
+
+        Returns:
+            tuple: The text, and its size in bytes before it was cut.
+        """
+
+        data = text.encode("utf-8")
+        if len(data) <= max_bytes:
+            return text, len(data)
+        return codecs.getincrementaldecoder("utf-8")().decode(data[:max_bytes]), len(data)
+
+    # End of truncate_text()
+
+
+    def _open_spill_file(self, response: requests.Response):
+        """
+        Open a new file for a response body in the spill directory.
+        """
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        suffix = mimetypes.guess_extension(content_type) or ".txt"
+        fd, path = tempfile.mkstemp(prefix="api_response_", suffix=suffix, dir=self.spill_dir)
+        return os.fdopen(fd, "wb"), path
+
+    # End of _open_spill_file()
+
+
+    def make_api_calls(self, calls: Union[str, List[Dict[str, Any]]], max_concurrency: Optional[int] = None,
+                       host_concurrency: Optional[int] = None) -> str:
+        """
+        Return the results of several API calls made concurrently
+
+        Every call is validated and sent by make_api_call(), at most
+        max_concurrency at once and at most host_concurrency at once per host.
+
+        Args:
+            calls (list): The calls to make, as a list or a JSON string of
+                dictionaries with the arguments of make_api_call(): host,
+                endpoint, mthd (or method), params, body, hdrs (or headers),
+                timeout and projection. Unknown arguments fail only their call.
+            max_concurrency (int): The maximum number of calls in flight,
+                API_TOOLS_BATCH_CONCURRENCY or 10 by default.
+            host_concurrency (int): The maximum number of calls in flight per
+                host, API_TOOLS_BATCH_HOST_CONCURRENCY or 4 by default.
+
+        Returns:
+            str: A JSON list with the result of every call, in the order of
+                calls, in the format of make_api_call(). Calls that fail
+                validation or raise have the status "error", the error message
+                as response, and the type and message of the error as error.
+        """
+
+        # Type-check inputs - calls
+        if isinstance(calls, str):
+            try:
+                calls = json.loads(calls)
+            except json.JSONDecodeError:
+                raise ValueError("calls must be a list")
+        if not isinstance(calls, list):
+            raise ValueError("calls must be a list")
+        arguments = []
+        for call in calls:
+            try:
+                arguments.append(self._api_call_arguments(call))
+            except Exception as e:
+                # Reported in the call's result, the other calls are still made
+                arguments.append(e)
+
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("API_TOOLS_BATCH_CONCURRENCY", "10"))
+        if host_concurrency is None:
+            host_concurrency = int(os.getenv("API_TOOLS_BATCH_HOST_CONCURRENCY", "4"))
+        max_concurrency = max(1, int(max_concurrency))
+        host_concurrency = max(1, int(host_concurrency))
+
+        batch = self._make_api_calls_async(arguments, max_concurrency, host_concurrency)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            results = asyncio.run(batch)
+        else:
+            # Already inside an event loop, run the batch on a loop of its own
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                results = executor.submit(asyncio.run, batch).result()
+        return json.dumps(results)
+
+    # End of make_api_calls()
+
+
+    def _api_call_arguments(self, call: Any) -> Dict[str, Any]:
+        """
+        Map a batch call to the keyword arguments of make_api_call().
+        """
+
+        if not isinstance(call, dict):
+            raise ValueError("every call must be a dictionary")
+        aliases = {"method": "mthd", "headers": "hdrs"}
+        allowed = {"host", "endpoint", "mthd", "params", "body", "hdrs", "timeout", "projection"}
+        arguments = {}
+        for key, value in call.items():
+            key = aliases.get(key, key)
+            if key not in allowed:
+                raise ValueError("unknown call argument: " + str(key))
+            arguments[key] = value
+        return arguments
+
+    # End of _api_call_arguments()
+
+
+    async def _make_api_calls_async(self, calls: List[Union[Dict[str, Any], Exception]], max_concurrency: int,
+                                    host_concurrency: int) -> List[Dict[str, Any]]:
+        """
+        Run make_api_call() for every call on a thread pool, within the limits.
+
+        Calls whose arguments are invalid are given as the exception to report,
+        and a call that raises is reported in its own result.
+        """
+
+        loop = asyncio.get_running_loop()
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+
+        def error(e: Exception) -> Dict[str, Any]:
+            return {"status": "error", "status_code": None, "response": str(e), "error": f"{type(e).__name__}: {e}"}
+
+        async def call_api(executor: ThreadPoolExecutor,
+                           arguments: Union[Dict[str, Any], Exception]) -> Dict[str, Any]:
+            if isinstance(arguments, Exception):
+                return error(arguments)
+            try:
+                host = str(arguments.get("host", ""))
+                host_key = self.host_key(host if "://" in host else f"https://{host}")
+            except Exception as e:
+                return error(e)
+            host_limit = host_limits.setdefault(host_key, asyncio.Semaphore(host_concurrency))
+            async with host_limit:
+                try:
+                    result = await loop.run_in_executor(executor, lambda: self.make_api_call(**arguments))
+                except Exception as e:
+                    # Bad input of one call must not lose the results of the others
+                    return error(e)
+            return json.loads(result)
+
+        # The executor's size is the global limit
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return await asyncio.gather(*(call_api(executor, arguments) for arguments in calls))
+
+    # End of _make_api_calls_async()
+
+
+    def crawl_api(self, host = "", endpoint = "", params = {}, hdrs = {"Content-Type": "application/json"},
+                  timeout = 60, max_pages = 10, max_items = 1000, skip = 0) -> str:
+        """
+        Return the merged items of every page of a paginated GET API call
+
+        The next page is found in the RFC 5988 Link header, or else in the body
+        (cursor fields such as `next`, `next_cursor` or `nextPageToken`, or a
+        `has_more` flag), or else by advancing a `page` or `offset` query
+        parameter. When the Link header gives the next page, it is requested
+        while the current one is parsed. Pages on other hosts are not followed.
+
+        Args:
+            host (str): The host to call.
+            endpoint (str): The endpoint of the first page.
+            params (dict): The query parameters of the first page.
+            hdrs (dict): The headers to use.
+            timeout (int): The timeout of every page.
+            max_pages (int): The maximum number of pages to request.
+            max_items (int): The maximum number of items to return.
+            skip (int): The number of items of the first page to leave out.
+
+        Returns:
+            str: A JSON string in the format
+                {"status": "success|error", "pages": int, "items": list,
+                "next": {"url": str, "params": dict, "skip": int} | null},
+                where next is the page to continue from when a limit was
+                reached, and skip the number of its items already returned.
+                Errors also have the "status_code" and "response" of the
+                failed page.
+        """
+
+        # Type-check inputs - limits
+        try:
+            max_pages = int(max_pages)
+            max_items = int(max_items)
+            skip = int(skip)
+        except (TypeError, ValueError):
+            raise ValueError("max_pages, max_items and skip must be integers")
+        if max_pages < 1 or max_items < 1:
+            raise ValueError("max_pages and max_items must be positive integers")
+        if skip < 0:
+            raise ValueError("skip must not be negative")
+
+        _, url, params, _, hdrs, timeout = self.validate_api_call(host, endpoint, "GET", params, "", hdrs, timeout)
+        origin = self.host_key(url)
+        result = {"status": "success", "pages": 0, "items": [], "next": None}
+        items = result["items"]
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = None
+        try:
+            current = (url, params)
+            future = executor.submit(self.call_api, "GET", url, params, "", hdrs, timeout)
+            while future is not None:
+                response, headers = future.result()
+                future = None
+                result["pages"] += 1
+                status_code = response["status_code"]
+                if response["status"] != "success" or not 200 <= status_code < 300:
+                    result.update(status="error", status_code=status_code, response=response["response"])
+                    break
+
+                following = None
+                link = next_link(headers, current[0])
+                if link is not None:
+                    following = (link, {})
+                    if result["pages"] < max_pages and self.host_key(link) == origin:
+                        # Prefetch the next page while this one is parsed
+                        future = executor.submit(self.call_api, "GET", link, {}, "", hdrs, timeout)
+
+                if "truncated" in response:
+                    result.update(status="error", status_code=status_code,
+                                  response=f"Page {result['pages']} is larger than the maximum response size")
+                    break
+                try:
+                    data = json.loads(response["response"])
+                except ValueError:
+                    result.update(status="error", status_code=status_code,
+                                  response=f"Page {result['pages']} is not JSON")
+                    break
+                page_items = extract_items(data)
+                if page_items is None:
+                    page_items = [data]
+                first = skip if result["pages"] == 1 else 0
+                end = first + max_items - len(items)
+                items.extend(page_items[first:end])
+                if end < len(page_items):
+                    # The page was cut, continue from its first item not returned
+                    result["next"] = {"url": current[0], "params": current[1], "skip": end}
+                    break
+
+                if following is None:
+                    following = next_page(data, page_items, *current)
+                if following is None or following == current or self.host_key(following[0]) != origin:
+                    break
+                if len(items) >= max_items or result["pages"] >= max_pages:
+                    result["next"] = {"url": following[0], "params": following[1], "skip": 0}
+                    break
+                if future is None:
+                    future = executor.submit(self.call_api, "GET", following[0], following[1], "", hdrs, timeout)
+                current = following
+        finally:
+            # Drop the prefetched page, if any
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        return json.dumps(result)
+
+    # End of crawl_api()
+
 # End of class ApiCallCommand
@@ -0,0 +1,100 @@
+"""Latency benchmark of ApiCallCommand.make_api_call replayed from a cassette.
+
+Usage:
+    python benchmark_cassette.py CASSETTE [--repeat N]
+
+Record the cassette first by running Auto-GPT, or any script calling the
+command, with API_TOOLS_CASSETTE=CASSETTE and API_TOOLS_CASSETTE_MODE=record.
+
+Every recorded request is replayed offline through the whole command:
+validation, retries, rate limiting, streaming, serialization. Nothing is sent,
+so the latencies are the command's own overhead per call, reported next to
+the bare replay of the transport and the latencies recorded on the network.
+"""
+import argparse
+import json
+import statistics
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+try:
+    from .api_tools import ApiCallCommand
+    from .cassette import Cassette, CassetteAdapter
+    from .rate_limit import TokenBucketLimiter
+except ImportError:
+    from api_tools import ApiCallCommand
+    from cassette import Cassette, CassetteAdapter
+    from rate_limit import TokenBucketLimiter
+
+
+def call_arguments(request: dict) -> dict:
+    """Return the make_api_call() arguments sending a recorded request."""
+    url = urlsplit(request["url"])
+    body = request["body"]
+    if request["method"] not in ("GET", "HEAD", "OPTIONS"):
+        # The command sends its body as a JSON string
+        body = json.loads(body) if body else ""
+    return {
+        "host": f"{url.scheme}://{url.netloc}",
+        "endpoint": url.path or "/",
+        "mthd": request["method"],
+        "params": dict(parse_qsl(url.query, keep_blank_values=True)),
+        "body": body,
+    }
+
+
+def percentiles(seconds: list) -> str:
+    """Format the p50 and p95 of latencies in microseconds."""
+    if len(seconds) < 2:
+        return f"p50 {seconds[0] * 1e6:9.1f} us, p95 {seconds[0] * 1e6:9.1f} us"
+    cuts = statistics.quantiles(seconds, n=20, method="inclusive")
+    return f"p50 {cuts[9] * 1e6:9.1f} us, p95 {cuts[18] * 1e6:9.1f} us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cassette")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    cassette = Cassette(args.cassette, "replay")
+    command = ApiCallCommand(rate_limiter=TokenBucketLimiter(), cassette=cassette)
+    session = requests.Session()
+    session.mount("http://", CassetteAdapter(cassette))
+    session.mount("https://", CassetteAdapter(cassette))
+
+    requests_seen = set()
+    for interaction in cassette.interactions:
+        request = interaction["request"]
+        key = Cassette.request_key(**request)
+        if key in requests_seen:
+            continue
+        requests_seen.add(key)
+        arguments = call_arguments(request)
+
+        transport, pipeline = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            session.request(request["method"], request["url"], data=request["body"] or None,
+                            allow_redirects=False).content
+            transport.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = command.make_api_call(**arguments)
+            pipeline.append(time.perf_counter() - start)
+        status = json.loads(result)["status_code"]
+        recorded = [i["elapsed"] for i in cassette.interactions if Cassette.request_key(**i["request"]) == key]
+
+        print(f"{request['method']} {request['url']} ({status})")
+        print(f"    make_api_call: {percentiles(pipeline)}")
+        print(f"    transport:     {percentiles(transport)}")
+        print(f"    recorded:      {percentiles(recorded)}")
+
+    command.close()
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
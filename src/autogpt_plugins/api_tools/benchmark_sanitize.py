@@ -0,0 +1,72 @@
+"""Micro-benchmark of ApiCallCommand.sanitize against the previous regex version.
+
+Usage:
+    python benchmark_sanitize.py [--items N] [--repeat N]
+
+Sanitizes hosts, endpoints and JSON bodies of growing size, after checking
+that both implementations return the same strings.
+"""
+import argparse
+import json
+import re
+import timeit
+
+try:
+    from .api_tools import ApiCallCommand
+except ImportError:
+    from api_tools import ApiCallCommand
+
+
+def sanitize_regex(input_string: str) -> str:
+    """The re.sub based sanitize this benchmark compares against."""
+
+    def sanitize_string(value: str) -> str:
+        return re.sub(r'[^a-zA-Z0-9_: -{}[\],"]', '', value)
+
+    try:
+        data = json.loads(input_string)
+        return json.dumps({sanitize_string(k): sanitize_string(str(v)) for k, v in data.items()})
+    except json.JSONDecodeError:
+        return sanitize_string(input_string)
+
+
+def corpus(items: int) -> dict:
+    """Return the inputs to sanitize, by name."""
+    record = {
+        "id": 12345,
+        "name": "Café Zürich | Ünïcödé ~ <script>alert(1)</script>",
+        "tags": ["a", "b", "c"],
+        "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+    }
+    return {
+        "host": "https://api.example.com",
+        "endpoint": "/v1/users/12345/repos?page=2&per_page=100",
+        "json 1 KB": json.dumps({f"key{i}": record["description"] for i in range(4)}),
+        f"json {items} records": json.dumps({f"record{i}": record for i in range(items)}),
+        f"text {items} records": " ".join(record["name"] for _ in range(items)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sanitize = ApiCallCommand().sanitize
+    for name, value in corpus(args.items).items():
+        if sanitize(value) != sanitize_regex(value):
+            raise SystemExit(f"{name}: the outputs differ")
+        number = max(1, 100000 // len(value))
+        timings = []
+        for function in (sanitize_regex, sanitize):
+            seconds = min(timeit.repeat(lambda: function(value), number=number, repeat=args.repeat))
+            timings.append(seconds / number)
+        print(
+            f"{name:>20} ({len(value) / 1e3:9.1f} KB): regex {timings[0] * 1e6:10.1f} us, "
+            f"translate {timings[1] * 1e6:10.1f} us, {timings[0] / timings[1]:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Recording and replay of the API Call command's HTTP traffic."""
+
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+# Response headers describing the body as it was sent, not as it is recorded
+_TRANSPORT_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive")
+
+CASSETTE_VERSION = 1
+
+
+class CassetteError(requests.exceptions.RequestException):
+    """
+    Raised when a replayed request was not recorded in the cassette.
+    """
+
+# End of class CassetteError
+
+
+class Cassette:
+    """
+    A file of recorded HTTP interactions.
+
+    In "record" mode requests are sent and every response is saved to the
+    file, which is rewritten after each interaction. In "replay" mode nothing
+    is sent: requests are answered with the recorded responses, matched by
+    method, URL and body. A request made several times gets its recorded
+    responses in order, then the last one again.
+    """
+
+    def __init__(self, path: str, mode: Optional[str] = None):
+        """
+        Initialize the cassette.
+
+        Args:
+            path (str): The cassette file.
+            mode (str): "record" or "replay". By default, an existing cassette
+                is replayed and a missing one is recorded.
+
+        Raises:
+            ValueError: If the mode is unknown or the cassette is not valid.
+        """
+
+        if mode is None:
+            mode = "replay" if os.path.exists(path) else "record"
+        if mode not in ("record", "replay"):
+            raise ValueError("Invalid cassette mode: " + str(mode))
+        self.path = path
+        self.mode = mode
+        self.interactions: List[Dict[str, Any]] = []
+        self._played: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get("version") != CASSETTE_VERSION:
+                raise ValueError("Unsupported cassette: " + path)
+            self.interactions = data["interactions"]
+
+    # End of __init__()
+
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        """
+        Create the cassette configured by API_TOOLS_CASSETTE and
+        API_TOOLS_CASSETTE_MODE, if any.
+
+        Returns:
+            Cassette: The cassette, or None if no path is set.
+        """
+
+        path = os.getenv("API_TOOLS_CASSETTE")
+        if not path:
+            return None
+        return cls(path, os.getenv("API_TOOLS_CASSETTE_MODE") or None)
+
+    # End of from_env()
+
+
+    @staticmethod
+    def request_key(method: str, url: str, body: Any) -> Tuple[str, str, str]:
+        """
+        Return what a request is matched on: its method, URL and body.
+        """
+
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "replace")
+        return method.upper(), url, body or ""
+
+    # End of request_key()
+
+
+    def play(self, method: str, url: str, body: Any) -> Dict[str, Any]:
+        """
+        Return the next recorded interaction of a request.
+
+        Raises:
+            CassetteError: If the request was not recorded.
+        """
+
+        key = self.request_key(method, url, body)
+        with self._lock:
+            matches = [interaction for interaction in self.interactions
+                       if self.request_key(**interaction["request"]) == key]
+            if not matches:
+                raise CassetteError(f"No recorded response for {key[0]} {url} in {self.path}")
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+            return matches[min(played, len(matches) - 1)]
+
+    # End of play()
+
+
+    def record(self, method: str, url: str, body: Any, response: requests.Response,
+               elapsed: float) -> Dict[str, Any]:
+        """
+        Read a response whole, add it to the cassette and save the cassette.
+
+        Args:
+            method (str): The request method.
+            url (str): The request URL.
+            body: The request body.
+            response (requests.Response): The streamed response.
+            elapsed (float): Seconds until the response headers arrived.
+
+        Returns:
+            dict: The recorded interaction.
+        """
+
+        content = response.content
+        headers = [[name, value] for name, value in response.raw.headers.items()
+                   if name.lower() not in _TRANSPORT_HEADERS]
+        headers.append(["Content-Length", str(len(content))])
+        recorded_response = {
+            "status_code": response.status_code,
+            "reason": response.reason,
+            "headers": headers,
+        }
+        try:
+            recorded_response["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            recorded_response["body_base64"] = base64.b64encode(content).decode("ascii")
+        _, _, body = self.request_key(method, url, body)
+        interaction = {
+            "request": {"method": method.upper(), "url": url, "body": body},
+            "response": recorded_response,
+            "elapsed": elapsed,
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+            self.save()
+        return interaction
+
+    # End of record()
+
+
+    def save(self) -> None:
+        """
+        Write the cassette, replacing the file at once.
+        """
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(prefix=".cassette_", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": self.interactions}, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    # End of save()
+
+# End of class Cassette
+
+
+class CassetteAdapter(HTTPAdapter):
+    """
+    A transport adapter recording its traffic to a cassette or replaying it.
+
+    Recorded responses are always returned from the cassette, so a recording
+    run sees exactly what the replays will.
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    # End of __init__()
+
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.cassette.mode == "record":
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            try:
+                interaction = self.cassette.record(request.method, request.url, request.body, response,
+                                                   time.perf_counter() - start)
+            finally:
+                response.close()
+        else:
+            interaction = self.cassette.play(request.method, request.url, request.body)
+        return self.replay(request, interaction)
+
+    # End of send()
+
+
+    def replay(self, request: requests.PreparedRequest, interaction: Dict[str, Any]) -> requests.Response:
+        """
+        Build the streamed response of a recorded interaction.
+        """
+
+        recorded_response = interaction["response"]
+        if "body_base64" in recorded_response:
+            content = base64.b64decode(recorded_response["body_base64"])
+        else:
+            content = recorded_response["body"].encode("utf-8")
+        raw = HTTPResponse(
+            body=io.BytesIO(content),
+            headers=[tuple(header) for header in recorded_response["headers"]],
+            status=recorded_response["status_code"],
+            reason=recorded_response.get("reason"),
+            preload_content=False,
+            request_method=request.method,
+            request_url=request.url,
+        )
+        return self.build_response(request, raw)
+
+    # End of replay()
+
+# End of class CassetteAdapter
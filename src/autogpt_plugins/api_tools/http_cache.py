@@ -0,0 +1,480 @@
+"""HTTP response cache for the API Call command."""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+# Status codes that are cacheable by default (RFC 7231 section 6.1)
+CACHEABLE_STATUS_CODES = {200, 203, 204, 300, 301, 404, 405, 410, 414, 501}
+
+# Heuristic freshness never exceeds a day (RFC 7234 section 4.2.2)
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    Parse a Cache-Control header into its directives.
+
+    Args:
+        value (str): The header value, such as 'max-age=60, must-revalidate'.
+
+    Returns:
+        dict: The lower-cased directive names and their values, or None for
+            directives without a value.
+    """
+
+    directives: Dict[str, Optional[str]] = {}
+    for directive in (value or "").split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+# End of parse_cache_control()
+
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    """
+    Return the timestamp of an HTTP date, or None if it cannot be parsed.
+    """
+
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+# End of parse_http_date()
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    """
+    Return a delta-seconds value, or None if it is not a number.
+    """
+
+    try:
+        return max(0, int(value)) if value is not None else None
+    except ValueError:
+        return None
+
+# End of _seconds()
+
+
+class ResponseCache:
+    """
+    A private HTTP cache for GET and HEAD responses, as described by RFC 7234.
+
+    Entries are kept in an in-memory LRU bounded by a byte budget and, if a
+    directory is given, written to disk so they survive restarts, the least
+    recently used files being removed past a second byte budget. Fresh entries
+    are served without a request; stale entries that have an ETag or a
+    Last-Modified date are revalidated with a conditional request, so a
+    `304 Not Modified` answer avoids downloading the body again.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, directory: Optional[str] = None,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes (int): The byte budget of the in-memory entries.
+            directory (str): The directory of the on-disk store, if any.
+            max_disk_bytes (int): The byte budget of the on-disk store.
+        """
+
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._disk_size = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_entries())
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    # End of __init__()
+
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """
+        Create the cache configured by the environment, if it is enabled.
+
+        The cache is enabled by API_TOOLS_CACHE=True or by setting
+        API_TOOLS_CACHE_DIR, its in-memory budget is API_TOOLS_CACHE_MAX_BYTES
+        and its on-disk budget API_TOOLS_CACHE_DIR_MAX_BYTES.
+
+        Returns:
+            ResponseCache: The cache, or None if it is disabled.
+        """
+
+        enabled = os.getenv("API_TOOLS_CACHE", "False").lower() == "true"
+        directory = os.getenv("API_TOOLS_CACHE_DIR") or None
+        if not enabled and not directory:
+            return None
+        max_bytes = int(os.getenv("API_TOOLS_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+        max_disk_bytes = int(os.getenv("API_TOOLS_CACHE_DIR_MAX_BYTES", str(256 * 1024 * 1024)))
+        return cls(max_bytes, directory, max_disk_bytes)
+
+    # End of from_env()
+
+
+    def lookup(self, method: str, url: str, headers: Mapping[str, str]) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored response of a request, fresh or not.
+
+        Args:
+            method (str): The request method.
+            url (str): The full URL, query string included.
+            headers (dict): The request headers, matched against the stored
+                response's Vary header.
+
+        Returns:
+            dict: The stored response, or None if there is none or the request
+                asks not to use the cache.
+        """
+
+        request_directives = parse_cache_control(_header(headers, "Cache-Control"))
+        if "no-store" in request_directives:
+            return None
+        key = self._key(method, url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None or entry["vary"] != self._vary_values(entry["headers"], headers):
+            self.misses += 1
+            return None
+        return entry
+
+    # End of lookup()
+
+
+    def is_fresh(self, entry: Dict[str, Any], headers: Mapping[str, str]) -> bool:
+        """
+        Return whether a stored response can be served without revalidation,
+        counting a hit if it can.
+
+        Args:
+            entry (dict): A response returned by lookup().
+            headers (dict): The request headers.
+
+        Returns:
+            bool: True if the response is fresh.
+        """
+
+        request_directives = parse_cache_control(_header(headers, "Cache-Control"))
+        response_directives = parse_cache_control(_header(entry["headers"], "Cache-Control"))
+        if "no-cache" in request_directives or "no-cache" in response_directives:
+            return False
+        if _header(headers, "Pragma") == "no-cache":
+            return False
+        age = self._current_age(entry)
+        lifetime = self._freshness_lifetime(entry)
+        max_age = _seconds(request_directives.get("max-age"))
+        if max_age is not None:
+            lifetime = min(lifetime, max_age)
+        if lifetime <= age:
+            return False
+        self.hits += 1
+        return True
+
+    # End of is_fresh()
+
+
+    def conditional_headers(self, entry: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Return the headers revalidating a stored response.
+
+        Args:
+            entry (dict): A response returned by lookup().
+
+        Returns:
+            dict: If-None-Match and If-Modified-Since, for the validators the
+                response has.
+        """
+
+        conditions = {}
+        etag = _header(entry["headers"], "ETag")
+        last_modified = _header(entry["headers"], "Last-Modified")
+        if etag:
+            conditions["If-None-Match"] = etag
+        if last_modified:
+            conditions["If-Modified-Since"] = last_modified
+        return conditions
+
+    # End of conditional_headers()
+
+
+    def store(self, method: str, url: str, request_headers: Mapping[str, str], status_code: int,
+              response_headers: Mapping[str, str], body: str) -> None:
+        """
+        Store a response if it is cacheable.
+
+        Args:
+            method (str): The request method.
+            url (str): The full URL, query string included.
+            request_headers (dict): The request headers.
+            status_code (int): The response status code.
+            response_headers (dict): The response headers.
+            body (str): The response body.
+        """
+
+        request_directives = parse_cache_control(_header(request_headers, "Cache-Control"))
+        response_directives = parse_cache_control(_header(response_headers, "Cache-Control"))
+        if "no-store" in request_directives or "no-store" in response_directives:
+            return
+        if status_code not in CACHEABLE_STATUS_CODES or _header(response_headers, "Vary") == "*":
+            return
+        headers = dict(response_headers)
+        entry = {
+            "url": url,
+            "status_code": status_code,
+            "headers": headers,
+            "body": body,
+            "stored_at": time.time(),
+            "vary": self._vary_values(headers, request_headers),
+        }
+        if self._freshness_lifetime(entry) <= 0 and not self.conditional_headers(entry):
+            # Neither fresh nor revalidatable, it could never be served
+            return
+        key = self._key(method, url)
+        self._remember(key, entry)
+        self._save(key, entry)
+
+    # End of store()
+
+
+    def refresh(self, method: str, url: str, entry: Dict[str, Any], response_headers: Mapping[str, str]) -> None:
+        """
+        Update a stored response after a 304 Not Modified answer.
+
+        Args:
+            method (str): The request method.
+            url (str): The full URL, query string included.
+            entry (dict): The revalidated response returned by lookup().
+            response_headers (dict): The headers of the 304 response.
+        """
+
+        self.revalidations += 1
+        headers = dict(entry["headers"])
+        for name, value in response_headers.items():
+            if name.lower() not in ("content-length", "content-encoding", "transfer-encoding"):
+                headers = {k: v for k, v in headers.items() if k.lower() != name.lower()}
+                headers[name] = value
+        entry = {**entry, "headers": headers, "stored_at": time.time()}
+        key = self._key(method, url)
+        self._remember(key, entry)
+        self._save(key, entry)
+
+    # End of refresh()
+
+
+    def invalidate(self, url: str) -> None:
+        """
+        Forget the stored responses of a URL, after an unsafe request to it.
+
+        Args:
+            url (str): The full URL, query string included.
+        """
+
+        for method in ("GET", "HEAD"):
+            key = self._key(method, url)
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._size -= entry["size"]
+            if self.directory:
+                self._remove_file(self._path(key))
+
+    # End of invalidate()
+
+
+    def _key(self, method: str, url: str) -> str:
+        return hashlib.sha256(f"{method.upper()} {url}".encode("utf-8")).hexdigest()
+
+    # End of _key()
+
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory or "", f"{key}.json")
+
+    # End of _path()
+
+
+    def _vary_values(self, response_headers: Mapping[str, str], request_headers: Mapping[str, str]) -> Dict[str, str]:
+        names = [n.strip().lower() for n in (_header(response_headers, "Vary") or "").split(",") if n.strip()]
+        return {name: _header(request_headers, name) or "" for name in sorted(names)}
+
+    # End of _vary_values()
+
+
+    def _freshness_lifetime(self, entry: Dict[str, Any]) -> float:
+        headers = entry["headers"]
+        directives = parse_cache_control(_header(headers, "Cache-Control"))
+        max_age = _seconds(directives.get("max-age"))
+        if max_age is not None:
+            return max_age
+        date = parse_http_date(_header(headers, "Date")) or entry["stored_at"]
+        if _header(headers, "Expires") is not None:
+            expires = parse_http_date(_header(headers, "Expires"))
+            return expires - date if expires is not None else 0
+        last_modified = parse_http_date(_header(headers, "Last-Modified"))
+        if last_modified is not None and "must-revalidate" not in directives:
+            return min(max(date - last_modified, 0) / 10, MAX_HEURISTIC_LIFETIME)
+        return 0
+
+    # End of _freshness_lifetime()
+
+
+    def _current_age(self, entry: Dict[str, Any]) -> float:
+        headers = entry["headers"]
+        date = parse_http_date(_header(headers, "Date")) or entry["stored_at"]
+        apparent_age = max(0.0, entry["stored_at"] - date)
+        initial_age = max(apparent_age, _seconds(_header(headers, "Age")) or 0)
+        return initial_age + time.time() - entry["stored_at"]
+
+    # End of _current_age()
+
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        size = len(entry["body"].encode("utf-8")) + sum(len(k) + len(v) for k, v in entry["headers"].items())
+        entry["size"] = size
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous["size"]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted["size"]
+
+    # End of _remember()
+
+
+    def _save(self, key: str, entry: Dict[str, Any]) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        size = os.path.getsize(temporary_path)
+        if size > self.max_disk_bytes:
+            os.remove(temporary_path)
+            self._remove_file(path)
+            return
+        try:
+            previous_size = os.path.getsize(path)
+        except OSError:
+            previous_size = 0
+        os.replace(temporary_path, path)
+        with self._lock:
+            self._disk_size += size - previous_size
+            over_budget = self._disk_size > self.max_disk_bytes
+        if over_budget:
+            self._prune_disk()
+
+    # End of _save()
+
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # Files are pruned least recently used first
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    # End of _load()
+
+
+    def _disk_entries(self) -> List[Tuple[float, str, int]]:
+        """
+        Return the modification time, path and size of the stored files.
+        """
+
+        entries = []
+        for dir_entry in os.scandir(self.directory):
+            if dir_entry.name.endswith(".json"):
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, dir_entry.path, stat.st_size))
+        return entries
+
+    # End of _disk_entries()
+
+
+    def _prune_disk(self) -> None:
+        """
+        Remove the least recently used files until the store fits its budget.
+        """
+
+        entries = sorted(self._disk_entries())
+        size = sum(entry_size for _, _, entry_size in entries)
+        for _, path, entry_size in entries:
+            if size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        with self._lock:
+            # Other processes sharing the directory may have changed it too
+            self._disk_size = size
+
+    # End of _prune_disk()
+
+
+    def _remove_file(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._disk_size -= size
+
+    # End of _remove_file()
+
+# End of class ResponseCache
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    """
+    Return a header's value, looked up case-insensitively.
+    """
+
+    value = headers.get(name)
+    if value is not None:
+        return value
+    name = name.lower()
+    return next((v for k, v in headers.items() if k.lower() == name), None)
+
+# End of _header()
@@ -0,0 +1,128 @@
+"""Pagination detection for the API crawler command."""
+
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import urljoin
+
+from requests.utils import parse_header_links
+
+# Fields holding the items of a page, in order of preference
+ITEM_FIELDS = ("data", "items", "results", "records", "entries", "values", "list")
+
+# Fields holding the next page, and the query parameter a token is sent back in
+CURSOR_FIELDS = {
+    "next": "cursor",
+    "next_url": None,
+    "next_page_url": None,
+    "next_link": None,
+    "nextLink": None,
+    "next_page": "page",
+    "nextPage": "page",
+    "next_cursor": "cursor",
+    "nextCursor": "cursor",
+    "next_page_token": "page_token",
+    "nextPageToken": "pageToken",
+}
+
+# Objects the cursor fields may be nested in
+CURSOR_CONTAINERS = ("pagination", "paging", "meta", "links", "_links", "cursor", "cursors")
+
+# A page to request: its URL and query parameters
+NextPage = Tuple[str, Dict[str, Any]]
+
+
+def next_link(headers: Mapping[str, str], url: str) -> Optional[str]:
+    """
+    Return the URL of the next page given by an RFC 5988 Link header.
+
+    Args:
+        headers (dict): The response headers.
+        url (str): The URL of the current page, relative links are resolved
+            against it.
+
+    Returns:
+        str: The absolute URL of the next page, or None.
+    """
+
+    link_header = headers.get("Link") or headers.get("link")
+    if not link_header:
+        return None
+    for link in parse_header_links(link_header):
+        if "next" in link.get("rel", "").lower().split() and link.get("url"):
+            return urljoin(url, link["url"])
+    return None
+
+# End of next_link()
+
+
+def extract_items(data: Any) -> Optional[list]:
+    """
+    Return the items of a page.
+
+    Args:
+        data: The parsed JSON body of the page.
+
+    Returns:
+        list: The page itself if it is a list, or its first list field among
+            ITEM_FIELDS, or its only list field. None if there is none.
+    """
+
+    if isinstance(data, list):
+        return data
+    if not isinstance(data, dict):
+        return None
+    for field in ITEM_FIELDS:
+        if isinstance(data.get(field), list):
+            return data[field]
+    lists = [value for value in data.values() if isinstance(value, list)]
+    return lists[0] if len(lists) == 1 else None
+
+# End of extract_items()
+
+
+def next_page(data: Any, items: list, url: str, params: Dict[str, Any]) -> Optional[NextPage]:
+    """
+    Find the next page from the body of the current page and its parameters.
+
+    A cursor field (see CURSOR_FIELDS) holding a URL is followed, and one
+    holding a token is sent back as a query parameter. Otherwise, Stripe-like
+    `has_more` flags and `page` or `offset` query parameters are advanced.
+
+    Args:
+        data: The parsed JSON body of the current page.
+        items (list): The items of the current page.
+        url (str): The URL of the current page.
+        params (dict): The query parameters of the current page.
+
+    Returns:
+        tuple: The URL and query parameters of the next page, or None if the
+            current page is the last one.
+    """
+
+    if isinstance(data, dict):
+        containers = [data] + [data[c] for c in CURSOR_CONTAINERS if isinstance(data.get(c), dict)]
+        for container in containers:
+            for field, parameter in CURSOR_FIELDS.items():
+                value = container.get(field)
+                if isinstance(value, dict):
+                    value = value.get("href")
+                if value is None or value == "" or isinstance(value, (bool, list, dict)):
+                    continue
+                if parameter is None or (isinstance(value, str) and value.startswith(("http://", "https://", "/", "?"))):
+                    return urljoin(url, str(value)), {}
+                return url, {**params, parameter: str(value)}
+
+        has_more = data.get("has_more", data.get("hasMore"))
+        if has_more is False:
+            return None
+        if has_more and items and isinstance(items[-1], dict) and "id" in items[-1]:
+            return url, {**params, "starting_after": str(items[-1]["id"])}
+
+    if not items:
+        return None
+    if str(params.get("page", "")).isdigit():
+        return url, {**params, "page": str(int(params["page"]) + 1)}
+    if str(params.get("offset", "")).isdigit():
+        return url, {**params, "offset": str(int(params["offset"]) + len(items))}
+    return None
+
+# End of next_page()
@@ -0,0 +1,240 @@
+"""Response projection for the API Call command."""
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, Dict, Optional, Tuple
+
+# A projection tree: the selected fields and the projection of their values,
+# None selecting a value whole
+Projection = Dict[str, Optional["Projection"]]
+
+_TOKEN = re.compile(r'\s*(?:([^\s(),.]+)|([(),.]))')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_WHITESPACE_CHARACTERS = (" ", "\n", "\t", "\r")
+_NESTED = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|([\[{])|[\]}]')
+_SCALAR_END = re.compile(r'[^,\]}\s]*')
+_decoder = json.JSONDecoder()
+
+
+def parse_projection(projection: str) -> Projection:
+    """
+    Parse a projection such as `data(id,name,owner.login),meta.total`.
+
+    The syntax extends the SerpApi plugin's result filter to any depth: a field
+    is followed by the fields to keep in its value between parentheses, and
+    `a.b` is short for `a(b)`. `*` selects every field of an object. Fields of
+    lists apply to each of their items.
+
+    Args:
+        projection (str): The projection.
+
+    Returns:
+        dict: The projection tree.
+
+    Raises:
+        ValueError: If the projection is invalid.
+    """
+
+    tokens = [(name, symbol) for name, symbol in _TOKEN.findall(projection)]
+    if "".join(name + symbol for name, symbol in tokens) != re.sub(r"\s", "", projection):
+        raise ValueError("Invalid projection: " + projection)
+    tree, position = _parse_fields(tokens, 0)
+    if position != len(tokens) or not tree:
+        raise ValueError("Invalid projection: " + projection)
+    return tree
+
+# End of parse_projection()
+
+
+def _parse_fields(tokens: list, position: int) -> Tuple[Projection, int]:
+    """
+    Parse a comma separated list of fields, up to a closing parenthesis.
+    """
+
+    tree: Projection = {}
+    while position < len(tokens):
+        path = []
+        while True:
+            name, symbol = tokens[position] if position < len(tokens) else ("", "")
+            if not name:
+                raise ValueError("Invalid projection: a field name is missing")
+            path.append(name)
+            position += 1
+            if position < len(tokens) and tokens[position][1] == ".":
+                position += 1
+                continue
+            break
+        subtree = None
+        if position < len(tokens) and tokens[position][1] == "(":
+            subtree, position = _parse_fields(tokens, position + 1)
+            if position >= len(tokens) or tokens[position][1] != ")":
+                raise ValueError("Invalid projection: a parenthesis is not closed")
+            position += 1
+        for name in reversed(path[1:]):
+            subtree = {name: subtree}
+        _merge(tree, path[0], subtree)
+        if position < len(tokens) and tokens[position][1] == ",":
+            position += 1
+            continue
+        break
+    return tree, position
+
+# End of _parse_fields()
+
+
+def _merge(tree: Projection, name: str, subtree: Optional[Projection]) -> None:
+    """
+    Add a field to a projection tree, merging it with the same field.
+    """
+
+    if name not in tree:
+        tree[name] = subtree
+    elif tree[name] is not None:
+        if subtree is None:
+            tree[name] = None
+        else:
+            for child, child_tree in subtree.items():
+                _merge(tree[name], child, child_tree)
+
+# End of _merge()
+
+
+def project(data: Any, tree: Optional[Projection]) -> Any:
+    """
+    Apply a projection tree to parsed JSON.
+
+    Args:
+        data: The parsed JSON.
+        tree (dict): The projection tree, or None to keep data whole.
+
+    Returns:
+        The projected data. Scalars are kept as they are.
+    """
+
+    if tree is None:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    wildcard = tree.get("*", False)
+    return {
+        key: project(value, tree[key] if key in tree else wildcard)
+        for key, value in data.items()
+        if key in tree or wildcard is not False
+    }
+
+# End of project()
+
+
+def project_json(text: str, tree: Projection) -> Any:
+    """
+    Parse a JSON document, materializing only the fields a projection selects.
+
+    Unselected values are skipped over without being decoded, and selected
+    values are decoded by the json module's C decoder, so large responses cost
+    little more memory than the projected result.
+
+    Args:
+        text (str): The JSON document.
+        tree (dict): The projection tree.
+
+    Returns:
+        The projected data, as project(json.loads(text), tree) would return it.
+
+    Raises:
+        json.JSONDecodeError: If the document is not valid JSON.
+    """
+
+    value, end = _project_value(text, _skip_whitespace(text, 0), tree)
+    end = _skip_whitespace(text, end)
+    if end != len(text):
+        raise json.JSONDecodeError("Extra data", text, end)
+    return value
+
+# End of project_json()
+
+
+def _skip_whitespace(text: str, index: int) -> int:
+    if text[index:index + 1] not in _WHITESPACE_CHARACTERS:
+        return index
+    return _WHITESPACE.match(text, index).end()
+
+# End of _skip_whitespace()
+
+
+def _project_value(text: str, index: int, tree: Optional[Projection]) -> Tuple[Any, int]:
+    """
+    Decode the projection of the value starting at index, and return its end.
+    """
+
+    if tree is None or index >= len(text) or text[index] not in "{[":
+        return _decoder.raw_decode(text, index)
+
+    if text[index] == "[":
+        items = []
+        index = _skip_whitespace(text, index + 1)
+        if text[index:index + 1] == "]":
+            return items, index + 1
+        while True:
+            item, index = _project_value(text, _skip_whitespace(text, index), tree)
+            items.append(item)
+            index = _skip_whitespace(text, index)
+            if text[index:index + 1] == "]":
+                return items, index + 1
+            if text[index:index + 1] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, index)
+            index += 1
+
+    wildcard = tree.get("*", False)
+    selected = {}
+    index = _skip_whitespace(text, index + 1)
+    if text[index:index + 1] == "}":
+        return selected, index + 1
+    while True:
+        if text[index:index + 1] != '"':
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, index)
+        key, index = scanstring(text, index + 1)
+        index = _skip_whitespace(text, index)
+        if text[index:index + 1] != ":":
+            raise json.JSONDecodeError("Expecting ':' delimiter", text, index)
+        index = _skip_whitespace(text, index + 1)
+        if key in tree or wildcard is not False:
+            selected[key], index = _project_value(text, index, tree[key] if key in tree else wildcard)
+        else:
+            index = _skip_value(text, index)
+        index = _skip_whitespace(text, index)
+        if text[index:index + 1] == "}":
+            return selected, index + 1
+        if text[index:index + 1] != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, index)
+        index = _skip_whitespace(text, index + 1)
+
+# End of _project_value()
+
+
+def _skip_value(text: str, index: int) -> int:
+    """
+    Return the end of the value starting at index, without decoding it.
+    """
+
+    character = text[index:index + 1]
+    if character == '"':
+        return scanstring(text, index + 1)[1]
+    if character not in ("{", "["):
+        end = _SCALAR_END.match(text, index).end()
+        if end == index:
+            raise json.JSONDecodeError("Expecting value", text, index)
+        return end
+    depth = 0
+    for match in _NESTED.finditer(text, index):
+        if match.lastindex:
+            depth += 1
+        elif text[match.start()] != '"':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    raise json.JSONDecodeError("Unterminated value", text, index)
+
+# End of _skip_value()
@@ -0,0 +1,226 @@
+"""Client-side rate limiting for the API Call command."""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+def parse_host_limits(value: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """
+    Parse per-host limits such as `api.github.com=0.5/10,example.com=5`.
+
+    Args:
+        value (str): Comma separated `host=rate` or `host=rate/burst` entries,
+            the rate being in requests per second.
+
+    Returns:
+        dict: The rate and burst of every host. The burst defaults to the
+            rate, and to at least one request.
+
+    Raises:
+        ValueError: If an entry is invalid.
+    """
+
+    limits = {}
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        host, separator, limit = entry.partition("=")
+        rate, _, burst = limit.partition("/")
+        if not separator or not host.strip():
+            raise ValueError("Invalid host rate limit: " + entry)
+        rate_value = float(rate)
+        limits[host.strip().lower()] = (rate_value, float(burst) if burst else max(1.0, rate_value))
+    return limits
+
+# End of parse_host_limits()
+
+
+class TokenBucketLimiter:
+    """
+    Paces requests per host with token buckets.
+
+    Every host has a bucket holding up to `burst` tokens, refilled at `rate`
+    tokens per second, and every request takes a token. A request finding the
+    bucket empty reserves the next token and waits for it, so concurrent
+    requests are spread out instead of retrying in lockstep.
+
+    The buckets are kept in memory, or in a SQLite database shared by every
+    process using the same path.
+    """
+
+    def __init__(self, rate: float = 0.0, burst: Optional[float] = None,
+                 host_limits: Optional[Dict[str, Tuple[float, float]]] = None, path: Optional[str] = None):
+        """
+        Initialize the limiter.
+
+        Args:
+            rate (float): The requests per second of hosts without their own
+                limit, 0 for no limit.
+            burst (float): The requests those hosts get without waiting,
+                the rate (and at least one request) by default.
+            host_limits (dict): The rate and burst of specific hosts. A limit
+                applies to the host and its subdomains.
+            path (str): The SQLite database sharing the buckets between
+                processes, if any.
+        """
+
+        self.rate = max(0.0, rate)
+        self.burst = burst if burst is not None else max(1.0, self.rate)
+        self.host_limits = {host.lower(): limit for host, limit in (host_limits or {}).items()}
+        self.path = path
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._waited: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path:
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS buckets (host TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    # End of __init__()
+
+
+    @classmethod
+    def from_env(cls) -> "TokenBucketLimiter":
+        """
+        Create the limiter configured by API_TOOLS_RATE_LIMIT,
+        API_TOOLS_RATE_BURST, API_TOOLS_HOST_RATE_LIMITS and API_TOOLS_RATE_LIMIT_DB.
+
+        Returns:
+            TokenBucketLimiter: The limiter.
+        """
+
+        burst = os.getenv("API_TOOLS_RATE_BURST")
+        return cls(
+            rate=float(os.getenv("API_TOOLS_RATE_LIMIT", "0")),
+            burst=float(burst) if burst else None,
+            host_limits=parse_host_limits(os.getenv("API_TOOLS_HOST_RATE_LIMITS")),
+            path=os.getenv("API_TOOLS_RATE_LIMIT_DB") or None,
+        )
+
+    # End of from_env()
+
+
+    def limit(self, host: str) -> Optional[Tuple[float, float]]:
+        """
+        Return the rate and burst of a host, or None if it is not limited.
+
+        Args:
+            host (str): The host name, without scheme or port.
+        """
+
+        labels = host.lower().split(".")
+        for i in range(len(labels)):
+            limit = self.host_limits.get(".".join(labels[i:]))
+            if limit is not None:
+                return limit if limit[0] > 0 else None
+        return (self.rate, self.burst) if self.rate > 0 else None
+
+    # End of limit()
+
+
+    def acquire(self, host: str) -> float:
+        """
+        Take a token of a host's bucket, waiting for it if needed.
+
+        Args:
+            host (str): The host name, without scheme or port.
+
+        Returns:
+            float: The seconds waited.
+        """
+
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    # End of acquire()
+
+
+    def reserve(self, host: str) -> float:
+        """
+        Take a token of a host's bucket, without waiting for it.
+
+        Args:
+            host (str): The host name, without scheme or port.
+
+        Returns:
+            float: The seconds to wait before the token is available.
+        """
+
+        limit = self.limit(host)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        host = host.lower()
+        if self.path:
+            wait = self._reserve_shared(host, rate, burst)
+        else:
+            with self._lock:
+                now = time.monotonic()
+                tokens, updated = self._buckets.get(host, (burst, now))
+                tokens = min(burst, tokens + (now - updated) * rate) - 1
+                self._buckets[host] = (tokens, now)
+            wait = -tokens / rate if tokens < 0 else 0.0
+        with self._lock:
+            self._waited[host] = self._waited.get(host, 0.0) + wait
+        return wait
+
+    # End of reserve()
+
+
+    def waited(self, host: str) -> float:
+        """
+        Return the total seconds requests to a host were delayed.
+        """
+
+        with self._lock:
+            return self._waited.get(host.lower(), 0.0)
+
+    # End of waited()
+
+
+    def _reserve_shared(self, host: str, rate: float, burst: float) -> float:
+        """
+        Take a token of a bucket stored in the SQLite database.
+        """
+
+        connection = self._connect()
+        # The write lock is taken first, so no other process reads the bucket
+        # until it is updated
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE host = ?", (host,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate) - 1
+            connection.execute("INSERT OR REPLACE INTO buckets (host, tokens, updated) VALUES (?, ?, ?)",
+                               (host, tokens, now))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return -tokens / rate if tokens < 0 else 0.0
+
+    # End of _reserve_shared()
+
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection to the SQLite database.
+        """
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    # End of _connect()
+
+# End of class TokenBucketLimiter
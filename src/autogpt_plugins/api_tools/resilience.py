@@ -0,0 +1,310 @@
+"""Retry policy and circuit breaker for the API Call command."""
+
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import requests
+
+try:
+    from .http_cache import parse_http_date
+except ImportError:
+    from http_cache import parse_http_date
+
+# Methods that can be repeated without changing the result (RFC 7231 section 4.2.2)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# Statuses worth retrying: throttling and unavailable gateways or servers
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is sent again.
+
+    Delays grow exponentially with full jitter, and a Retry-After header sent
+    with a 429 or 503 response is honored as long as it does not exceed the
+    maximum backoff. Only idempotent methods are retried by default.
+    """
+
+    def __init__(self, max_retries: int = 2, backoff_factor: float = 0.5, max_backoff: float = 30,
+                 methods: Iterable[str] = IDEMPOTENT_METHODS, status_codes: Iterable[int] = RETRY_STATUS_CODES):
+        """
+        Initialize the policy.
+
+        Args:
+            max_retries (int): The number of times a request is sent again.
+            backoff_factor (float): The delay in seconds before the first retry,
+                doubled on every retry.
+            max_backoff (float): The longest delay in seconds between attempts.
+            methods (list): The methods that are retried.
+            status_codes (list): The response statuses that are retried.
+        """
+
+        self.max_retries = max(0, max_retries)
+        self.backoff_factor = max(0.0, backoff_factor)
+        self.max_backoff = max_backoff
+        self.methods = {method.strip().upper() for method in methods}
+        self.status_codes = set(status_codes)
+
+    # End of __init__()
+
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        Create the policy configured by API_TOOLS_MAX_RETRIES,
+        API_TOOLS_RETRY_BACKOFF, API_TOOLS_RETRY_MAX_BACKOFF and
+        API_TOOLS_RETRY_METHODS.
+
+        Returns:
+            RetryPolicy: The policy.
+        """
+
+        methods = os.getenv("API_TOOLS_RETRY_METHODS")
+        return cls(
+            max_retries=int(os.getenv("API_TOOLS_MAX_RETRIES", "2")),
+            backoff_factor=float(os.getenv("API_TOOLS_RETRY_BACKOFF", "0.5")),
+            max_backoff=float(os.getenv("API_TOOLS_RETRY_MAX_BACKOFF", "30")),
+            methods=methods.split(",") if methods else IDEMPOTENT_METHODS,
+        )
+
+    # End of from_env()
+
+
+    def delay(self, method: str, attempt: int, status_code: Optional[int] = None,
+              retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        Return how long to wait before sending a request again.
+
+        Args:
+            method (str): The request method.
+            attempt (int): The number of retries made so far.
+            status_code (int): The response status, or None if the request
+                failed to get a response.
+            retry_after (str): The response's Retry-After header, if any.
+
+        Returns:
+            float: The delay in seconds, or None if the request must not be
+                retried.
+        """
+
+        if attempt >= self.max_retries or method.upper() not in self.methods:
+            return None
+        if status_code is not None and status_code not in self.status_codes:
+            return None
+        if retry_after:
+            wait = _retry_after_seconds(retry_after)
+            if wait is not None:
+                # The server asks for longer than the agent is willing to wait
+                return wait if wait <= self.max_backoff else None
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    # End of delay()
+
+# End of class RetryPolicy
+
+
+def _retry_after_seconds(value: str) -> Optional[float]:
+    """
+    Return the delay of a Retry-After header, given in seconds or as a date.
+    """
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parse_http_date(value)
+    return max(0.0, date - time.time()) if date is not None else None
+
+# End of _retry_after_seconds()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+    """
+
+# End of class CircuitOpenError
+
+
+class CircuitBreaker:
+    """
+    Fails fast on hosts that keep failing.
+
+    After `failure_threshold` consecutive failures (connection errors and 5xx
+    responses) the circuit of a host opens and its requests are rejected
+    without being sent. Once `reset_timeout` seconds have passed, one trial
+    request is let through: the circuit closes again if it succeeds and stays
+    open for another `reset_timeout` if it fails.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        Initialize the breaker.
+
+        Args:
+            failure_threshold (int): The consecutive failures opening a circuit.
+            reset_timeout (float): Seconds before an open circuit is tried again.
+        """
+
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._trial_in_flight: Dict[str, bool] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    # End of __init__()
+
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        """
+        Create the breaker configured by API_TOOLS_CIRCUIT_FAILURES and
+        API_TOOLS_CIRCUIT_RESET_TIMEOUT.
+
+        Returns:
+            CircuitBreaker: The breaker.
+        """
+
+        return cls(
+            failure_threshold=int(os.getenv("API_TOOLS_CIRCUIT_FAILURES", "5")),
+            reset_timeout=float(os.getenv("API_TOOLS_CIRCUIT_RESET_TIMEOUT", "30")),
+        )
+
+    # End of from_env()
+
+
+    def allow(self, host: str) -> bool:
+        """
+        Return whether a request to a host may be sent.
+
+        Args:
+            host (str): The host, as scheme://netloc.
+
+        Returns:
+            bool: False if the host's circuit is open.
+        """
+
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at >= self.reset_timeout and not self._trial_in_flight.get(host):
+                self._trial_in_flight[host] = True
+                return True
+            self._count(host, "rejected")
+            return False
+
+    # End of allow()
+
+
+    def retry_in(self, host: str) -> float:
+        """
+        Return the seconds left before an open circuit lets a trial through.
+        """
+
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+        if opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - opened_at))
+
+    # End of retry_in()
+
+
+    def record_success(self, host: str) -> None:
+        """
+        Record a request that got a response from a healthy host.
+        """
+
+        with self._lock:
+            self._failures[host] = 0
+            self._opened_at.pop(host, None)
+            self._trial_in_flight.pop(host, None)
+
+    # End of record_success()
+
+
+    def record_failure(self, host: str) -> None:
+        """
+        Record a request that failed because of the host.
+        """
+
+        with self._lock:
+            self._count(host, "failures")
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.failure_threshold or self._trial_in_flight.get(host):
+                if host not in self._opened_at or self._trial_in_flight.get(host):
+                    self._count(host, "circuit_opened")
+                self._opened_at[host] = time.monotonic()
+                self._trial_in_flight.pop(host, None)
+
+    # End of record_failure()
+
+
+    def release_trial(self, host: str) -> None:
+        """
+        Record a request that failed for a reason unrelated to the host's
+        health, such as too many redirects, so that the next request to an open
+        circuit can be a trial again.
+        """
+
+        with self._lock:
+            self._trial_in_flight.pop(host, None)
+
+    # End of release_trial()
+
+
+    def record_retry(self, host: str) -> None:
+        """
+        Record a request that is sent again.
+        """
+
+        with self._lock:
+            self._count(host, "retries")
+
+    # End of record_retry()
+
+
+    def get_metrics(self, host: str) -> Dict[str, object]:
+        """
+        Return the counters of a host.
+
+        Returns:
+            dict: The numbers of retries, failures, rejected requests and times
+                the circuit opened, and the state of the circuit: "closed",
+                "open" or "half-open".
+        """
+
+        with self._lock:
+            counters = self._counters.get(host, {})
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                state = "closed"
+            elif self._trial_in_flight.get(host) or time.monotonic() - opened_at >= self.reset_timeout:
+                state = "half-open"
+            else:
+                state = "open"
+            return {
+                "retries": counters.get("retries", 0),
+                "failures": counters.get("failures", 0),
+                "rejected": counters.get("rejected", 0),
+                "circuit_opened": counters.get("circuit_opened", 0),
+                "circuit_state": state,
+            }
+
+    # End of get_metrics()
+
+
+    def _count(self, host: str, counter: str) -> None:
+        counters = self._counters.setdefault(host, {})
+        counters[counter] = counters.get(counter, 0) + 1
+
+    # End of _count()
+
+# End of class CircuitBreaker
@@ -1,17 +1,88 @@
 import json
+import os
 import random
+import re
+import requests
 import requests_mock
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 try:
     from .api_tools import ApiCallCommand
+    from .cassette import Cassette
+    from .http_cache import ResponseCache
+    from .projection import parse_projection, project, project_json
+    from .rate_limit import TokenBucketLimiter, parse_host_limits
+    from .resilience import CircuitBreaker, RetryPolicy
 except ImportError:
     from api_tools import ApiCallCommand
+    from cassette import Cassette
+    from http_cache import ResponseCache
+    from projection import parse_projection, project, project_json
+    from rate_limit import TokenBucketLimiter, parse_host_limits
+    from resilience import CircuitBreaker, RetryPolicy
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """A local HTTP/1.1 endpoint that keeps connections alive."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"path": "%s"}' % self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class SlowHandler(KeepAliveHandler):
+    """A local endpoint that takes a while to answer and records its concurrency."""
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):
+        with SlowHandler.lock:
+            SlowHandler.in_flight += 1
+            SlowHandler.max_in_flight = max(SlowHandler.max_in_flight, SlowHandler.in_flight)
+        time.sleep(0.2)
+        with SlowHandler.lock:
+            SlowHandler.in_flight -= 1
+        super().do_GET()
+
+class EchoHandler(KeepAliveHandler):
+    """A local endpoint that answers POST requests with their body."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
 class TestAutoGPTAPITools(unittest.TestCase):
 
     def setUp(self):
         self.plugin_class = ApiCallCommand()
 
+    def tearDown(self):
+        self.plugin_class.close()
+
+    def start_local_server(self, handler=KeepAliveHandler):
+        """Serve handler on a local port and return the server's URL."""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
     def test_api_call_get(self):
         """Test the self.plugin_class.make_api_call() function with a GET request."""
         with requests_mock.Mocker() as m:
@@ -668,3 +739,600 @@ class TestAutoGPTAPITools(unittest.TestCase):
         with self.assertRaises(ValueError) as excinfo:
             self.plugin_class.make_api_call('http://example.com', '/endpoint', timeout='\x00') # type: ignore
         self.assertIn("timeout_secs must be an integer", str(excinfo.exception))
+
+    def test_api_call_reuses_connections(self):
+        """Test that repeated calls to a host reuse one keep-alive connection."""
+        host = self.start_local_server()
+        for i in range(3):
+            response = json.loads(self.plugin_class.make_api_call(host, f'/item/{i}'))
+            self.assertEqual(response['status_code'], 200)
+            self.assertEqual(json.loads(response['response']), {'path': f'/item/{i}'})
+
+        metrics = self.plugin_class.get_metrics()[host]
+        self.assertEqual(metrics['requests'], 3)
+        self.assertEqual(metrics['connections'], 1)
+        self.assertEqual(metrics['reused_connections'], 2)
+
+    def test_api_call_session_per_host(self):
+        """Test that every host gets its own session, and that idle sessions are closed."""
+        self.plugin_class = ApiCallCommand(idle_timeout=0)
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', text='success')
+            m.get('http://example.org/endpoint', text='success')
+            self.plugin_class.make_api_call('http://example.com', '/endpoint')
+            first = self.plugin_class.get_session('http://example.com/other')
+            self.assertIs(first, self.plugin_class.get_session('http://EXAMPLE.com/'))
+
+            self.plugin_class.make_api_call('http://example.org', '/endpoint')
+            self.assertIsNot(first, self.plugin_class.get_session('http://example.com/'))
+            self.assertEqual(self.plugin_class.get_metrics()['http://example.com']['requests'], 4)
+
+    def test_api_calls_batch(self):
+        """Test the self.plugin_class.make_api_calls() function with concurrent calls to one host."""
+        SlowHandler.max_in_flight = 0
+        host = self.start_local_server(SlowHandler)
+        calls = [{'host': host, 'endpoint': f'/item/{i}'} for i in range(6)]
+
+        start = time.monotonic()
+        results = json.loads(self.plugin_class.make_api_calls(calls, max_concurrency=6, host_concurrency=3))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual([json.loads(r['response'])['path'] for r in results], [f'/item/{i}' for i in range(6)])
+        self.assertEqual(SlowHandler.max_in_flight, 3)
+        self.assertLess(elapsed, 6 * 0.2)
+
+    def test_api_calls_batch_per_item_status(self):
+        """Test that the batch results keep the input order and report errors per call."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/a', text='a')
+            m.post('http://example.org/b', text='b', status_code=201)
+            calls = json.dumps([
+                {'host': 'http://example.com', 'endpoint': '/a'},
+                {'host': 'http://example.com', 'endpoint': '/a', 'method': 'FETCH'},
+                {'host': 'http://example.org', 'endpoint': '/b', 'method': 'post', 'headers': {'X-Test': '1'}},
+                {'host': 'http://example.com', 'verb': 'GET'},
+                'not a call',
+            ])
+            results = json.loads(self.plugin_class.make_api_calls(calls))
+
+        self.assertEqual([r['status'] for r in results], ['success', 'error', 'success', 'error', 'error'])
+        self.assertEqual(results[1]['response'], 'Invalid method: FETCH')
+        self.assertEqual(results[3], {'status': 'error', 'status_code': None,
+                                      'response': 'unknown call argument: verb',
+                                      'error': 'ValueError: unknown call argument: verb'})
+        self.assertEqual(results[4]['response'], 'every call must be a dictionary')
+        self.assertEqual(results[2]['status_code'], 201)
+        self.assertEqual(m.request_history[-1].headers['X-Test'], '1')
+
+    def test_api_calls_batch_bad_input_per_item(self):
+        """Test that calls raising on bad input are reported in their own result without failing the batch."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/a', text='a')
+            results = json.loads(self.plugin_class.make_api_calls([
+                {'host': 'http://example.com', 'endpoint': '/a', 'timeout': [1]},
+                {'host': 'http://example.com', 'endpoint': '/a', 'hdrs': '[1]'},
+                {'host': 'http://example.com', 'endpoint': '/a'},
+            ]))
+
+        self.assertEqual([r['status'] for r in results], ['error', 'error', 'success'])
+        self.assertEqual(results[2]['response'], 'a')
+        for result in results[:2]:
+            self.assertIsNone(result['status_code'])
+            self.assertTrue(result['error'])
+
+    def test_api_calls_batch_invalid(self):
+        """Test the self.plugin_class.make_api_calls() function with invalid call lists."""
+        with self.assertRaises(ValueError) as excinfo:
+            self.plugin_class.make_api_calls('not json')
+        self.assertIn("calls must be a list", str(excinfo.exception))
+        with self.assertRaises(ValueError) as excinfo:
+            self.plugin_class.make_api_calls({'host': 'http://example.com'})
+        self.assertIn("calls must be a list", str(excinfo.exception))
+
+    def test_api_call_cache_fresh_response(self):
+        """Test that a fresh cached GET response is served without a request."""
+        self.plugin_class = ApiCallCommand(cache=ResponseCache())
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', text='cached', headers={'Cache-Control': 'max-age=60'})
+            first = self.plugin_class.make_api_call('http://example.com', '/endpoint', params={'q': 1})
+            second = self.plugin_class.make_api_call('http://example.com', '/endpoint', params={'q': 1})
+            self.plugin_class.make_api_call('http://example.com', '/endpoint', params={'q': 2})
+
+        self.assertEqual(first, second)
+        self.assertEqual(json.loads(second)['response'], 'cached')
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(self.plugin_class.cache.hits, 1)
+
+    def test_api_call_cache_revalidation(self):
+        """Test that stale cached responses are revalidated with their ETag and Last-Modified date."""
+        self.plugin_class = ApiCallCommand(cache=ResponseCache())
+        validators = {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT', 'Cache-Control': 'no-cache'}
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', [
+                {'text': 'body', 'headers': validators},
+                {'status_code': 304, 'headers': {'ETag': '"v1"'}},
+            ])
+            self.plugin_class.make_api_call('http://example.com', '/endpoint')
+            response = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        self.assertEqual(response, {'status': 'success', 'status_code': 200, 'response': 'body'})
+        self.assertEqual(m.request_history[1].headers['If-None-Match'], '"v1"')
+        self.assertEqual(m.request_history[1].headers['If-Modified-Since'], validators['Last-Modified'])
+        self.assertEqual(self.plugin_class.cache.revalidations, 1)
+
+    def test_api_call_cache_on_disk(self):
+        """Test that cached responses are shared through the on-disk store."""
+        with tempfile.TemporaryDirectory() as directory, requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', text='stored', headers={'Expires': 'Thu, 01 Jan 2099 00:00:00 GMT',
+                                                                         'Date': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+            ApiCallCommand(cache=ResponseCache(directory=directory)).make_api_call('http://example.com', '/endpoint')
+            result = ApiCallCommand(cache=ResponseCache(directory=directory)).make_api_call('http://example.com',
+                                                                                             '/endpoint')
+            self.assertEqual(json.loads(result)['response'], 'stored')
+            self.assertEqual(m.call_count, 1)
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_api_call_cache_invalidation(self):
+        """Test that uncacheable responses are not stored and unsafe methods invalidate the cache."""
+        self.plugin_class = ApiCallCommand(cache=ResponseCache())
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/private', text='secret', headers={'Cache-Control': 'no-store, max-age=60'})
+            m.get('http://example.com/item', text='item', headers={'Cache-Control': 'max-age=60'})
+            m.put('http://example.com/item', text='updated')
+            for _ in range(2):
+                self.plugin_class.make_api_call('http://example.com', '/private')
+            self.plugin_class.make_api_call('http://example.com', '/item')
+            self.plugin_class.make_api_call('http://example.com', '/item', mthd='PUT', body='{}')
+            self.plugin_class.make_api_call('http://example.com', '/item')
+
+        self.assertEqual([r.method for r in m.request_history], ['GET', 'GET', 'GET', 'PUT', 'GET'])
+
+    def test_response_cache_byte_budget(self):
+        """Test that the least recently used responses are evicted beyond the byte budget."""
+        cache = ResponseCache(max_bytes=250)
+        headers = {'Cache-Control': 'max-age=60'}
+        for name in ('a', 'b', 'c'):
+            cache.store('GET', f'http://example.com/{name}', {}, 200, headers, name * 100)
+            cache.lookup('GET', 'http://example.com/a', {})
+
+        self.assertIsNotNone(cache.lookup('GET', 'http://example.com/a', {}))
+        self.assertIsNone(cache.lookup('GET', 'http://example.com/b', {}))
+        self.assertIsNotNone(cache.lookup('GET', 'http://example.com/c', {}))
+
+    def test_response_cache_disk_budget(self):
+        """Test that the least recently used files of the on-disk store are removed beyond its byte budget."""
+        headers = {'Cache-Control': 'max-age=60'}
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory=directory)
+            cache.store('GET', 'http://example.com/a', {}, 200, headers, 'a' * 100)
+            file_size = os.path.getsize(os.path.join(directory, os.listdir(directory)[0]))
+
+            cache = ResponseCache(max_bytes=0, directory=directory, max_disk_bytes=file_size * 5 // 2)
+            cache.store('GET', 'http://example.com/b', {}, 200, headers, 'b' * 100)
+            for name, age in (('a', 20), ('b', 10)):
+                path = os.path.join(directory, f"{cache._key('GET', f'http://example.com/{name}')}.json")
+                os.utime(path, (time.time() - age, time.time() - age))
+            self.assertIsNotNone(cache.lookup('GET', 'http://example.com/a', {}))
+            cache.store('GET', 'http://example.com/c', {}, 200, headers, 'c' * 100)
+            # Too large to be stored at all
+            cache.store('GET', 'http://example.com/d', {}, 200, headers, 'd' * file_size * 3)
+
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertIsNotNone(cache.lookup('GET', 'http://example.com/a', {}))
+            self.assertIsNone(cache.lookup('GET', 'http://example.com/b', {}))
+            self.assertIsNotNone(cache.lookup('GET', 'http://example.com/c', {}))
+            self.assertIsNone(cache.lookup('GET', 'http://example.com/d', {}))
+
+    def test_api_call_response_truncated(self):
+        """Test that response bodies are capped and the download stops early."""
+        self.plugin_class = ApiCallCommand(max_response_bytes=11)
+        body = ('é' * 500000).encode('utf-8')
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', content=body,
+                  headers={'Content-Type': 'text/plain; charset=utf-8', 'Content-Length': str(len(body))})
+            response = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        # The incomplete character at the cut is dropped
+        self.assertEqual(response['response'], 'é' * 5)
+        self.assertEqual(response['truncated']['returned_bytes'], 11)
+        self.assertEqual(response['truncated']['content_length'], len(body))
+        self.assertLess(response['truncated']['read_bytes'], len(body))
+        self.assertNotIn('file', response['truncated'])
+
+    def test_api_call_response_not_truncated(self):
+        """Test that bodies within the cap are returned whole and without a summary."""
+        self.plugin_class = ApiCallCommand(max_response_bytes=7)
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', text='success')
+            response = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+        self.assertEqual(response, {'status': 'success', 'status_code': 200, 'response': 'success'})
+
+    def test_api_call_response_spilled_to_file(self):
+        """Test that large response bodies are written whole to the spill directory."""
+        body = json.dumps({'items': list(range(50000))}).encode()
+        with tempfile.TemporaryDirectory() as directory, requests_mock.Mocker() as m:
+            self.plugin_class = ApiCallCommand(max_response_bytes=100, spill_dir=directory)
+            m.get('http://example.com/endpoint', content=body, headers={'Content-Type': 'application/json'})
+            response = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+            summary = response['truncated']
+            self.assertEqual(response['response'], body[:100].decode())
+            self.assertEqual(summary['read_bytes'], len(body))
+            self.assertEqual(os.path.dirname(summary['file']), directory)
+            self.assertTrue(summary['file'].endswith('.json'))
+            with open(summary['file'], 'rb') as f:
+                self.assertEqual(f.read(), body)
+
+    def test_sanitize_string_matches_regex(self):
+        """Test that the translation table removes exactly the characters the original regex removed."""
+        every_character = ''.join(chr(c) for c in range(0x3000)) + '\U0001F600'
+        self.assertEqual(self.plugin_class.sanitize_string(every_character),
+                         re.sub(r'[^a-zA-Z0-9_: -{}[\],"]', '', every_character))
+
+    def test_sanitize_json_fast_path(self):
+        """Test that only strings that may be JSON objects are parsed as JSON."""
+        self.assertEqual(self.plugin_class.sanitize(' {"k|ey": ["v~", 1]}'), '{"key": "[\'v\', 1]"}')
+        self.assertEqual(self.plugin_class.sanitize('{not json|'), '{not json')
+        self.assertEqual(self.plugin_class.sanitize('[1, 2]'), '[1, 2]')
+        self.assertEqual(self.plugin_class.sanitize('42'), '42')
+
+    @patch('time.sleep')
+    def test_api_call_retries_with_retry_after(self, mock_sleep):
+        """Test that throttled idempotent requests are retried after the Retry-After delay."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', [
+                {'status_code': 429, 'headers': {'Retry-After': '2'}},
+                {'status_code': 503},
+                {'text': 'success'},
+            ])
+            response = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        self.assertEqual(response['response'], 'success')
+        self.assertEqual(m.call_count, 3)
+        self.assertEqual(mock_sleep.call_args_list[0].args, (2.0,))
+        self.assertLessEqual(mock_sleep.call_args_list[1].args[0], 1.0)
+        self.assertEqual(self.plugin_class.get_metrics()['http://example.com']['retries'], 2)
+
+    @patch('time.sleep')
+    def test_api_call_retry_limits(self, mock_sleep):
+        """Test that POST requests and too long Retry-After delays are not retried."""
+        with requests_mock.Mocker() as m:
+            m.post('http://example.com/endpoint', status_code=503)
+            m.get('http://example.com/endpoint', status_code=429, headers={'Retry-After': '3600'})
+            post = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint', mthd='POST'))
+            get = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        self.assertEqual((post['status_code'], get['status_code']), (503, 429))
+        self.assertEqual(m.call_count, 2)
+        mock_sleep.assert_not_called()
+
+    @patch('time.sleep')
+    def test_api_call_retries_connection_errors(self, mock_sleep):
+        """Test that connection errors are retried up to the maximum number of retries."""
+        self.plugin_class = ApiCallCommand(retry_policy=RetryPolicy(max_retries=3, backoff_factor=0.1))
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', exc=requests.exceptions.ConnectTimeout('timed out'))
+            response = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        self.assertEqual(response, {'status': 'error', 'status_code': None, 'response': 'timed out'})
+        self.assertEqual(m.call_count, 4)
+        for attempt, call in enumerate(mock_sleep.call_args_list):
+            self.assertLessEqual(call.args[0], 0.1 * 2 ** attempt)
+
+    def test_api_call_circuit_breaker(self):
+        """Test that a failing host's circuit opens, fails fast and closes after a successful trial."""
+        self.plugin_class = ApiCallCommand(retry_policy=RetryPolicy(max_retries=0),
+                                           circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.05))
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', [{'status_code': 500}, {'status_code': 500}, {'text': 'back'}])
+            for _ in range(2):
+                self.plugin_class.make_api_call('http://example.com', '/endpoint')
+            rejected = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+            self.assertEqual(m.call_count, 2)
+            self.assertEqual(rejected['status'], 'error')
+            self.assertIn('Circuit open for http://example.com', rejected['response'])
+            self.assertEqual(self.plugin_class.get_metrics()['http://example.com']['circuit_state'], 'open')
+
+            time.sleep(0.06)
+            trial = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        self.assertEqual(trial['response'], 'back')
+        metrics = self.plugin_class.get_metrics()['http://example.com']
+        self.assertEqual((metrics['circuit_state'], metrics['failures'], metrics['rejected'], metrics['circuit_opened']),
+                         ('closed', 2, 1, 1))
+
+    def test_api_call_circuit_trial_with_other_error(self):
+        """Test that a trial request failing with a non-connection error lets the next request be a trial."""
+        self.plugin_class = ApiCallCommand(retry_policy=RetryPolicy(max_retries=0),
+                                           circuit_breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', [{'status_code': 500},
+                                                  {'exc': requests.exceptions.TooManyRedirects('too many redirects')},
+                                                  {'text': 'back'}])
+            self.plugin_class.make_api_call('http://example.com', '/endpoint')
+            time.sleep(0.06)
+            trial = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+            second_trial = json.loads(self.plugin_class.make_api_call('http://example.com', '/endpoint'))
+
+        self.assertEqual(trial['response'], 'too many redirects')
+        self.assertEqual(second_trial['response'], 'back')
+        self.assertEqual(self.plugin_class.get_metrics()['http://example.com']['circuit_state'], 'closed')
+
+    def test_crawl_api_link_header(self):
+        """Test that the crawler follows RFC 5988 Link headers and merges the pages."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/items', json=[1, 2],
+                  headers={'Link': '<http://example.com/items?page=2>; rel="next", <http://example.com/items?page=3>; rel="last"'})
+            m.get('http://example.com/items?page=2', json=[3, 4], headers={'Link': '</items?page=3>; rel="next"'})
+            m.get('http://example.com/items?page=3', json=[5])
+            result = json.loads(self.plugin_class.crawl_api('http://example.com', '/items'))
+
+        self.assertEqual(result, {'status': 'success', 'pages': 3, 'items': [1, 2, 3, 4, 5], 'next': None})
+
+    def test_crawl_api_cursor_fields(self):
+        """Test that the crawler sends cursor tokens found in the body back as query parameters."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/users', [
+                {'json': {'data': [{'id': 1}], 'meta': {'next_cursor': 'abc'}}},
+                {'json': {'data': [{'id': 2}], 'meta': {'next_cursor': None}}},
+            ])
+            result = json.loads(self.plugin_class.crawl_api('http://example.com', '/users', params={'limit': 1}))
+
+        self.assertEqual(result['items'], [{'id': 1}, {'id': 2}])
+        self.assertEqual(m.request_history[1].qs, {'limit': ['1'], 'cursor': ['abc']})
+
+    def test_crawl_api_page_parameter_and_limits(self):
+        """Test that page parameters are advanced until a limit is reached, and where to continue is returned."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/search', json={'results': ['a', 'b', 'c']})
+            result = json.loads(self.plugin_class.crawl_api('http://example.com', '/search', params={'page': 1},
+                                                            max_items=7))
+
+        self.assertEqual(result['pages'], 3)
+        self.assertEqual(result['items'], ['a', 'b', 'c', 'a', 'b', 'c', 'a'])
+        self.assertEqual(result['next'], {'url': 'http://example.com/search', 'params': {'page': '3'}, 'skip': 1})
+        self.assertEqual([r.qs['page'] for r in m.request_history], [['1'], ['2'], ['3']])
+
+    def test_crawl_api_resumes_within_a_page(self):
+        """Test that a crawl continued from a page cut by max_items returns the rest of that page."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/search', json={'results': ['a', 'b', 'c']})
+            result = json.loads(self.plugin_class.crawl_api('http://example.com', '/search', params={'page': 3},
+                                                            max_pages=2, skip=1))
+
+        self.assertEqual(result['items'], ['b', 'c', 'a', 'b', 'c'])
+        self.assertEqual(result['next'], {'url': 'http://example.com/search', 'params': {'page': '5'}, 'skip': 0})
+        with self.assertRaises(ValueError):
+            self.plugin_class.crawl_api('http://example.com', '/search', skip=-1)
+
+    def test_crawl_api_stops_on_errors_and_other_hosts(self):
+        """Test that the crawler reports failed pages and does not follow links to other hosts."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/a', json={'items': [1], 'next': 'http://evil.example.org/steal'})
+            m.get('http://example.com/b', json={'items': [1], 'next': '/b2'})
+            m.get('http://example.com/b2', status_code=404, text='missing')
+            other_host = json.loads(self.plugin_class.crawl_api('http://example.com', '/a'))
+            failed = json.loads(self.plugin_class.crawl_api('http://example.com', '/b'))
+
+        self.assertEqual((other_host['status'], other_host['items'], other_host['next']), ('success', [1], None))
+        self.assertEqual(failed['status'], 'error')
+        self.assertEqual((failed['status_code'], failed['response'], failed['items']), (404, 'missing', [1]))
+        self.assertNotIn('evil.example.org', [r.hostname for r in m.request_history])
+
+    def test_parse_projection(self):
+        """Test the projection syntax, including dotted paths and merged fields."""
+        self.assertEqual(parse_projection('organic_results(title,link,snippet)'),
+                         {'organic_results': {'title': None, 'link': None, 'snippet': None}})
+        self.assertEqual(parse_projection('data(id, owner.login), data.name, meta.total, *'),
+                         {'data': {'id': None, 'owner': {'login': None}, 'name': None},
+                          'meta': {'total': None}, '*': None})
+        for invalid in ('', 'a(b', 'a..b', 'a,(b)', 'a)b'):
+            with self.assertRaises(ValueError):
+                parse_projection(invalid)
+
+    def test_project_json_matches_project(self):
+        """Test that the skipping parser returns what projecting the fully parsed JSON returns."""
+        document = {
+            'data': [{'id': i, 'name': f'n\\"{i}]', 'owner': {'login': f'u{i}', 'tags': ['{', '}']},
+                      'extra': {'deep': [[i, None, True, 1.5e3]]}} for i in range(20)],
+            'meta': {'total': 20, 'next': None},
+            'empty': {}, 'list': [],
+        }
+        text = json.dumps(document, indent=2)
+        for projection in ('data(id,owner.login)', 'meta', 'data.extra.deep,meta.total', 'empty,list(a),missing',
+                           'data(*),meta(*)', '*(total)'):
+            tree = parse_projection(projection)
+            self.assertEqual(project_json(text, tree), project(document, tree), projection)
+        with self.assertRaises(json.JSONDecodeError):
+            project_json('{"data": [1, 2}', parse_projection('data'))
+
+    def test_project_json_memory(self):
+        """Test that projecting a large response does not materialize the unselected fields."""
+        text = json.dumps({'items': [{'id': i, 'payload': {'values': [f'v{j}' for j in range(50)]}} for i in range(5000)]})
+        tree = parse_projection('items(id)')
+
+        tracemalloc.start()
+        json.loads(text)
+        full_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        tracemalloc.start()
+        projected = project_json(text, tree)
+        projected_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.assertEqual(projected['items'][4999], {'id': 4999})
+        self.assertLess(projected_peak * 5, full_peak)
+
+    def test_api_call_projection(self):
+        """Test the self.plugin_class.make_api_call() function with a projection."""
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/repos', json={'items': [{'name': 'a', 'owner': {'login': 'me', 'id': 1}}],
+                                                    'total_count': 1})
+            m.get('http://example.com/text', text='not json')
+            result = json.loads(self.plugin_class.make_api_call('http://example.com', '/repos',
+                                                                projection='items(name,owner.login)'))
+            text = json.loads(self.plugin_class.make_api_call('http://example.com', '/text', projection='items'))
+
+        self.assertEqual(json.loads(result['response']), {'items': [{'name': 'a', 'owner': {'login': 'me'}}]})
+        self.assertEqual(text['response'], 'not json')
+        self.assertIn('The response is not JSON', text['projection_error'])
+
+    def test_api_call_projection_of_large_response(self):
+        """Test that a projection applies to the body up to its own cap, and the size cap to the projected fields."""
+        self.plugin_class = ApiCallCommand(max_response_bytes=150, max_projection_bytes=2000)
+        document = {'items': [{'id': n, 'description': 'x' * 50} for n in range(10)]}
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/items', json=document)
+            m.get('http://example.com/huge', json={'items': ['x' * 3000]})
+            projected = json.loads(self.plugin_class.make_api_call('http://example.com', '/items',
+                                                                   projection='items(id)'))
+            capped = json.loads(self.plugin_class.make_api_call('http://example.com', '/items', projection='items'))
+            huge = json.loads(self.plugin_class.make_api_call('http://example.com', '/huge', projection='items'))
+            plain = json.loads(self.plugin_class.make_api_call('http://example.com', '/items'))
+
+        self.assertEqual(json.loads(projected['response']), {'items': [{'id': n} for n in range(10)]})
+        self.assertNotIn('truncated', projected)
+        self.assertEqual(len(capped['response']), 150)
+        self.assertEqual(capped['truncated']['returned_bytes'], 150)
+        self.assertGreater(capped['truncated']['projected_bytes'], 600)
+        self.assertIn('larger than the maximum size to project', huge['projection_error'])
+        self.assertEqual((len(huge['response']), huge['truncated']['returned_bytes']), (150, 150))
+        self.assertEqual((len(plain['response']), plain['truncated']['returned_bytes']), (150, 150))
+
+        # The memory used depends on the projection cap, not on the size of the body
+        self.plugin_class = ApiCallCommand(max_response_bytes=150, max_projection_bytes=1024 * 1024)
+        body = json.dumps({'items': [{'id': n, 'description': 'x' * 1000} for n in range(8000)]}).encode()
+        results, peaks = [], []
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/huge', content=body)
+            m.get('http://example.com/items', content=body[:900 * 1024].rsplit(b', {', 1)[0] + b']}')
+            for endpoint in ('/huge', '/items'):
+                tracemalloc.start()
+                results.append(json.loads(self.plugin_class.make_api_call('http://example.com', endpoint,
+                                                                          projection='items(id)')))
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+
+        self.assertIn('larger than the maximum size to project', results[0]['projection_error'])
+        self.assertNotIn('projection_error', results[1])
+        self.assertGreater(results[1]['truncated']['projected_bytes'], 150)
+        for peak in peaks:
+            self.assertLess(peak, 4 * 1024 * 1024)
+
+    def test_api_call_cached_response_capped(self):
+        """Test that a large body cached by a projected call is capped when served to a plain call."""
+        self.plugin_class = ApiCallCommand(max_response_bytes=60, cache=ResponseCache())
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/items', json={'items': ['x' * 100]}, headers={'Cache-Control': 'max-age=60'})
+            self.plugin_class.make_api_call('http://example.com', '/items', projection='items')
+            plain = json.loads(self.plugin_class.make_api_call('http://example.com', '/items'))
+
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(len(plain['response']), 60)
+        self.assertEqual(plain['truncated']['returned_bytes'], 60)
+
+    def test_parse_host_limits(self):
+        """Test the per-host rate limit syntax."""
+        self.assertEqual(parse_host_limits('api.GitHub.com=0.5/10, example.com=5,slow.example.com=0.2'),
+                         {'api.github.com': (0.5, 10.0), 'example.com': (5.0, 5.0), 'slow.example.com': (0.2, 1.0)})
+        with self.assertRaises(ValueError):
+            parse_host_limits('example.com')
+
+    def test_token_bucket_limiter(self):
+        """Test that requests beyond the burst wait for their token, per host and subdomain."""
+        limiter = TokenBucketLimiter(rate=10, burst=2, host_limits={'example.org': (1, 1), 'free.example.org': (0, 0)})
+        with patch('time.monotonic', return_value=100.0):
+            self.assertEqual([limiter.reserve('example.com') for _ in range(4)], [0.0, 0.0, 0.1, 0.2])
+            self.assertEqual([limiter.reserve('api.example.org') for _ in range(2)], [0.0, 1.0])
+            self.assertEqual(limiter.reserve('free.example.org'), 0.0)
+        with patch('time.monotonic', return_value=101.0):
+            # The bucket refilled, up to the burst
+            self.assertEqual([limiter.reserve('example.com') for _ in range(3)], [0.0, 0.0, 0.1])
+        self.assertAlmostEqual(limiter.waited('example.com'), 0.4)
+        self.assertIsNone(TokenBucketLimiter().limit('example.com'))
+
+    def test_token_bucket_limiter_shared_between_processes(self):
+        """Test that limiters using the same database share their buckets."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'limits.db')
+            first = TokenBucketLimiter(rate=1, burst=2, path=path)
+            second = TokenBucketLimiter(rate=1, burst=2, path=path)
+            with patch('time.time', return_value=1000.0):
+                self.assertEqual(first.reserve('example.com'), 0.0)
+                self.assertEqual(second.reserve('example.com'), 0.0)
+                self.assertEqual(first.reserve('example.com'), 1.0)
+                self.assertEqual(second.reserve('example.com'), 2.0)
+            first._connect().close()
+            second._connect().close()
+
+    @patch('time.sleep')
+    def test_api_call_rate_limited(self, mock_sleep):
+        """Test that make_api_call() waits for the host's rate limiter before sending."""
+        self.plugin_class = ApiCallCommand(rate_limiter=TokenBucketLimiter(host_limits={'example.com': (2, 1)}))
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/endpoint', text='success')
+            m.get('http://example.org/endpoint', text='success')
+            for _ in range(2):
+                self.plugin_class.make_api_call('http://example.com', '/endpoint')
+            self.plugin_class.make_api_call('http://example.org', '/endpoint')
+
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertAlmostEqual(mock_sleep.call_args.args[0], 0.5, places=2)
+        self.assertGreater(self.plugin_class.get_metrics()['http://example.com']['rate_limit_wait'], 0.4)
+
+    def test_api_call_cassette_record_and_replay(self):
+        """Test that calls recorded to a cassette are replayed offline with the same results."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.json')
+            server_url = self.start_local_server(EchoHandler)
+            calls = [
+                {'host': server_url, 'endpoint': '/items', 'params': {'page': '2'}},
+                {'host': server_url, 'endpoint': '/items', 'mthd': 'POST', 'body': '{"name": "a"}'},
+            ]
+            recorder = ApiCallCommand(cassette=Cassette(path, 'record'))
+            recorded = [recorder.make_api_call(**call) for call in calls]
+            recorder.close()
+            self.doCleanups()
+
+            self.plugin_class = ApiCallCommand(cassette=Cassette(path))
+            replayed = [self.plugin_class.make_api_call(**call) for call in calls]
+            self.assertEqual(self.plugin_class.cassette.mode, 'replay')
+            self.assertEqual(len(self.plugin_class.cassette.interactions), 2)
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(json.loads(replayed[0])['response'], '{"path": "/items?page=2"}')
+        self.assertEqual(json.loads(replayed[1])['status_code'], 201)
+        self.assertEqual(json.loads(json.loads(replayed[1])['response']), '{"name": "a"}')
+
+    def test_api_call_cassette_replays_in_order(self):
+        """Test that a request recorded several times gets its responses in order, then the last one."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.json')
+            interactions = [
+                {'request': {'method': 'GET', 'url': 'http://example.com/poll', 'body': ''},
+                 'response': {'status_code': 200, 'reason': 'OK', 'headers': [['Content-Type', 'text/plain']],
+                              'body': body},
+                 'elapsed': 0.1}
+                for body in ('pending', 'done')
+            ]
+            with open(path, 'w') as f:
+                json.dump({'version': 1, 'interactions': interactions}, f)
+            self.plugin_class = ApiCallCommand(cassette=Cassette(path, 'replay'))
+            results = [json.loads(self.plugin_class.make_api_call('http://example.com', '/poll'))['response']
+                       for _ in range(3)]
+
+        self.assertEqual(results, ['pending', 'done', 'done'])
+
+    def test_api_call_cassette_unrecorded_request(self):
+        """Test that a request missing from a replayed cassette fails without being sent."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.json')
+            with open(path, 'w') as f:
+                json.dump({'version': 1, 'interactions': []}, f)
+            self.plugin_class = ApiCallCommand(cassette=Cassette(path))
+            response = json.loads(self.plugin_class.make_api_call('http://127.0.0.1:9', '/endpoint'))
+
+        self.assertEqual(response['status'], 'error')
+        self.assertIn('No recorded response for GET http://127.0.0.1:9/endpoint', response['response'])
+        with self.assertRaises(ValueError):
+            Cassette(path, 'rewind')
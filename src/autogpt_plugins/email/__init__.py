@@ -26,9 +26,14 @@ class AutoGPTEmailPlugin(AutoGPTPluginTemplate):
     def post_prompt(self, prompt: PromptGenerator) -> PromptGenerator:
         from .email_plugin.email_plugin import (
             bothEmailAndPwdSet,
+            get_new_emails,
+            read_email_threads,
             read_emails,
+            read_emails_from_folders,
             send_email,
             send_email_with_attachment,
+            send_emails,
+            watch_emails,
         )
 
         if bothEmailAndPwdSet():
@@ -43,6 +48,17 @@ class AutoGPTEmailPlugin(AutoGPTPluginTemplate):
                 },
                 read_emails,
             )
+            prompt.add_command(
+                "Read Emails From Folders",
+                "read_emails_from_folders",
+                {
+                    "imap_folders": "<comma_separated_imap_folders>",
+                    "imap_search_command": "<imap_search_criteria_command>",
+                    "limit": "<email_count_return_limit>",
+                    "page": "<number_of_email_results_page>",
+                },
+                read_emails_from_folders,
+            )
             prompt.add_command(
                 "Send Email",
                 "send_email",
@@ -60,6 +76,41 @@ class AutoGPTEmailPlugin(AutoGPTPluginTemplate):
                 },
                 send_email_with_attachment,
             )
+            prompt.add_command(
+                "Send Emails",
+                "send_emails",
+                {
+                    "emails": "<list of emails with keys to, subject, body and "
+                    "optionally filename>",
+                },
+                send_emails,
+            )
+            prompt.add_command(
+                "Read Email Threads",
+                "read_email_threads",
+                {
+                    "imap_folder": "<imap_folder>",
+                    "imap_search_command": "<imap_search_criteria_command>",
+                    "limit": "<conversation_count_return_limit>",
+                    "page": "<number_of_conversation_results_page>",
+                    "expanded": "<number_of_newest_emails_with_body>",
+                },
+                read_email_threads,
+            )
+            prompt.add_command(
+                "Watch Emails",
+                "watch_emails",
+                {
+                    "imap_folders": "<comma separated imap folders>",
+                },
+                watch_emails,
+            )
+            prompt.add_command(
+                "Get New Emails",
+                "get_new_emails",
+                {},
+                get_new_emails,
+            )
         else:
             print(
                 Fore.RED
@@ -0,0 +1,107 @@
+"""Micro-benchmark of clean_email_body against the previous BeautifulSoup version.
+
+Usage:
+    python benchmark_clean_email_body.py [DIRECTORY_WITH_EML_FILES] [--repeat N]
+
+Without a directory a generated corpus of plain text replies and HTML
+newsletters is used. Every body is checked to produce the same output with
+both implementations before they are timed.
+"""
+import argparse
+import email
+import os
+import re
+import timeit
+from email import policy
+from typing import List
+
+from bs4 import BeautifulSoup
+from email_plugin import clean_email_body
+
+
+def clean_email_body_bs4(email_body):
+    """The BeautifulSoup based clean_email_body this benchmark compares against."""
+    if email_body is None:
+        email_body = ""
+    email_body = BeautifulSoup(email_body, "html.parser").get_text()
+    email_body = "".join(email_body.splitlines())
+    email_body = " ".join(email_body.split())
+    email_body = email_body.encode("ascii", "ignore").decode("utf-8", "ignore")
+    return re.sub(r"http\S+", "", email_body)
+
+
+def load_corpus(directory: str) -> List[str]:
+    """Return the text/plain and text/html parts of every .eml file in directory."""
+    bodies = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(".eml"):
+                continue
+            with open(os.path.join(root, name), "rb") as fp:
+                msg = email.message_from_binary_file(fp, policy=policy.default)
+            for part in msg.walk():
+                if part.get_content_type() in ("text/plain", "text/html"):
+                    try:
+                        bodies.append(part.get_content())
+                    except (LookupError, UnicodeDecodeError):
+                        pass
+    return bodies
+
+
+def generated_corpus() -> List[str]:
+    """Return plain text replies and HTML newsletters of various sizes."""
+    reply = (
+        "Hi team,\n\nThanks for the update, see https://example.com/ticket/42 for "
+        "details.\n\n> On Monday someone wrote:\n> Can we ship this week?\n\n"
+        "Best regards,\nAlex\n"
+    )
+    row = (
+        '<tr><td class="item" style="padding:8px;font-family:Arial">'
+        '<a href="https://example.com/article/{0}?utm_source=news">Headline {0}'
+        "</a><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit &amp; "
+        "sed do eiusmod tempor&nbsp;incididunt&hellip;</p></td></tr>\n"
+    )
+    newsletter = (
+        "<!DOCTYPE html><html><head><title>Weekly digest</title>"
+        "<style>td {{ color: #333; }}</style></head><body>"
+        "<!-- preheader --><table>{rows}</table>"
+        "<script>track();</script><p>Unsubscribe: https://example.com/u</p>"
+        "</body></html>"
+    )
+    corpus = [reply * n for n in (1, 10, 100)]
+    corpus += [
+        newsletter.format(rows="".join(row.format(i) for i in range(n)))
+        for n in (10, 100, 1000)
+    ]
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", help="Directory of .eml files")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.directory) if args.directory else generated_corpus()
+    mismatches = sum(
+        clean_email_body(body) != clean_email_body_bs4(body) for body in corpus
+    )
+    size = sum(len(body) for body in corpus)
+    print(f"{len(corpus)} bodies, {size / 1e6:.1f} MB, {mismatches} mismatches")
+
+    for name, function in (
+        ("BeautifulSoup", clean_email_body_bs4),
+        ("clean_email_body", clean_email_body),
+    ):
+        seconds = min(
+            timeit.repeat(
+                lambda: [function(body) for body in corpus],
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{name:>16}: {seconds * 1000:8.1f} ms ({size / seconds / 1e6:.1f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,35 @@
+import base64
+import binascii
 import email
+import email.policy
+import email.utils
 import imaplib
 import json
+import logging
 import mimetypes
 import os
+import queue
+import quopri
 import re
+import select
 import smtplib
+import sqlite3
+import ssl
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from email.header import decode_header
 from email.message import EmailMessage
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
-from bs4 import BeautifulSoup
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Headers requested by the partial fetch mode, i.e. the ones read_emails returns
+EMAIL_HEADER_FIELDS = "FROM TO DATE CC SUBJECT"
+THREAD_HEADER_FIELDS = "MESSAGE-ID IN-REPLY-TO REFERENCES"
 
 
 def bothEmailAndPwdSet() -> bool:
@@ -69,41 +89,224 @@ def send_email_with_attachment_internal(
 
     msg.set_content(message)
 
+    streamed_msg = None
     if attachment_path:
         ctype, encoding = mimetypes.guess_type(attachment_path)
         if ctype is None or encoding is not None:
             # No guess could be made, or the file is encoded (compressed)
             ctype = "application/octet-stream"
         maintype, subtype = ctype.split("/", 1)
-        with open(attachment_path, "rb") as fp:
-            msg.add_attachment(
-                fp.read(), maintype=maintype, subtype=subtype, filename=attachment
+        threshold = _env_float("EMAIL_ATTACHMENT_STREAMING_THRESHOLD", 1024 * 1024)
+        if _file_size(attachment_path) > threshold:
+            # Encoded from disk while being sent instead of being held in memory
+            streamed_msg = StreamedMimeMessage(
+                msg, attachment_path, maintype, subtype, attachment
             )
+        else:
+            with open(attachment_path, "rb") as fp:
+                msg.add_attachment(
+                    fp.read(), maintype=maintype, subtype=subtype, filename=attachment
+                )
 
     draft_folder = os.getenv("EMAIL_DRAFT_MODE_WITH_FOLDER")
 
     if not draft_folder:
         smtp_host = os.getenv("EMAIL_SMTP_HOST")
         smtp_port = os.getenv("EMAIL_SMTP_PORT")
+
+        def send(smtp: smtplib.SMTP) -> None:
+            if streamed_msg:
+                recipients = [address for _, address in email.utils.getaddresses([to])]
+                smtp_send_chunks(smtp, email_sender, recipients, streamed_msg.chunks())
+            else:
+                smtp.send_message(msg)
+
         # send email
-        with smtplib.SMTP(smtp_host, smtp_port) as smtp:
-            smtp.ehlo()
-            smtp.starttls()
-            smtp.login(email_sender, email_password)
-            smtp.send_message(msg)
-            smtp.quit()
+        smtp_rate_limiter(smtp_host).wait()
+        smtp_pool.run(smtp_host, smtp_port, email_sender, email_password, send)
         return f"Email was sent to {to}!"
     else:
-        conn = imap_open(draft_folder, email_sender, email_password)
-        conn.append(
-            draft_folder,
-            "",
-            imaplib.Time2Internaldate(time.time()),
-            str(msg).encode("UTF-8"),
-        )
+
+        def append(conn: imaplib.IMAP4_SSL) -> None:
+            date_time = imaplib.Time2Internaldate(time.time())
+            if streamed_msg:
+                imap_append_chunks(
+                    conn,
+                    draft_folder,
+                    date_time,
+                    streamed_msg.chunks(),
+                    streamed_msg.size,
+                )
+            else:
+                conn.append(draft_folder, "", date_time, str(msg).encode("UTF-8"))
+
+        # A retried APPEND could store the draft twice
+        imap_pool.run(draft_folder, email_sender, email_password, append, retry=False)
         return f"Email went to {draft_folder}!"
 
 
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        # Let opening the file report the error
+        return 0
+
+
+class StreamedMimeMessage:
+    """An email with one attachment that is base64 encoded from disk in chunks.
+
+    Only the headers and text part are serialized up front, so memory use stays
+    bounded by `CHUNK_SIZE` regardless of the size of the attachment, and the
+    exact size of the serialized email is known before it is sent.
+    """
+
+    # Whole 76 character base64 lines
+    CHUNK_SIZE = 57 * 1024
+
+    def __init__(
+        self,
+        msg: EmailMessage,
+        attachment_path: str,
+        maintype: str,
+        subtype: str,
+        filename: str,
+    ):
+        msg.add_attachment(b"", maintype=maintype, subtype=subtype, filename=filename)
+        serialized = msg.as_bytes(policy=email.policy.SMTP)
+        self._closing = b"\r\n--%s--\r\n" % msg.get_boundary().encode("ascii")
+        # The empty attachment body sits right before the closing boundary
+        self._head = serialized[: -len(self._closing)]
+        self._attachment_path = attachment_path
+
+        attachment_size = os.path.getsize(attachment_path)
+        full_lines, rest = divmod(attachment_size, 57)
+        encoded_size = full_lines * 78 + (4 * -(-rest // 3) + 2 if rest else 0)
+        self.size = len(self._head) + encoded_size + len(self._closing)
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yield the serialized email, with CRLF line endings, in chunks of whole
+        lines."""
+        yield self._head
+        with open(self._attachment_path, "rb") as fp:
+            while True:
+                data = fp.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                yield base64.encodebytes(data).replace(b"\n", b"\r\n")
+        yield self._closing
+
+
+def smtp_send_chunks(
+    smtp: smtplib.SMTP, from_addr: str, to_addrs: List[str], chunks: Iterator[bytes]
+) -> Dict[str, Tuple[int, bytes]]:
+    """Send an email given as chunks of whole CRLF terminated lines, like
+    `smtplib.SMTP.sendmail` does for a complete email.
+
+    Returns:
+        Dict[str, Tuple[int, bytes]]: The refused recipients, as `sendmail` does.
+    """
+    smtp.ehlo_or_helo_if_needed()
+    code, resp = smtp.mail(from_addr)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for to_addr in to_addrs:
+        code, resp = smtp.rcpt(to_addr)
+        if code not in (250, 251):
+            refused[to_addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, resp = smtp.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in chunks:
+        # Dot-stuffing, chunks always start at the beginning of a line
+        if chunk.startswith(b"."):
+            chunk = b"." + chunk
+        smtp.send(chunk.replace(b"\r\n.", b"\r\n.."))
+    smtp.send(b".\r\n")
+    code, resp = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+def imap_append_chunks(
+    conn: imaplib.IMAP4_SSL,
+    mailbox: str,
+    date_time: str,
+    chunks: Iterator[bytes],
+    size: int,
+) -> Tuple[str, list]:
+    """APPEND an email of `size` bytes given as chunks, like `IMAP4.append` does
+    for a complete email, by sending the literal chunk by chunk."""
+    tag = conn._new_tag()
+    command = b"%s APPEND %s %s {%d}" % (
+        tag,
+        mailbox.encode(conn._encoding),
+        date_time.encode(conn._encoding),
+        size,
+    )
+    try:
+        conn.send(command + imaplib.CRLF)
+        # Wait for the continuation response
+        while conn._get_response():
+            if conn.tagged_commands[tag]:
+                return conn._command_complete("APPEND", tag)
+        for chunk in chunks:
+            conn.send(chunk)
+        conn.send(imaplib.CRLF)
+    except OSError as e:
+        raise conn.abort(f"socket error: {e}")
+    return conn._command_complete("APPEND", tag)
+
+
+def send_emails(emails) -> List[dict]:
+    """Send several emails, reusing pooled SMTP connections.
+
+    The emails are sent by up to EMAIL_SMTP_MAX_CONNECTIONS workers, each sending
+    its share of the emails over one pooled connection, and paced by the per
+    server EMAIL_SMTP_RATE_LIMIT.
+
+    Args:
+        emails (list | str): The emails to send, as a list (or a JSON encoded list)
+            of objects with the keys `to`, `subject`, `body` and optionally
+            `filename`, or of `[to, subject, body, filename]` lists.
+
+    Returns:
+        List[dict]: The status of every email, in the order they were given.
+    """
+    if isinstance(emails, str):
+        emails = json.loads(emails)
+
+    def send(item: Any) -> dict:
+        if isinstance(item, dict):
+            to = item.get("to")
+            subject = item.get("subject", "")
+            body = item.get("body", "")
+            filename = item.get("filename")
+        else:
+            to, subject, body, filename = (list(item) + [None])[:4]
+        status = {"to": to, "subject": subject}
+        try:
+            if filename:
+                result = send_email_with_attachment(to, subject, body, filename)
+            else:
+                result = send_email(to, subject, body)
+        except Exception as e:
+            return {**status, "status": "error", "result": f"Error: {e}"}
+        return {**status, "status": "sent", "result": result}
+
+    if not emails:
+        return []
+    max_workers = int(_env_float("EMAIL_SMTP_MAX_CONNECTIONS", 1))
+    max_workers = max(1, min(max_workers, len(emails)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(send, emails))
+
+
 def read_emails(
         imap_folder: str = "inbox", imap_search_command: str = "UNSEEN", limit: int = 5,
         page: int = 1) -> str:
@@ -128,12 +331,253 @@ def read_emails(
     imap_search_ar = split_imap_search_command(imap_search_command)
     email_password = getPwd()
 
+    messages = _read_folder_emails(
+        imap_folder, imap_search_ar, email_sender, email_password, limit, page
+    )
+    if not messages:
+        return (
+            f"There are no Emails in your folder `{imap_folder}` "
+            f"when searching with imap command `{imap_search_command}`"
+        )
+    return messages
+
+
+def read_emails_from_folders(
+    imap_folders: str = "inbox",
+    imap_search_command: str = "UNSEEN",
+    limit: int = 5,
+    page: int = 1,
+) -> str:
+    """Read emails from several IMAP folders at once.
+
+    The folders are searched in parallel, each on its own pooled IMAP connection,
+    and the results are merged by their Date header before `limit` and `page` are
+    applied, so the first page holds the newest emails of all folders. Only the
+    emails of that page are then fetched, and marked as seen if
+    EMAIL_MARK_AS_SEEN is set.
+
+    Args:
+        imap_folders (str, optional): Comma separated names of the IMAP folders to
+            read emails from. Defaults to "inbox".
+        imap_search_command (str, optional): The IMAP search command to filter
+            emails. Defaults to "UNSEEN".
+        limit (int, optional): Number of emails to return. Defaults to 5 emails.
+        page (int, optional): The index of the page to return. Defaults to 1, the
+            first page.
+
+    Returns:
+        str: A list of dictionaries containing email details, including the folder
+             each email was found in, oldest first, if there are any matching
+             emails. Otherwise, returns a string indicating that no matching emails
+             were found.
+    """
+    email_sender = getSender()
+    email_password = getPwd()
+    imap_search_ar = split_imap_search_command(imap_search_command)
+    folders = [
+        enclose_with_quotes(adjust_imap_folder_for_gmail(folder.strip(), email_sender))
+        for folder in imap_folders.split(",")
+        if folder.strip()
+    ]
+
+    limit = int(limit)
+    page = int(page)
+    if limit < 1:
+        raise ValueError("Error: The message limit should be 1 or greater")
+    if page < 1:
+        raise ValueError("Error: The page value references a page that is not part of the results")
+
     mark_as_seen = os.getenv("EMAIL_MARK_AS_SEEN")
     if isinstance(mark_as_seen, str):
         mark_as_seen = json.loads(mark_as_seen.lower())
+    partial_fetch = os.getenv("EMAIL_FETCH_MODE", "full").lower() == "partial"
+    cache = get_email_cache()
+    account = f"{os.getenv('EMAIL_IMAP_SERVER')}:{email_sender}"
+
+    def search(folder: str) -> Tuple[Optional[int], List[Tuple[float, bytes]]]:
+        return imap_pool.run(
+            folder,
+            email_sender,
+            email_password,
+            lambda conn: _search_folder_dates(
+                conn, cache, account, folder, imap_search_ar, page * limit
+            ),
+        )
+
+    def fetch(folder: str, uids: List[bytes]) -> Dict[int, dict]:
+        def fetch_emails(conn: imaplib.IMAP4_SSL) -> Dict[int, dict]:
+            if cache:
+                return _fetch_cached_emails(
+                    conn,
+                    cache,
+                    account,
+                    folder,
+                    searches[folder][0],
+                    uids,
+                    mark_as_seen,
+                    partial_fetch,
+                )
+            fetch_uids = _fetch_partial_emails if partial_fetch else _fetch_full_emails
+            return fetch_uids(conn, uids, mark_as_seen, use_uid=True)
+
+        return imap_pool.run(folder, email_sender, email_password, fetch_emails)
+
+    # Every folder contributes the dates of at most its `page * limit` newest
+    # emails, and only the emails of the merged page are fetched, so no other
+    # email is downloaded or marked as seen
+    max_workers = int(_env_float("EMAIL_IMAP_MAX_CONNECTIONS", 4))
+    max_workers = max(1, min(max_workers, len(folders)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        searches = dict(zip(folders, executor.map(search, folders)))
+        dates = [
+            (timestamp, folder, uid)
+            for folder, (_, folder_dates) in searches.items()
+            for timestamp, uid in folder_dates
+        ]
+        if not dates:
+            return (
+                f"There are no Emails in your folders `{', '.join(folders)}` "
+                f"when searching with imap command `{imap_search_command}`"
+            )
+        if len(dates) <= (page - 1) * limit:
+            raise ValueError("Error: The page value references a page that is not part of the results")
+
+        dates.sort(key=lambda date: date[0], reverse=True)
+        page_dates = dates[(page - 1) * limit : page * limit][::-1]
+        page_uids: Dict[str, List[bytes]] = {}
+        for _, folder, uid in page_dates:
+            page_uids.setdefault(folder, []).append(uid)
+        fetched = dict(
+            zip(page_uids, executor.map(fetch, page_uids, page_uids.values()))
+        )
+
+    return [
+        {**fetched[folder][int(uid)], "Folder": folder}
+        for _, folder, uid in page_dates
+        if int(uid) in fetched[folder]
+    ]
+
+
+def read_email_threads(
+    imap_folder: str = "inbox",
+    imap_search_command: str = "UNSEEN",
+    limit: int = 5,
+    page: int = 1,
+    expanded: int = 1,
+) -> str:
+    """Read the emails of an IMAP folder grouped by conversation.
+
+    Matching emails are grouped with the server's THREAD=REFERENCES extension
+    when it is available, or locally from their Message-ID, In-Reply-To and
+    References headers otherwise. Only the bodies of the newest `expanded` emails
+    of every conversation are fetched, the other emails only have their headers.
 
-    conn = imap_open(imap_folder, email_sender, email_password)
+    Args:
+        imap_folder (str, optional): The name of the IMAP folder to read emails
+            from. Defaults to "inbox".
+        imap_search_command (str, optional): The IMAP search command to filter
+            emails. Defaults to "UNSEEN".
+        limit (int, optional): Number of conversations to return. Defaults to 5.
+        page (int, optional): The index of the page to return, the first page
+            holding the conversations with the newest emails. Defaults to 1.
+        expanded (int, optional): Number of emails per conversation, newest first,
+            returned with their message body. Defaults to 1.
 
+    Returns:
+        str: A list of dictionaries with the subject, number of emails and emails
+             of every conversation, oldest first, if there are any matching
+             emails. Otherwise, returns a string indicating that no matching
+             emails were found.
+    """
+    email_sender = getSender()
+    imap_folder = adjust_imap_folder_for_gmail(imap_folder, email_sender)
+    imap_folder = enclose_with_quotes(imap_folder)
+    imap_search_ar = split_imap_search_command(imap_search_command)
+    email_password = getPwd()
+
+    mark_as_seen = os.getenv("EMAIL_MARK_AS_SEEN")
+    if isinstance(mark_as_seen, str):
+        mark_as_seen = json.loads(mark_as_seen.lower())
+    partial_fetch = os.getenv("EMAIL_FETCH_MODE", "full").lower() == "partial"
+
+    threads = imap_pool.run(
+        imap_folder,
+        email_sender,
+        email_password,
+        lambda conn: _search_and_fetch_threads(
+            conn,
+            imap_search_ar,
+            mark_as_seen,
+            int(limit),
+            int(page),
+            int(expanded),
+            partial_fetch,
+        ),
+    )
+    if not threads:
+        return (
+            f"There are no Emails in your folder `{imap_folder}` "
+            f"when searching with imap command `{imap_search_command}`"
+        )
+    return threads
+
+
+def _email_timestamp(message: Any) -> float:
+    """Return the timestamp of the Date of an email or its headers, 0 if unknown."""
+    date = message.get("Date")
+    parsed = email.utils.parsedate_tz(date) if date else None
+    return email.utils.mktime_tz(parsed) if parsed else 0.0
+
+
+def _read_folder_emails(
+    imap_folder: str,
+    imap_search_ar: List[str],
+    email_sender: str,
+    email_password: str,
+    limit: int,
+    page: int,
+) -> List[dict]:
+    mark_as_seen = os.getenv("EMAIL_MARK_AS_SEEN")
+    if isinstance(mark_as_seen, str):
+        mark_as_seen = json.loads(mark_as_seen.lower())
+
+    partial_fetch = os.getenv("EMAIL_FETCH_MODE", "full").lower() == "partial"
+
+    cache = get_email_cache()
+    if cache:
+        account = f"{os.getenv('EMAIL_IMAP_SERVER')}:{email_sender}"
+
+        def search_and_fetch(conn: imaplib.IMAP4_SSL) -> List[dict]:
+            return _search_and_fetch_cached_emails(
+                conn,
+                cache,
+                account,
+                imap_folder,
+                imap_search_ar,
+                mark_as_seen,
+                limit,
+                page,
+                partial_fetch,
+            )
+
+    else:
+
+        def search_and_fetch(conn: imaplib.IMAP4_SSL) -> List[dict]:
+            return _search_and_fetch_emails(
+                conn, imap_search_ar, mark_as_seen, limit, page, partial_fetch
+            )
+
+    return imap_pool.run(imap_folder, email_sender, email_password, search_and_fetch)
+
+
+def _search_and_fetch_emails(
+    conn: imaplib.IMAP4_SSL,
+    imap_search_ar: List[str],
+    mark_as_seen: bool,
+    limit: int,
+    page: int,
+    partial_fetch: bool = False,
+) -> List[dict]:
     imap_keyword = imap_search_ar[0]
     if len(imap_search_ar) == 1:
         _, search_data = conn.search(None, imap_keyword)
@@ -141,62 +585,700 @@ def read_emails(
         argument = enclose_with_quotes(imap_search_ar[1])
         _, search_data = conn.search(None, imap_keyword, argument)
 
-    messages = []
-    for num in search_data[0].split():
-        if mark_as_seen:
-            message_parts = "(RFC822)"
-        else:
-            message_parts = "(BODY.PEEK[])"
-        _, msg_data = conn.fetch(num, message_parts)
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                
-                # If the subject has unknown encoding, return blank
-                if msg["Subject"] is not None:
-                    subject, encoding = decode_header(msg["Subject"])[0]
-                else:
-                    subject = ""
-                    encoding = ""
-
-
-                if isinstance(subject, bytes):
-                    try:
-                        # If the subject has unknown encoding, return blank
-                        if encoding is not None:
-                            subject = subject.decode(encoding)
-                        else:
-                            subject = ""
-                    except [LookupError] as e:
-                        pass
+    message_ids = search_data[0].split()
+    if not message_ids:
+        return []
+
+    # Only the requested page is fetched, in a single round trip
+    page_ids = paginate_message_ids(message_ids, limit, page)
+    fetch_emails = _fetch_partial_emails if partial_fetch else _fetch_full_emails
+    messages = fetch_emails(conn, page_ids, mark_as_seen)
+    # Servers may answer a batched FETCH in any order
+    return [messages[key] for key in sorted(messages)]
+
+
+def _search_and_fetch_cached_emails(
+    conn: imaplib.IMAP4_SSL,
+    cache: "EmailCache",
+    account: str,
+    imap_folder: str,
+    imap_search_ar: List[str],
+    mark_as_seen: bool,
+    limit: int,
+    page: int,
+    partial_fetch: bool = False,
+) -> List[dict]:
+    """Like `_search_and_fetch_emails`, but by UID and through the `EmailCache`.
+
+    Only the emails of the requested page that are not cached yet are fetched.
+    If the server supports CONDSTORE, searches on flags alone (e.g. `UNSEEN`)
+    are answered from the synced flags without a SEARCH round trip.
+    """
+    uidvalidity, uids = _search_cached_uids(
+        conn, cache, account, imap_folder, imap_search_ar
+    )
+    if not uids:
+        return []
+
+    page_uids = paginate_message_ids(uids, limit, page)
+    messages = _fetch_cached_emails(
+        conn,
+        cache,
+        account,
+        imap_folder,
+        uidvalidity,
+        page_uids,
+        mark_as_seen,
+        partial_fetch,
+    )
+    return [messages[int(uid)] for uid in page_uids if int(uid) in messages]
 
-                body = get_email_body(msg)
-                # Clean email body
-                body = clean_email_body(body)
-
-                from_address = msg["From"]
-                to_address = msg["To"]
-                date = msg["Date"]
-                cc = msg["CC"] if msg["CC"] else ""
-
-                messages.append(
-                    {
-                        "From": from_address,
-                        "To": to_address,
-                        "Date": date,
-                        "CC": cc,
-                        "Subject": subject,
-                        "Message Body": body,
-                    }
-                )
 
-    conn.logout()
-    if not messages:
-        return (
-            f"There are no Emails in your folder `{imap_folder}` "
-            f"when searching with imap command `{imap_search_command}`"
+def _search_cached_uids(
+    conn: imaplib.IMAP4_SSL,
+    cache: "EmailCache",
+    account: str,
+    imap_folder: str,
+    imap_search_ar: List[str],
+) -> Tuple[int, List[bytes]]:
+    """Sync the folder's cache and return its UIDVALIDITY and the matching UIDs."""
+    uidvalidity, flags_synced = sync_folder(conn, cache, account, imap_folder)
+
+    uids = None
+    if flags_synced and len(imap_search_ar) == 1:
+        uids = cache.search_flags(account, imap_folder, uidvalidity, imap_search_ar[0])
+    if uids is None:
+        uids = _uid_search(conn, imap_search_ar)
+    return uidvalidity, uids
+
+
+def _uid_search(conn: imaplib.IMAP4_SSL, imap_search_ar: List[str]) -> List[bytes]:
+    """Return the UIDs matching a search, oldest first."""
+    if len(imap_search_ar) == 1:
+        _, search_data = conn.uid("SEARCH", imap_search_ar[0])
+    else:
+        argument = enclose_with_quotes(imap_search_ar[1])
+        _, search_data = conn.uid("SEARCH", imap_search_ar[0], argument)
+    return sorted(search_data[0].split(), key=int)
+
+
+def _fetch_cached_emails(
+    conn: imaplib.IMAP4_SSL,
+    cache: "EmailCache",
+    account: str,
+    imap_folder: str,
+    uidvalidity: int,
+    uids: List[bytes],
+    mark_as_seen: bool,
+    partial_fetch: bool = False,
+) -> Dict[int, dict]:
+    """Return the emails of `uids`, fetching and caching the ones not cached yet."""
+    # Emails read with another fetch mode or body cap are fetched again
+    fetch_mode = "full"
+    if partial_fetch:
+        fetch_mode = f"partial:{int(os.getenv('EMAIL_BODY_MAX_BYTES') or 0)}"
+    messages = cache.get_messages(account, imap_folder, uidvalidity, uids, fetch_mode)
+    cached_uids = [uid for uid in uids if int(uid) in messages]
+    missing_uids = [uid for uid in uids if int(uid) not in messages]
+
+    if missing_uids:
+        fetch_emails = _fetch_partial_emails if partial_fetch else _fetch_full_emails
+        fetched = fetch_emails(conn, missing_uids, mark_as_seen, use_uid=True)
+        cache.store_messages(account, imap_folder, uidvalidity, fetched, fetch_mode)
+        messages.update(fetched)
+    if mark_as_seen and cached_uids:
+        conn.uid("STORE", imap_message_set(cached_uids), "+FLAGS", "(\\Seen)")
+    return messages
+
+
+def _search_folder_dates(
+    conn: imaplib.IMAP4_SSL,
+    cache: Optional["EmailCache"],
+    account: str,
+    imap_folder: str,
+    imap_search_ar: List[str],
+    limit: int,
+) -> Tuple[Optional[int], List[Tuple[float, bytes]]]:
+    """Return the dates of the `limit` newest emails of a folder matching a search.
+
+    Only the Date header is fetched, without setting the \\Seen flag.
+
+    Returns:
+        Tuple[Optional[int], List[Tuple[float, bytes]]]: The folder's UIDVALIDITY
+            if `cache` is used, and the timestamp and UID of the emails, oldest
+            first.
+    """
+    uidvalidity = None
+    if cache:
+        uidvalidity, uids = _search_cached_uids(
+            conn, cache, account, imap_folder, imap_search_ar
+        )
+    else:
+        uids = _uid_search(conn, imap_search_ar)
+    if not uids:
+        return uidvalidity, []
+    uids = paginate_message_ids(uids, limit, 1)
+
+    responses = _fetch_responses(conn, uids, "(BODY.PEEK[HEADER.FIELDS (DATE)])", True)
+    dates = []
+    for uid in uids:
+        header = _fetch_item(responses.get(int(uid), {}), b"BODY[HEADER") or b""
+        dates.append((_email_timestamp(email.message_from_bytes(header)), uid))
+    return uidvalidity, dates
+
+
+def _search_and_fetch_threads(
+    conn: imaplib.IMAP4_SSL,
+    imap_search_ar: List[str],
+    mark_as_seen: bool,
+    limit: int,
+    page: int,
+    expanded: int,
+    partial_fetch: bool = False,
+) -> List[dict]:
+    search_args = list(imap_search_ar[:1])
+    if len(imap_search_ar) > 1:
+        search_args.append(enclose_with_quotes(imap_search_ar[1]))
+
+    headers: Dict[int, email.message.Message] = {}
+    if "THREAD=REFERENCES" in getattr(conn, "capabilities", ()):
+        _, thread_data = conn.uid("THREAD", "REFERENCES", "UTF-8", *search_args)
+        threads = parse_thread_response(thread_data)
+    else:
+        _, search_data = conn.uid("SEARCH", *search_args)
+        uids = search_data[0].split()
+        if not uids:
+            return []
+        # The headers are fetched once, for grouping and for the collapsed emails
+        header_fields = f"{EMAIL_HEADER_FIELDS} {THREAD_HEADER_FIELDS}"
+        responses = _fetch_responses(
+            conn, uids, f"(BODY.PEEK[HEADER.FIELDS ({header_fields})])", True
+        )
+        headers = {
+            uid: email.message_from_bytes(_fetch_item(items, b"BODY[HEADER") or b"")
+            for uid, items in responses.items()
+        }
+        threads = group_by_references(headers)
+    if not threads:
+        return []
+
+    # Conversations are ordered by their newest email, like the emails of a page
+    threads.sort(key=max)
+    page_threads = paginate_message_ids(threads, limit, page)
+
+    expanded = max(expanded, 0)
+    expanded_uids, collapsed_uids = [], []
+    for thread in page_threads:
+        split = max(len(thread) - expanded, 0)
+        collapsed_uids += thread[:split]
+        expanded_uids += thread[split:]
+
+    messages: Dict[int, dict] = {}
+    if expanded_uids:
+        fetch_emails = _fetch_partial_emails if partial_fetch else _fetch_full_emails
+        messages.update(
+            fetch_emails(
+                conn, [b"%d" % uid for uid in expanded_uids], mark_as_seen, True
+            )
         )
+    missing_uids = [b"%d" % uid for uid in collapsed_uids if uid not in headers]
+    if missing_uids:
+        responses = _fetch_responses(
+            conn,
+            missing_uids,
+            f"(BODY.PEEK[HEADER.FIELDS ({EMAIL_HEADER_FIELDS})])",
+            True,
+        )
+        for uid, items in responses.items():
+            header = _fetch_item(items, b"BODY[HEADER") or b""
+            headers[uid] = email.message_from_bytes(header)
+    for uid in collapsed_uids:
+        if uid in headers:
+            # Collapsed emails are listed without their message body
+            messages[uid] = _email_details(headers[uid], "")
+            del messages[uid]["Message Body"]
+
+    conversations = []
+    for thread in page_threads:
+        emails = [messages[uid] for uid in thread if uid in messages]
+        if emails:
+            conversations.append(
+                {
+                    "Subject": emails[0]["Subject"],
+                    "Email Count": len(thread),
+                    "Emails": emails,
+                }
+            )
+    return conversations
+
+
+def parse_thread_response(thread_data: list) -> List[List[int]]:
+    """Parse the data imaplib returns for a THREAD command.
+
+    Args:
+        thread_data (list): The data part of `IMAP4.uid("THREAD", ...)`'s result,
+            such as `[b"(2)(3 6 (4 23)(44 7 96))"]`.
+
+    Returns:
+        List[List[int]]: The message ids of every thread, in ascending order.
+    """
+    chunks = [part for part in thread_data if isinstance(part, bytes)]
+    return [
+        sorted(_flatten_thread(thread))
+        for thread in _imap_parse(chunks)
+        if isinstance(thread, list) and thread
+    ]
+
+
+def _flatten_thread(thread: list) -> Iterator[int]:
+    for node in thread:
+        if isinstance(node, list):
+            yield from _flatten_thread(node)
+        elif node:
+            yield int(node)
 
+
+def group_by_references(headers: Dict[int, email.message.Message]) -> List[List[int]]:
+    """Group emails into conversations using their Message-ID, In-Reply-To and
+    References headers.
+
+    Two emails belong to the same conversation if one refers to the other, or if
+    they both refer to the same email, even one that is not part of `headers`.
+
+    Args:
+        headers (Dict[int, email.message.Message]): The headers of every email,
+            keyed by UID.
+
+    Returns:
+        List[List[int]]: The UIDs of every conversation, in ascending order.
+    """
+    parents: Dict[str, str] = {}
+
+    def find(key: str) -> str:
+        root = parents.setdefault(key, key)
+        while root != parents[root]:
+            root = parents[root]
+        while key != root:
+            parents[key], key = root, parents[key]
+        return root
+
+    roots = {}
+    for uid, msg in headers.items():
+        message_ids = [f"uid:{uid}"]
+        for field in ("Message-ID", "In-Reply-To", "References"):
+            message_ids += _MESSAGE_ID.findall(str(msg.get(field) or ""))
+        root = find(message_ids[0])
+        for message_id in message_ids[1:]:
+            other = find(message_id)
+            if other != root:
+                parents[other] = root
+        roots[uid] = message_ids[0]
+
+    threads: Dict[str, List[int]] = {}
+    for uid in sorted(roots):
+        threads.setdefault(find(roots[uid]), []).append(uid)
+    return list(threads.values())
+
+
+def sync_folder(
+    conn: imaplib.IMAP4_SSL, cache: "EmailCache", account: str, imap_folder: str
+) -> Tuple[int, bool]:
+    """Bring the cached state of the selected folder up to date.
+
+    The cache is dropped when the folder's UIDVALIDITY changes. On servers with
+    CONDSTORE the flags of emails above the last seen UID, and the flags changed
+    since the last seen MODSEQ, are fetched; cached emails that were expunged are
+    forgotten.
+
+    Args:
+        conn (imaplib.IMAP4_SSL): A connection with `imap_folder` selected, which
+            is selected again to read its current UIDNEXT and HIGHESTMODSEQ.
+        cache (EmailCache): The cache to update.
+        account (str): The account the folder belongs to.
+        imap_folder (str): The selected folder.
+
+    Returns:
+        Tuple[int, bool]: The folder's UIDVALIDITY and whether its flags are in sync.
+    """
+    condstore = "CONDSTORE" in getattr(conn, "capabilities", ())
+    # STATUS must not be used on the selected mailbox (RFC 3501 6.3.10), so the
+    # counters are taken from the untagged responses of selecting it again
+    _, select_data = conn.select(imap_folder)
+    status = {"MESSAGES": int(select_data[0])}
+    for item in ("UIDNEXT", "UIDVALIDITY", "HIGHESTMODSEQ"):
+        _, data = conn.response(item)
+        if data and data[-1] is not None:
+            status[item] = int(data[-1])
+    uidvalidity = status["UIDVALIDITY"]
+
+    state = cache.folder_state(account, imap_folder)
+    if state is None or state[0] != uidvalidity:
+        cache.reset_folder(account, imap_folder, uidvalidity)
+        state = (uidvalidity, 0, 0)
+    _, highest_uid, highest_modseq = state
+
+    if not condstore or "HIGHESTMODSEQ" not in status or "UIDNEXT" not in status:
+        return uidvalidity, False
+
+    flags = {}
+    if status["UIDNEXT"] - 1 > highest_uid:
+        # Only the emails that arrived since the last sync
+        flags.update(
+            _fetch_flags(conn, f"{highest_uid + 1}:*".encode(), "(FLAGS)", highest_uid)
+        )
+    if highest_uid and status["HIGHESTMODSEQ"] > highest_modseq:
+        # Only the flags that changed since the last sync
+        flags.update(
+            _fetch_flags(
+                conn,
+                f"1:{highest_uid}".encode(),
+                f"(FLAGS) (CHANGEDSINCE {highest_modseq})",
+            )
+        )
+    cache.store_flags(account, imap_folder, uidvalidity, flags)
+    highest_uid = max([highest_uid, *flags])
+
+    if cache.count(account, imap_folder, uidvalidity) != status["MESSAGES"]:
+        # Some emails were expunged, keep only the ones still on the server
+        _, search_data = conn.uid("SEARCH", "ALL")
+        uids = {int(uid) for uid in search_data[0].split()}
+        cache.retain(account, imap_folder, uidvalidity, uids)
+
+    cache.set_folder_state(
+        account, imap_folder, uidvalidity, highest_uid, status["HIGHESTMODSEQ"]
+    )
+    return uidvalidity, True
+
+
+def _fetch_flags(
+    conn: imaplib.IMAP4_SSL, message_set: bytes, message_parts: str, above_uid: int = 0
+) -> Dict[int, List[bytes]]:
+    _, msg_data = conn.uid("FETCH", message_set, message_parts)
+    flags = {}
+    for items in parse_fetch_response(msg_data).values():
+        if b"UID" not in items:
+            continue
+        uid = int(items[b"UID"])
+        # `n:*` always matches the last email, even if its UID is below n
+        if uid > above_uid:
+            flags[uid] = items.get(b"FLAGS") or []
+    return flags
+
+
+def _imap_fetch(
+    conn: imaplib.IMAP4_SSL, message_ids: List[bytes], message_parts: str, use_uid: bool
+) -> list:
+    message_set = imap_message_set(message_ids)
+    if use_uid:
+        _, msg_data = conn.uid("FETCH", message_set, message_parts)
+    else:
+        _, msg_data = conn.fetch(message_set, message_parts)
+    return msg_data
+
+
+def _fetch_full_emails(
+    conn: imaplib.IMAP4_SSL,
+    message_ids: List[bytes],
+    mark_as_seen: bool,
+    use_uid: bool = False,
+) -> Dict[int, dict]:
+    """Fetch whole emails, keyed by sequence number or by UID if `use_uid`."""
+    if mark_as_seen:
+        message_parts = "(RFC822)"
+    else:
+        message_parts = "(BODY.PEEK[])"
+    msg_data = _imap_fetch(conn, message_ids, message_parts, use_uid)
+
+    messages = {}
+    for response_part in msg_data:
+        if not isinstance(response_part, tuple):
+            continue
+        if use_uid:
+            key = int(re.search(rb"UID (\d+)", response_part[0]).group(1))
+        else:
+            key = int(response_part[0].split()[0])
+        msg = email.message_from_bytes(response_part[1])
+        body = get_email_body(msg)
+        # Clean email body
+        body = clean_email_body(body)
+        messages[key] = _email_details(msg, body)
+    return messages
+
+
+def _fetch_partial_emails(
+    conn: imaplib.IMAP4_SSL,
+    message_ids: List[bytes],
+    mark_as_seen: bool,
+    use_uid: bool = False,
+) -> Dict[int, dict]:
+    """Fetch only the headers read_emails returns and the text part of each email.
+
+    A first FETCH pulls the header fields and the BODYSTRUCTURE of every email,
+    then one FETCH per distinct MIME section pulls the text/plain part (or the
+    text/html part as a fallback), capped at EMAIL_BODY_MAX_BYTES if set.
+    Attachments are never downloaded. Emails are keyed by sequence number or by
+    UID if `use_uid`.
+    """
+    peek = "" if mark_as_seen else ".PEEK"
+    responses = _fetch_responses(
+        conn,
+        message_ids,
+        f"(BODY{peek}[HEADER.FIELDS ({EMAIL_HEADER_FIELDS})] BODYSTRUCTURE)",
+        use_uid,
+    )
+
+    max_bytes = int(os.getenv("EMAIL_BODY_MAX_BYTES") or 0)
+    byte_range = f"<0.{max_bytes}>" if max_bytes > 0 else ""
+
+    text_parts = {}
+    sections: Dict[str, List[bytes]] = {}
+    for key, items in responses.items():
+        text_part = find_text_part(items.get(b"BODYSTRUCTURE"))
+        if text_part:
+            text_parts[key] = text_part
+            sections.setdefault(text_part[0], []).append(b"%d" % key)
+
+    bodies = {}
+    for section, section_ids in sections.items():
+        body_responses = _fetch_responses(
+            conn, section_ids, f"(BODY{peek}[{section}]{byte_range})", use_uid
+        )
+        for key, items in body_responses.items():
+            data = _fetch_item(items, b"BODY[")
+            if key in text_parts and data is not None:
+                _, encoding, charset = text_parts[key]
+                bodies[key] = decode_body_part(data, encoding, charset)
+
+    messages = {}
+    for key, items in responses.items():
+        header = _fetch_item(items, b"BODY[HEADER") or b""
+        msg = email.message_from_bytes(header)
+        body = clean_email_body(bodies.get(key))
+        messages[key] = _email_details(msg, body)
+    return messages
+
+
+def _fetch_responses(
+    conn: imaplib.IMAP4_SSL, message_ids: List[bytes], message_parts: str, use_uid: bool
+) -> Dict[int, Dict[bytes, Any]]:
+    responses = parse_fetch_response(
+        _imap_fetch(conn, message_ids, message_parts, use_uid)
+    )
+    if not use_uid:
+        return responses
+    return {
+        int(items[b"UID"]): items for items in responses.values() if b"UID" in items
+    }
+
+
+def _email_details(msg: email.message.Message, body: str) -> dict:
+    # If the subject has unknown encoding, return blank
+    if msg["Subject"] is not None:
+        subject, encoding = decode_header(msg["Subject"])[0]
+    else:
+        subject = ""
+        encoding = ""
+
+    if isinstance(subject, bytes):
+        try:
+            # If the subject has unknown encoding, return blank
+            if encoding is not None:
+                subject = subject.decode(encoding)
+            else:
+                subject = ""
+        except LookupError:
+            subject = ""
+
+    return {
+        "From": msg["From"],
+        "To": msg["To"],
+        "Date": msg["Date"],
+        "CC": msg["CC"] if msg["CC"] else "",
+        "Subject": subject,
+        "Message Body": body,
+    }
+
+
+class _ImapLiteral(bytes):
+    """A literal string (`{n}` followed by n bytes) of an IMAP response."""
+
+
+_IMAP_OPEN = object()
+_IMAP_CLOSE = object()
+_IMAP_TOKEN = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))'
+)
+_IMAP_LITERAL_MARKER = re.compile(rb"\{\d+\}\s*$")
+_IMAP_FETCH_START = re.compile(rb"\d+ \(")
+_MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+
+
+def _imap_tokens(chunks: List[bytes]) -> Iterator[Any]:
+    for chunk in chunks:
+        if isinstance(chunk, _ImapLiteral):
+            yield bytes(chunk)
+            continue
+        text = _IMAP_LITERAL_MARKER.sub(b"", chunk)
+        for match in _IMAP_TOKEN.finditer(text):
+            opening, closing, quoted, atom = match.groups()
+            if opening:
+                yield _IMAP_OPEN
+            elif closing:
+                yield _IMAP_CLOSE
+            elif quoted is not None:
+                yield re.sub(rb"\\(.)", rb"\1", quoted)
+            elif atom:
+                yield None if atom.upper() == b"NIL" else atom
+
+
+def _imap_parse(chunks: List[bytes]) -> list:
+    stack: List[list] = [[]]
+    for token in _imap_tokens(chunks):
+        if token is _IMAP_OPEN:
+            stack.append([])
+        elif token is _IMAP_CLOSE:
+            if len(stack) > 1:
+                closed = stack.pop()
+                stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        closed = stack.pop()
+        stack[-1].append(closed)
+    return stack[0]
+
+
+def parse_fetch_response(msg_data: list) -> Dict[int, Dict[bytes, Any]]:
+    """Parse the data imaplib returns for a FETCH command.
+
+    Args:
+        msg_data (list): The data part of `IMAP4.fetch()`'s result.
+
+    Returns:
+        Dict[int, Dict[bytes, Any]]: The fetched items of every message, keyed by
+            sequence number and then by upper-cased item name such as
+            `BODYSTRUCTURE` or `BODY[1]<0>`. Lists are parsed into nested lists.
+    """
+    grouped: List[List[bytes]] = []
+    for part in msg_data:
+        head = part[0] if isinstance(part, tuple) else part
+        if not isinstance(head, bytes):
+            continue
+        if _IMAP_FETCH_START.match(head):
+            grouped.append([])
+        elif not grouped:
+            continue
+        if isinstance(part, tuple):
+            grouped[-1].extend([part[0], _ImapLiteral(part[1])])
+        else:
+            grouped[-1].append(part)
+
+    responses = {}
+    for chunks in grouped:
+        parsed = _imap_parse(chunks)
+        if len(parsed) < 2 or not isinstance(parsed[1], list):
+            continue
+        items = parsed[1]
+        responses[int(parsed[0])] = {
+            bytes(items[i]).upper(): items[i + 1]
+            for i in range(0, len(items) - 1, 2)
+            if isinstance(items[i], bytes)
+        }
+    return responses
+
+
+def _fetch_item(items: Dict[bytes, Any], prefix: bytes) -> Optional[bytes]:
+    return next((v for k, v in items.items() if k.startswith(prefix)), None)
+
+
+def find_text_part(bodystructure: Optional[list]) -> Optional[Tuple[str, bytes, str]]:
+    """Find the MIME part holding an email's text in its BODYSTRUCTURE.
+
+    Args:
+        bodystructure (list): The parsed BODYSTRUCTURE of an email.
+
+    Returns:
+        Optional[Tuple[str, bytes, str]]: The section number, transfer encoding and
+            charset of the first text/plain part that is not an attachment, or of
+            the first text/html part if there is no plain text. None otherwise.
+    """
+    if not isinstance(bodystructure, list):
+        return None
+    html_part = None
+    for subtype, text_part in _text_parts(bodystructure, ""):
+        if subtype == b"PLAIN":
+            return text_part
+        if subtype == b"HTML" and html_part is None:
+            html_part = text_part
+    return html_part
+
+
+def _text_parts(
+    structure: list, section: str
+) -> Iterator[Tuple[bytes, Tuple[str, bytes, str]]]:
+    if structure and isinstance(structure[0], list):
+        # Multipart: the child parts come first, followed by the subtype
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            child_section = f"{section}.{index}" if section else str(index)
+            yield from _text_parts(child, child_section)
+        return
+
+    if len(structure) < 7 or not isinstance(structure[0], bytes):
+        return
+    if structure[0].upper() != b"TEXT" or not isinstance(structure[1], bytes):
+        return
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and disposition and disposition[0]:
+        if disposition[0].upper() == b"ATTACHMENT":
+            return
+
+    charset = "utf-8"
+    params = structure[2] if isinstance(structure[2], list) else []
+    for name, value in zip(params[::2], params[1::2]):
+        if isinstance(name, bytes) and name.upper() == b"CHARSET" and value:
+            charset = value.decode("ascii", "ignore")
+    encoding = (structure[5] or b"7BIT").upper()
+    yield structure[1].upper(), (section or "1", encoding, charset)
+
+
+def decode_body_part(data: bytes, encoding: bytes, charset: str) -> Optional[str]:
+    """Decode a (possibly truncated) MIME part fetched by section number.
+
+    Args:
+        data (bytes): The raw part as sent by the server.
+        encoding (bytes): The part's Content-Transfer-Encoding.
+        charset (str): The part's charset.
+
+    Returns:
+        Optional[str]: The decoded text, or None if the encoding is unknown.
+    """
+    try:
+        if encoding == b"BASE64":
+            data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+            # A byte capped fetch may end in the middle of a base64 quantum
+            data = base64.b64decode(data[: len(data) - len(data) % 4])
+        elif encoding == b"QUOTED-PRINTABLE":
+            data = quopri.decodestring(data)
+        return data.decode(charset, "ignore")
+    except (binascii.Error, LookupError):
+        return None
+
+
+def paginate_message_ids(
+    message_ids: List[bytes], limit: int, page: int
+) -> List[bytes]:
+    """Select the ids of one result page, the first page holding the newest emails.
+
+    Args:
+        message_ids (List[bytes]): The message ids returned by SEARCH, oldest first.
+        limit (int): Number of emails per page.
+        page (int): The index of the page, starting at 1.
+
+    Returns:
+        List[bytes]: The message ids of the requested page, oldest first.
+    """
     # Confirm that integer parameters are the right type
     limit = int(limit)
     page = int(page)
@@ -205,21 +1287,30 @@ def read_emails(
     if limit < 1:
         raise ValueError("Error: The message limit should be 1 or greater")
 
-    page_count = len(messages) // limit + (len(messages) % limit > 0)
+    page_count = len(message_ids) // limit + (len(message_ids) % limit > 0)
 
     if page < 1 or page > page_count:
         raise ValueError("Error: The page value references a page that is not part of the results")
 
     # Calculate paginated indexes
-    start_index = len(messages) - (page * limit + 1)
-    end_index = start_index + limit
-    start_index = max(start_index, 0)
-
-    # Return paginated indexes
-    if start_index == end_index:
-        return [messages[start_index]]
-    else:
-        return messages[start_index:end_index]
+    end_index = len(message_ids) - (page - 1) * limit
+    start_index = max(end_index - limit, 0)
+    return message_ids[start_index:end_index]
+
+
+def imap_message_set(message_ids: List[bytes]) -> bytes:
+    """Collapse message ids into an IMAP message set such as `1:5,9,12`."""
+    numbers = sorted({int(message_id) for message_id in message_ids})
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return b",".join(
+        b"%d" % first if first == last else b"%d:%d" % (first, last)
+        for first, last in ranges
+    )
 
 
 def adjust_imap_folder_for_gmail(imap_folder: str, email_sender: str) -> str:
@@ -241,6 +1332,777 @@ def imap_open(
     return conn
 
 
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class ImapSession:
+    """A logged in IMAP connection kept alive by the `ImapConnectionPool`."""
+
+    def __init__(self, conn: imaplib.IMAP4_SSL, imap_folder: str):
+        self.conn = conn
+        self.selected_folder = imap_folder
+        self.last_used = time.monotonic()
+
+    def select(self, imap_folder: str) -> None:
+        """Select `imap_folder` unless it is already the selected folder."""
+        if self.selected_folder != imap_folder:
+            self.conn.select(imap_folder)
+            self.selected_folder = imap_folder
+
+    def is_alive(self, keepalive_interval: float) -> bool:
+        """Send a NOOP if the session has been idle for longer than
+        `keepalive_interval` seconds and report whether the server answered."""
+        if time.monotonic() - self.last_used < keepalive_interval:
+            return True
+        try:
+            self.conn.noop()
+        except (imaplib.IMAP4.error, OSError):
+            return False
+        return True
+
+    def close(self) -> None:
+        try:
+            self.conn.logout()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+
+
+class ImapConnectionPool:
+    """Process wide pool of logged in IMAP sessions keyed by (server, account).
+
+    Sessions are checked out for the duration of one operation and returned
+    afterwards, so repeated commands skip the TLS handshake, LOGIN and, when the
+    folder did not change, SELECT. Idle sessions are probed with NOOP before
+    reuse and logged out once they exceed the idle timeout.
+
+    Settings are read from the environment on every checkout:
+        EMAIL_IMAP_POOL_IDLE_TIMEOUT: Seconds an unused session is kept (300).
+        EMAIL_IMAP_POOL_KEEPALIVE: Idle seconds after which a NOOP is sent (60).
+        EMAIL_IMAP_POOL_MAX_IDLE: Idle sessions kept per account (4).
+    """
+
+    def __init__(self):
+        self._idle: Dict[Tuple[str, str], List[ImapSession]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(
+        self, imap_folder: str, email_sender: str, email_password: str
+    ) -> ImapSession:
+        """Check out a session with `imap_folder` selected, opening a new
+        connection if no idle one can be reused."""
+        key = (os.getenv("EMAIL_IMAP_SERVER"), email_sender)
+        keepalive = _env_float("EMAIL_IMAP_POOL_KEEPALIVE", 60)
+        self.evict_idle()
+
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key, [])
+                if not sessions:
+                    break
+                # Prefer a session that already has the folder selected
+                session = next(
+                    (s for s in reversed(sessions) if s.selected_folder == imap_folder),
+                    sessions[-1],
+                )
+                sessions.remove(session)
+            if session.is_alive(keepalive):
+                try:
+                    session.select(imap_folder)
+                except (imaplib.IMAP4.abort, OSError):
+                    # The server dropped the connection since it was probed
+                    session.close()
+                    continue
+                except imaplib.IMAP4.error:
+                    session.selected_folder = None
+                    self.release(email_sender, session)
+                    raise
+                return session
+            session.close()
+
+        conn = imap_open(imap_folder, email_sender, email_password)
+        return ImapSession(conn, imap_folder)
+
+    def release(self, email_sender: str, session: ImapSession) -> None:
+        """Return a session to the pool once an operation has completed."""
+        key = (os.getenv("EMAIL_IMAP_SERVER"), email_sender)
+        max_idle = int(_env_float("EMAIL_IMAP_POOL_MAX_IDLE", 4))
+        session.last_used = time.monotonic()
+        with self._lock:
+            sessions = self._idle.setdefault(key, [])
+            if len(sessions) < max_idle:
+                sessions.append(session)
+                return
+        session.close()
+
+    def evict_idle(self) -> None:
+        """Log out every pooled session that exceeded the idle timeout."""
+        idle_timeout = _env_float("EMAIL_IMAP_POOL_IDLE_TIMEOUT", 300)
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for sessions in self._idle.values():
+                for session in list(sessions):
+                    if now - session.last_used >= idle_timeout:
+                        sessions.remove(session)
+                        expired.append(session)
+        for session in expired:
+            session.close()
+
+    def clear(self) -> None:
+        """Log out and drop every pooled session."""
+        with self._lock:
+            sessions = [s for pooled in self._idle.values() for s in pooled]
+            self._idle.clear()
+        for session in sessions:
+            session.close()
+
+    def run(
+        self,
+        imap_folder: str,
+        email_sender: str,
+        email_password: str,
+        operation: Callable[[imaplib.IMAP4_SSL], T],
+        retry: bool = True,
+    ) -> T:
+        """Run `operation` on a pooled connection with `imap_folder` selected.
+
+        If the server drops the connection (`imaplib.IMAP4.abort`) the session is
+        discarded and, if `retry`, the operation is retried once on a fresh
+        connection. Operations that are not idempotent, such as APPEND, must not
+        be retried since the server may have carried them out before the drop.
+        """
+        for attempt in range(2 if retry else 1):
+            session = self.acquire(imap_folder, email_sender, email_password)
+            try:
+                result = operation(session.conn)
+            except imaplib.IMAP4.abort:
+                session.close()
+                if attempt or not retry:
+                    raise
+                continue
+            except (imaplib.IMAP4.error, OSError):
+                session.close()
+                raise
+            except Exception:
+                # e.g. invalid pagination, the connection itself is still usable
+                self.release(email_sender, session)
+                raise
+            self.release(email_sender, session)
+            return result
+
+
+imap_pool = ImapConnectionPool()
+
+
+def smtp_open(
+    smtp_host: str, smtp_port: str, email_sender: str, email_password: str
+) -> smtplib.SMTP:
+    smtp = smtplib.SMTP(smtp_host, smtp_port)
+    smtp.ehlo()
+    smtp.starttls()
+    smtp.login(email_sender, email_password)
+    return smtp
+
+
+class SmtpConnectionPool:
+    """Process wide pool of authenticated SMTP sessions keyed by (host, port, account).
+
+    Like the `ImapConnectionPool`, sessions are checked out for one operation,
+    probed with NOOP before reuse when they have been idle and closed once they
+    exceed the idle timeout.
+
+    Settings are read from the environment on every checkout:
+        EMAIL_SMTP_POOL_IDLE_TIMEOUT: Seconds an unused session is kept (60).
+        EMAIL_SMTP_POOL_KEEPALIVE: Idle seconds after which a NOOP is sent (15).
+        EMAIL_SMTP_POOL_MAX_IDLE: Idle sessions kept per account (4).
+    """
+
+    def __init__(self):
+        self._idle: Dict[Tuple[str, str, str], List[Tuple[smtplib.SMTP, float]]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(
+        self, smtp_host: str, smtp_port: str, email_sender: str, email_password: str
+    ) -> smtplib.SMTP:
+        """Check out a session, connecting and logging in if none can be reused."""
+        key = (smtp_host, smtp_port, email_sender)
+        keepalive = _env_float("EMAIL_SMTP_POOL_KEEPALIVE", 15)
+        self.evict_idle()
+
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key, [])
+                if not sessions:
+                    break
+                smtp, last_used = sessions.pop()
+            if time.monotonic() - last_used < keepalive:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(smtp)
+
+        return smtp_open(smtp_host, smtp_port, email_sender, email_password)
+
+    def release(
+        self, smtp_host: str, smtp_port: str, email_sender: str, smtp: smtplib.SMTP
+    ) -> None:
+        """Return a session to the pool once an operation has completed."""
+        key = (smtp_host, smtp_port, email_sender)
+        max_idle = int(_env_float("EMAIL_SMTP_POOL_MAX_IDLE", 4))
+        with self._lock:
+            sessions = self._idle.setdefault(key, [])
+            if len(sessions) < max_idle:
+                sessions.append((smtp, time.monotonic()))
+                return
+        self._close(smtp)
+
+    def evict_idle(self) -> None:
+        """Close every pooled session that exceeded the idle timeout."""
+        idle_timeout = _env_float("EMAIL_SMTP_POOL_IDLE_TIMEOUT", 60)
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for sessions in self._idle.values():
+                for session in list(sessions):
+                    if now - session[1] >= idle_timeout:
+                        sessions.remove(session)
+                        expired.append(session[0])
+        for smtp in expired:
+            self._close(smtp)
+
+    def clear(self) -> None:
+        """Close and drop every pooled session."""
+        with self._lock:
+            sessions = [smtp for pooled in self._idle.values() for smtp, _ in pooled]
+            self._idle.clear()
+        for smtp in sessions:
+            self._close(smtp)
+
+    def run(
+        self,
+        smtp_host: str,
+        smtp_port: str,
+        email_sender: str,
+        email_password: str,
+        operation: Callable[[smtplib.SMTP], T],
+    ) -> T:
+        """Run `operation` on a pooled session.
+
+        If the server closed the connection (`smtplib.SMTPServerDisconnected`) the
+        session is discarded and the operation is retried once on a new one.
+        """
+        for attempt in range(2):
+            smtp = self.acquire(smtp_host, smtp_port, email_sender, email_password)
+            try:
+                result = operation(smtp)
+            except smtplib.SMTPServerDisconnected:
+                self._close(smtp)
+                if attempt:
+                    raise
+                continue
+            except (smtplib.SMTPException, OSError):
+                self._close(smtp)
+                raise
+            except Exception:
+                self.release(smtp_host, smtp_port, email_sender, smtp)
+                raise
+            self.release(smtp_host, smtp_port, email_sender, smtp)
+            return result
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+
+smtp_pool = SmtpConnectionPool()
+
+
+class RateLimiter:
+    """Space out calls to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block until the next call is allowed."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_smtp_rate_limiters: Dict[str, RateLimiter] = {}
+_smtp_rate_limiters_lock = threading.Lock()
+
+
+def smtp_rate_limiter(smtp_host: str) -> RateLimiter:
+    """Return the RateLimiter of a SMTP server, configured by EMAIL_SMTP_RATE_LIMIT
+    in emails per second (unlimited if not set)."""
+    rate = _env_float("EMAIL_SMTP_RATE_LIMIT", 0)
+    with _smtp_rate_limiters_lock:
+        limiter = _smtp_rate_limiters.setdefault(smtp_host, RateLimiter(rate))
+        limiter.rate = rate
+        return limiter
+
+
+# Flags based search keywords the EmailCache can answer locally
+_LOCAL_SEARCH_FLAGS = {
+    "ALL": (None, True),
+    "SEEN": ("\\Seen", True),
+    "UNSEEN": ("\\Seen", False),
+    "FLAGGED": ("\\Flagged", True),
+    "UNFLAGGED": ("\\Flagged", False),
+    "ANSWERED": ("\\Answered", True),
+    "UNANSWERED": ("\\Answered", False),
+}
+
+
+class EmailCache:
+    """On-disk SQLite cache of the emails returned by read_emails.
+
+    Emails are stored as the dictionaries read_emails returns, i.e. parsed
+    headers and cleaned bodies, keyed by account, folder, UIDVALIDITY and UID,
+    along with the fetch mode and body cap they were read with.
+    Next to them the cache keeps each folder's highest seen UID and MODSEQ and
+    the emails' flags, which `sync_folder` keeps up to date incrementally.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS folders (account TEXT, folder TEXT, "
+                "uidvalidity INTEGER, highest_uid INTEGER, highest_modseq INTEGER, "
+                "PRIMARY KEY (account, folder))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages (account TEXT, folder TEXT, "
+                "uidvalidity INTEGER, uid INTEGER, flags TEXT, details TEXT, "
+                "fetch_mode TEXT, PRIMARY KEY (account, folder, uidvalidity, uid))"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(messages)")]
+            if "fetch_mode" not in columns:
+                # Caches created before the fetch mode was stored are refetched
+                self._db.execute("ALTER TABLE messages ADD COLUMN fetch_mode TEXT")
+
+    def folder_state(self, account: str, folder: str) -> Optional[Tuple[int, int, int]]:
+        """Return the UIDVALIDITY, highest UID and highest MODSEQ last synced."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT uidvalidity, highest_uid, highest_modseq FROM folders "
+                "WHERE account = ? AND folder = ?",
+                (account, folder),
+            ).fetchone()
+
+    def set_folder_state(
+        self,
+        account: str,
+        folder: str,
+        uidvalidity: int,
+        highest_uid: int,
+        highest_modseq: int,
+    ) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?)",
+                (account, folder, uidvalidity, highest_uid, highest_modseq),
+            )
+
+    def reset_folder(self, account: str, folder: str, uidvalidity: int) -> None:
+        """Forget everything cached for a folder, e.g. when its UIDVALIDITY changed."""
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM messages WHERE account = ? AND folder = ?",
+                (account, folder),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, 0, 0)",
+                (account, folder, uidvalidity),
+            )
+
+    def store_flags(
+        self,
+        account: str,
+        folder: str,
+        uidvalidity: int,
+        flags: Dict[int, List[bytes]],
+    ) -> None:
+        rows = [
+            (account, folder, uidvalidity, uid, _flags_column(uid_flags))
+            for uid, uid_flags in flags.items()
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (account, folder, uidvalidity, uid, flags) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, folder, uidvalidity, uid) "
+                "DO UPDATE SET flags = excluded.flags",
+                rows,
+            )
+
+    def store_messages(
+        self,
+        account: str,
+        folder: str,
+        uidvalidity: int,
+        messages: Dict[int, dict],
+        fetch_mode: str = "full",
+    ) -> None:
+        rows = [
+            (account, folder, uidvalidity, uid, json.dumps(details), fetch_mode)
+            for uid, details in messages.items()
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages "
+                "(account, folder, uidvalidity, uid, details, fetch_mode) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, folder, uidvalidity, uid) "
+                "DO UPDATE SET details = excluded.details, "
+                "fetch_mode = excluded.fetch_mode",
+                rows,
+            )
+
+    def get_messages(
+        self,
+        account: str,
+        folder: str,
+        uidvalidity: int,
+        uids: List[bytes],
+        fetch_mode: str = "full",
+    ) -> Dict[int, dict]:
+        """Return the emails among `uids` cached with `fetch_mode`, keyed by UID.
+
+        The fetch mode is "full", or "partial:<EMAIL_BODY_MAX_BYTES>" since a
+        body cut at one cap must not be returned with a larger or no cap.
+        """
+        uids = [int(uid) for uid in uids]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid, details FROM messages WHERE account = ? AND folder = ? "
+                "AND uidvalidity = ? AND details IS NOT NULL AND fetch_mode = ? "
+                f"AND uid IN ({','.join('?' * len(uids))})",
+                (account, folder, uidvalidity, fetch_mode, *uids),
+            ).fetchall()
+        return {uid: json.loads(details) for uid, details in rows}
+
+    def search_flags(
+        self, account: str, folder: str, uidvalidity: int, keyword: str
+    ) -> Optional[List[bytes]]:
+        """Answer a flags only IMAP search from the synced flags.
+
+        Returns:
+            Optional[List[bytes]]: The matching UIDs in ascending order, or None if
+                `keyword` cannot be answered locally.
+        """
+        if keyword.upper() not in _LOCAL_SEARCH_FLAGS:
+            return None
+        flag, present = _LOCAL_SEARCH_FLAGS[keyword.upper()]
+        query = (
+            "SELECT uid FROM messages WHERE account = ? AND folder = ? "
+            "AND uidvalidity = ? AND flags IS NOT NULL"
+        )
+        args: list = [account, folder, uidvalidity]
+        if flag:
+            query += " AND instr(flags, ?) " + ("> 0" if present else "= 0")
+            args.append(f" {flag} ")
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY uid", args).fetchall()
+        return [b"%d" % uid for uid, in rows]
+
+    def count(self, account: str, folder: str, uidvalidity: int) -> int:
+        """Return the number of emails whose flags are synced."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM messages WHERE account = ? AND folder = ? "
+                "AND uidvalidity = ? AND flags IS NOT NULL",
+                (account, folder, uidvalidity),
+            ).fetchone()[0]
+
+    def retain(self, account: str, folder: str, uidvalidity: int, uids: set) -> None:
+        """Forget the cached emails of a folder that are not in `uids`."""
+        with self._lock:
+            cached = self._db.execute(
+                "SELECT uid FROM messages WHERE account = ? AND folder = ? "
+                "AND uidvalidity = ?",
+                (account, folder, uidvalidity),
+            ).fetchall()
+        expunged = [
+            (account, folder, uidvalidity, uid) for uid, in cached if uid not in uids
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM messages WHERE account = ? AND folder = ? "
+                "AND uidvalidity = ? AND uid = ?",
+                expunged,
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _flags_column(flags: List[bytes]) -> str:
+    # Padded with spaces so a flag can be matched with instr(flags, " \\Seen ")
+    return " " + " ".join(flag.decode("ascii", "ignore") for flag in flags) + " "
+
+
+_email_caches: Dict[str, EmailCache] = {}
+_email_caches_lock = threading.Lock()
+
+
+def get_email_cache() -> Optional[EmailCache]:
+    """Return the EmailCache at EMAIL_CACHE_PATH, or None if caching is disabled."""
+    path = os.getenv("EMAIL_CACHE_PATH")
+    if not path:
+        return None
+    with _email_caches_lock:
+        if path not in _email_caches:
+            _email_caches[path] = EmailCache(path)
+        return _email_caches[path]
+
+
+class MailboxWatcher:
+    """Watch IMAP folders for new emails and queue their UIDs.
+
+    Every watched folder gets a dedicated connection and thread. The thread waits
+    in IDLE, re-issued every EMAIL_IDLE_REFRESH seconds, and looks up the new
+    UIDs whenever the server reports EXISTS. Servers without IDLE are polled with
+    NOOP every EMAIL_IDLE_POLL_INTERVAL seconds instead. Dropped connections are
+    re-opened without losing the UIDs that arrived in between.
+    """
+
+    def __init__(self):
+        self.events: "queue.Queue[dict]" = queue.Queue()
+        self._watchers: Dict[str, Tuple[threading.Thread, threading.Event]] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, imap_folder: str, email_sender: str, email_password: str) -> bool:
+        """Start watching `imap_folder`, unless it is already being watched."""
+        with self._lock:
+            watcher = self._watchers.get(imap_folder)
+            if watcher and watcher[0].is_alive():
+                return False
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=self._watch_folder,
+                args=(imap_folder, email_sender, email_password, stop),
+                name=f"email-watcher-{imap_folder}",
+                daemon=True,
+            )
+            self._watchers[imap_folder] = (thread, stop)
+        thread.start()
+        return True
+
+    def watched_folders(self) -> List[str]:
+        with self._lock:
+            return [
+                folder
+                for folder, (thread, _) in self._watchers.items()
+                if thread.is_alive()
+            ]
+
+    def stop(self, imap_folder: Optional[str] = None, timeout: float = 5) -> None:
+        """Stop watching `imap_folder`, or every folder if None."""
+        with self._lock:
+            folders = [imap_folder] if imap_folder else list(self._watchers)
+            watchers = [self._watchers.pop(f) for f in folders if f in self._watchers]
+        for _, stop in watchers:
+            stop.set()
+        for thread, _ in watchers:
+            thread.join(timeout)
+
+    def drain(self) -> List[dict]:
+        """Return and remove every queued new email notification."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _watch_folder(
+        self,
+        imap_folder: str,
+        email_sender: str,
+        email_password: str,
+        stop: threading.Event,
+    ) -> None:
+        last_uid = None
+        while not stop.is_set():
+            conn = None
+            try:
+                conn = imap_open(imap_folder, email_sender, email_password)
+                if last_uid is None:
+                    last_uid = _imap_last_uid(conn)
+                idle = "IDLE" in conn.capabilities
+                while not stop.is_set():
+                    if idle:
+                        _imap_idle(
+                            conn, stop, _env_float("EMAIL_IDLE_REFRESH", 25 * 60)
+                        )
+                    else:
+                        stop.wait(_env_float("EMAIL_IDLE_POLL_INTERVAL", 60))
+                        conn.noop()
+                    last_uid = self._queue_new_uids(conn, imap_folder, last_uid)
+            except (imaplib.IMAP4.error, OSError):
+                # Reconnect after a short pause
+                stop.wait(_env_float("EMAIL_IDLE_RECONNECT_DELAY", 5))
+            except Exception:
+                # Keep watching, an unexpected answer may not come again
+                logger.exception("Watching the IMAP folder %s failed", imap_folder)
+                stop.wait(_env_float("EMAIL_IDLE_RECONNECT_DELAY", 5))
+            finally:
+                if conn is not None:
+                    try:
+                        conn.logout()
+                    except (imaplib.IMAP4.error, OSError):
+                        pass
+
+    def _queue_new_uids(
+        self, conn: imaplib.IMAP4_SSL, imap_folder: str, last_uid: int
+    ) -> int:
+        _, search_data = conn.uid("SEARCH", f"UID {last_uid + 1}:*")
+        # `n:*` always matches the last email, even if its UID is below n
+        uids = sorted(u for u in map(int, search_data[0].split()) if u > last_uid)
+        for uid in uids:
+            self.events.put({"Folder": imap_folder, "UID": uid})
+        return uids[-1] if uids else last_uid
+
+
+def _imap_idle(conn: imaplib.IMAP4_SSL, stop: threading.Event, refresh: float) -> None:
+    """Wait in IDLE until the server reports a new email, `stop` is set or
+    `refresh` seconds have passed, then end IDLE with DONE."""
+    tag = conn._new_tag()
+    conn.send(tag + b" IDLE" + imaplib.CRLF)
+    line = conn.readline()
+    if not line.startswith(b"+"):
+        raise conn.error(f"IDLE rejected: {line!r}")
+
+    deadline = time.monotonic() + refresh
+    try:
+        while not stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Only read once a line is there, the socket staying blocking: a
+            # file object that timed out refuses every later read
+            if not _imap_wait_readable(conn, min(remaining, 1)):
+                continue
+            line = conn.readline()
+            if not line:
+                raise conn.abort("socket error: EOF during IDLE")
+            if re.match(rb"\* \d+ EXISTS", line):
+                break
+    finally:
+        conn.send(b"DONE" + imaplib.CRLF)
+    while True:
+        line = conn.readline()
+        if not line:
+            raise conn.abort("socket error: EOF during IDLE")
+        if line.startswith(tag):
+            if not line[len(tag) :].strip().startswith(b"OK"):
+                raise conn.error(f"IDLE failed: {line!r}")
+            return
+
+
+def _imap_last_uid(conn: imaplib.IMAP4_SSL) -> int:
+    """Return the highest UID of the selected folder, 0 if it is empty."""
+    # From the response to SELECT, STATUS is not allowed on the selected mailbox
+    _, uidnext = conn.response("UIDNEXT")
+    if uidnext and uidnext[-1] is not None:
+        return int(uidnext[-1]) - 1
+    # Some servers leave UIDNEXT out of their response to SELECT
+    _, search_data = conn.uid("SEARCH", "ALL")
+    return max((int(uid) for uid in (search_data[0] or b"").split()), default=0)
+
+
+def _imap_wait_readable(conn: imaplib.IMAP4_SSL, timeout: float) -> bool:
+    """Wait up to `timeout` seconds until `conn` has data to read, without reading.
+
+    Data already buffered by imaplib's reader or decrypted by the SSL layer is
+    invisible to select(), so it is checked first.
+    """
+    if getattr(conn, "_readbuf", None):
+        return True
+    sock = conn.sock
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    file = getattr(conn, "file", None)
+    if file is not None:
+        # Without a timeout, peek returns the buffered bytes, reads the ones
+        # ready on the socket, or gives up at once
+        sock_timeout = sock.gettimeout()
+        sock.settimeout(0.0)
+        try:
+            if file.peek(1):
+                return True
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+        finally:
+            sock.settimeout(sock_timeout)
+    return bool(select.select([sock], [], [], timeout)[0])
+
+
+mailbox_watcher = MailboxWatcher()
+
+
+def watch_emails(imap_folders: str = "inbox") -> str:
+    """Start watching IMAP folders for new emails in the background.
+
+    Args:
+        imap_folders (str, optional): Comma separated names of the IMAP folders to
+            watch. Defaults to "inbox".
+
+    Returns:
+        str: The folders being watched.
+    """
+    email_sender = getSender()
+    email_password = getPwd()
+    for folder in imap_folders.split(","):
+        if folder.strip():
+            folder = adjust_imap_folder_for_gmail(folder.strip(), email_sender)
+            mailbox_watcher.watch(
+                enclose_with_quotes(folder), email_sender, email_password
+            )
+    return f"Watching {', '.join(mailbox_watcher.watched_folders())} for new emails"
+
+
+def get_new_emails() -> str:
+    """Return the new emails reported by the folders started with `watch_emails`.
+
+    This does not contact the IMAP server, the returned UIDs can be read with
+    `read_emails` and the search command `UID <uid>`.
+
+    Returns:
+        str: A list of dictionaries with the folder and UID of every email that
+             arrived since the last call. Otherwise, returns a string indicating
+             that there are no new emails.
+    """
+    events = mailbox_watcher.drain()
+    if events:
+        return events
+    if not mailbox_watcher.watched_folders():
+        return "No folders are being watched, start watching them with watch_emails"
+    return "There are no new emails"
+
+
 def get_email_body(msg: email.message.Message) -> str:
     if msg.is_multipart():
         for part in msg.walk():
@@ -280,6 +2142,54 @@ def split_imap_search_command(input_string):
 
     return parts
 
+# Every line boundary str.splitlines() splits on
+_LINE_BREAKS = str.maketrans("", "", "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029")
+_URL_PATTERN = re.compile(r"http\S+")
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect the text of an HTML document while it is being parsed.
+
+    Matches `BeautifulSoup(html, "html.parser").get_text()`: the content of
+    script, style and template elements, comments, declarations and processing
+    instructions is dropped, CDATA sections are kept.
+    """
+
+    SKIPPED_TAGS = {"script", "style", "template"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipped_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skipped_depth:
+            self._skipped_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skipped_depth:
+            self.parts.append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith("CDATA[") and not self._skipped_depth:
+            self.parts.append(data[6:])
+
+
+def html_to_text(html: str) -> str:
+    """Return the text of an HTML document or fragment."""
+    # Without tags or character references there is nothing to parse
+    if "<" not in html and "&" not in html:
+        return html
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.parts)
+
+
 def clean_email_body(email_body):
     """Remove formating and URL's from an email's body
 
@@ -294,11 +2204,10 @@ def clean_email_body(email_body):
     if email_body is None: email_body = ""
 
     # Remove any HTML tags
-    email_body = BeautifulSoup(email_body, "html.parser")
-    email_body = email_body.get_text()
+    email_body = html_to_text(email_body)
 
     # Remove return characters
-    email_body = "".join(email_body.splitlines())
+    email_body = email_body.translate(_LINE_BREAKS)
 
     # Remove extra spaces
     email_body = " ".join(email_body.split())
@@ -308,6 +2217,6 @@ def clean_email_body(email_body):
     email_body = email_body.decode("utf-8", "ignore")
 
     # Remove any remaining URL's
-    email_body = re.sub(r"http\S+", "", email_body)
+    email_body = _URL_PATTERN.sub("", email_body)
 
     return email_body
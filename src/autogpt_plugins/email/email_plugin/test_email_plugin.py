@@ -1,18 +1,51 @@
+import imaplib
 import os
+import select
+import smtplib
+import socketserver
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+from email import message_from_bytes
 from email.message import EmailMessage
 from functools import partial
-from unittest.mock import mock_open, patch
+from unittest.mock import MagicMock, mock_open, patch
 
 from email_plugin import (
+    _imap_idle,
     adjust_imap_folder_for_gmail,
     bothEmailAndPwdSet,
+    clean_email_body,
+    decode_body_part,
+    EmailCache,
     enclose_with_quotes,
+    find_text_part,
+    get_email_cache,
+    get_new_emails,
+    group_by_references,
+    html_to_text,
     imap_open,
+    imap_message_set,
+    imap_pool,
+    mailbox_watcher,
+    paginate_message_ids,
+    parse_thread_response,
+    parse_fetch_response,
+    read_email_threads,
     read_emails,
+    read_emails_from_folders,
+    RateLimiter,
+    StreamedMimeMessage,
+    imap_append_chunks,
     send_email,
+    send_emails,
     send_email_with_attachment_internal,
+    smtp_pool,
+    smtp_send_chunks,
     split_imap_search_command,
+    watch_emails,
 )
 
 MOCK_FROM = "sender@example.com"
@@ -44,7 +77,95 @@ MOCK_ATTACHMENT_PATH = "example/file.txt"
 MOCK_ATTACHMENT_NAME = "file.txt"
 
 
+class LocalImapServer(socketserver.ThreadingTCPServer):
+    """A minimal IMAP server standing in for a real one in the watcher tests."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, capabilities):
+        super().__init__(("127.0.0.1", 0), LocalImapHandler)
+        self.capabilities = capabilities
+        self.uids = [1, 2]
+        self.logins = 0
+        # Send UIDNEXT in the response to SELECT
+        self.uidnext = True
+        # Send a flag update in the same segment as every EXISTS response
+        self.flag_updates = False
+        self.lock = threading.Lock()
+
+    def deliver(self):
+        with self.lock:
+            self.uids.append(self.uids[-1] + 1)
+
+
+class LocalImapHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        self.reply(f"* OK [CAPABILITY {server.capabilities}] ready")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            tag, command, *args = line.split(" ")
+            command = command.upper()
+            if command == "UID":
+                command = "UID " + args.pop(0).upper()
+            if command == "LOGIN":
+                server.logins += 1
+            if command == "CAPABILITY":
+                self.reply(f"* CAPABILITY {server.capabilities}")
+            elif command == "SELECT":
+                self.reply(f"* {len(server.uids)} EXISTS")
+                if server.uidnext:
+                    self.reply(f"* OK [UIDNEXT {server.uids[-1] + 1}] Predicted next UID")
+            elif command == "UID SEARCH" and args[0].upper() == "ALL":
+                self.reply("* SEARCH " + " ".join(map(str, server.uids)))
+            elif command == "UID SEARCH":
+                first = int(args[1].split(":")[0])
+                uids = [u for u in server.uids if u >= first] or server.uids[-1:]
+                self.reply("* SEARCH " + " ".join(map(str, uids)))
+            elif command == "IDLE":
+                self.idle(tag)
+                continue
+            elif command == "LOGOUT":
+                self.reply("* BYE")
+                self.reply(f"{tag} OK LOGOUT completed")
+                return
+            self.reply(f"{tag} OK {command} completed")
+
+    def idle(self, tag):
+        self.reply("+ idling")
+        known = len(self.server.uids)
+        while True:
+            if len(self.server.uids) != known:
+                known = len(self.server.uids)
+                if self.server.flag_updates:
+                    self.wfile.write(
+                        f"* 1 FETCH (FLAGS (\\Seen))\r\n* {known} EXISTS\r\n".encode()
+                    )
+                else:
+                    self.reply(f"* {known} EXISTS")
+            readable, _, _ = select.select([self.rfile], [], [], 0.02)
+            if readable and self.rfile.readline().strip().upper() == b"DONE":
+                self.reply(f"{tag} OK IDLE terminated")
+                return
+
+
 class TestEmailPlugin(unittest.TestCase):
+    def setUp(self):
+        imap_pool.clear()
+        smtp_pool.clear()
+
+    def tearDown(self):
+        imap_pool.clear()
+        smtp_pool.clear()
+        mailbox_watcher.stop()
+        mailbox_watcher.drain()
+
     @patch.dict(
         os.environ,
         {
@@ -201,12 +322,13 @@ class TestEmailPlugin(unittest.TestCase):
         mock_smtp.assert_called_once_with(MOCK_SMTP_SERVER, MOCK_SMTP_PORT)
 
         # Check if the SMTP object was created and used correctly
-        context = mock_smtp.return_value.__enter__.return_value
-        context.ehlo.assert_called()
-        context.starttls.assert_called_once()
-        context.login.assert_called_once_with(MOCK_FROM, MOCK_PWD)
-        context.send_message.assert_called_once()
-        context.quit.assert_called_once()
+        smtp = mock_smtp.return_value
+        smtp.ehlo.assert_called()
+        smtp.starttls.assert_called_once()
+        smtp.login.assert_called_once_with(MOCK_FROM, MOCK_PWD)
+        smtp.send_message.assert_called_once()
+        # The authenticated session is kept for the next email
+        smtp.quit.assert_not_called()
 
     # Test for reading emails in a specific folder with a specific search command and pagination
     @patch("imaplib.IMAP4_SSL")
@@ -561,5 +683,970 @@ class TestEmailPlugin(unittest.TestCase):
         mock_imap.return_value.search.assert_called_once_with(None, "UNSEEN")
         mock_imap.return_value.fetch.assert_called_once_with(b"1", "(BODY.PEEK[])")
 
+    # Test that consecutive reads reuse one pooled IMAP connection
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_read_emails_reuses_pooled_connection(self, mock_imap):
+        message = EmailMessage()
+        message["From"] = MOCK_FROM
+        message["To"] = MOCK_TO
+        message["Date"] = MOCK_DATE
+        message["Subject"] = MOCK_SUBJECT
+        message.set_content(MOCK_CONTENT)
+
+        mock_imap.return_value.search.return_value = (None, [b"1"])
+        mock_imap.return_value.fetch.return_value = (None, [(b"1", message.as_bytes())])
+
+        read_emails("inbox", "UNSEEN", 1, 1)
+        read_emails("inbox", "UNSEEN", 1, 1)
+        read_emails("Archive", "UNSEEN", 1, 1)
+
+        mock_imap.assert_called_once_with(MOCK_IMAP_SERVER)
+        mock_imap.return_value.login.assert_called_once_with(MOCK_FROM, MOCK_PWD)
+        mock_imap.return_value.logout.assert_not_called()
+        # SELECT is only sent again when the folder changes
+        self.assertEqual(
+            [c.args for c in mock_imap.return_value.select.call_args_list],
+            [("inbox",), ("Archive",)],
+        )
+
+    # Test that a dropped connection is replaced transparently
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_imap_pool_reconnects_on_abort(self, mock_imap):
+        stale, fresh = MagicMock(), MagicMock()
+        mock_imap.side_effect = [stale, fresh]
+        stale.search.side_effect = imaplib.IMAP4.abort("socket error: EOF")
+        fresh.search.return_value = ("OK", [b""])
+
+        result = read_emails("inbox", "UNSEEN", 1, 1)
+
+        assert result.startswith("There are no Emails")
+        self.assertEqual(mock_imap.call_count, 2)
+        fresh.login.assert_called_once_with(MOCK_FROM, MOCK_PWD)
+        fresh.select.assert_called_once_with("inbox")
+
+    # Test that operations that are not idempotent are not retried
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_imap_pool_no_retry(self, mock_imap):
+        conn = mock_imap.return_value
+        conn.append.side_effect = imaplib.IMAP4.abort("socket error: EOF")
+
+        with self.assertRaises(imaplib.IMAP4.abort):
+            imap_pool.run(
+                "Drafts",
+                MOCK_FROM,
+                MOCK_PWD,
+                lambda c: c.append("Drafts", "", "", b"draft"),
+                retry=False,
+            )
+
+        conn.append.assert_called_once()
+        self.assertEqual(mock_imap.call_count, 1)
+        conn.logout.assert_called_once()
+
+    # Test that a pooled session dropped while changing folders is replaced
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_imap_pool_reconnects_on_select_abort(self, mock_imap):
+        stale, fresh = MagicMock(), MagicMock()
+        mock_imap.side_effect = [stale, fresh]
+        imap_pool.run("inbox", MOCK_FROM, MOCK_PWD, lambda c: None)
+        stale.select.side_effect = imaplib.IMAP4.abort("socket error: EOF")
+
+        result = imap_pool.run("Archive", MOCK_FROM, MOCK_PWD, lambda c: c)
+
+        self.assertIs(result, fresh)
+        stale.logout.assert_called_once()
+        fresh.select.assert_called_once_with("Archive")
+
+    # Test keep-alive probing and idle eviction of pooled sessions
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+            "EMAIL_IMAP_POOL_KEEPALIVE": "0",
+        },
+    )
+    def test_imap_pool_keepalive_and_eviction(self, mock_imap):
+        conn = mock_imap.return_value
+        imap_pool.run("inbox", MOCK_FROM, MOCK_PWD, lambda c: None)
+        imap_pool.run("inbox", MOCK_FROM, MOCK_PWD, lambda c: None)
+        conn.noop.assert_called_once()
+        mock_imap.assert_called_once()
+
+        with patch.dict(os.environ, {"EMAIL_IMAP_POOL_IDLE_TIMEOUT": "0"}):
+            imap_pool.evict_idle()
+        conn.logout.assert_called_once()
+
+        imap_pool.run("inbox", MOCK_FROM, MOCK_PWD, lambda c: None)
+        self.assertEqual(mock_imap.call_count, 2)
+
+
+    def test_imap_message_set(self):
+        self.assertEqual(imap_message_set([b"1"]), b"1")
+        self.assertEqual(
+            imap_message_set([b"1", b"2", b"3", b"4", b"5", b"9", b"12"]),
+            b"1:5,9,12",
+        )
+        self.assertEqual(imap_message_set([b"12", b"3", b"2", b"3"]), b"2:3,12")
+
+    def test_paginate_message_ids(self):
+        ids = [b"%d" % i for i in range(1, 13)]
+        self.assertEqual(paginate_message_ids(ids, 5, 1), ids[7:])
+        self.assertEqual(paginate_message_ids(ids, 5, 2), ids[2:7])
+        self.assertEqual(paginate_message_ids(ids, "5", "3"), ids[:2])
+        with self.assertRaises(ValueError):
+            paginate_message_ids(ids, 5, 4)
+        with self.assertRaises(ValueError):
+            paginate_message_ids(ids, 0, 1)
+
+    # Test that only the requested page is fetched, in one batched FETCH
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_read_emails_fetches_single_page(self, mock_imap):
+        def make_message(subject):
+            message = EmailMessage()
+            message["From"] = MOCK_FROM
+            message["To"] = MOCK_TO
+            message["Date"] = MOCK_DATE
+            message["Subject"] = subject
+            message.set_content(MOCK_CONTENT)
+            return message.as_bytes()
+
+        ids = b" ".join(b"%d" % i for i in range(1, 1001))
+        mock_imap.return_value.search.return_value = ("OK", [ids])
+        # Answer out of order to check the result is sorted by sequence number
+        mock_imap.return_value.fetch.return_value = (
+            "OK",
+            [
+                (b"994 (BODY[] {100}", make_message("994")),
+                b")",
+                (b"993 (BODY[] {100}", make_message("993")),
+                b")",
+            ],
+        )
+
+        result = read_emails("inbox", "ALL", 2, 4)
+
+        self.assertEqual([m["Subject"] for m in result], ["993", "994"])
+        mock_imap.return_value.fetch.assert_called_once_with(
+            b"993:994", "(BODY.PEEK[])"
+        )
+
+    # Test that invalid pagination keeps the pooled connection
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_read_emails_invalid_page(self, mock_imap):
+        mock_imap.return_value.search.return_value = ("OK", [b"1 2 3"])
+
+        with self.assertRaises(ValueError):
+            read_emails("inbox", "ALL", 2, 3)
+        mock_imap.return_value.fetch.assert_not_called()
+        mock_imap.return_value.logout.assert_not_called()
+
+    # Test the partial fetch mode, which never downloads attachments
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+            "EMAIL_FETCH_MODE": "partial",
+            "EMAIL_BODY_MAX_BYTES": "12",
+        },
+    )
+    def test_read_emails_partial_fetch(self, mock_imap):
+        header = (
+            f"From: {MOCK_FROM}\r\nTo: {MOCK_TO}\r\nDate: {MOCK_DATE}\r\n"
+            f"Subject: {MOCK_SUBJECT}\r\n\r\n"
+        ).encode()
+        bodystructure = (
+            b'BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "BASE64"'
+            b' 20 1 NIL NIL NIL)("APPLICATION" "PDF" ("NAME" "big.pdf") NIL NIL'
+            b' "BASE64" 99999999 NIL ("ATTACHMENT" ("FILENAME" "big.pdf")) NIL)'
+            b' "MIXED" ("BOUNDARY" "b1") NIL NIL)'
+        )
+        mock_imap.return_value.search.return_value = ("OK", [b"7"])
+        mock_imap.return_value.fetch.side_effect = [
+            (
+                "OK",
+                [
+                    (
+                        b"7 (" + bodystructure + b" BODY[HEADER.FIELDS "
+                        b"(FROM TO DATE CC SUBJECT)] {%d}" % len(header),
+                        header,
+                    ),
+                    b")",
+                ],
+            ),
+            ("OK", [(b"7 (BODY[1]<0> {12}", b"VGVzdCBtZXNz"), b")"]),
+        ]
+
+        result = read_emails("inbox", "UNSEEN", 1, 1)
+
+        self.assertEqual(
+            result,
+            [
+                {
+                    "From": MOCK_FROM,
+                    "To": MOCK_TO,
+                    "Date": MOCK_DATE,
+                    "CC": "",
+                    "Subject": MOCK_SUBJECT,
+                    "Message Body": "Test mess",
+                }
+            ],
+        )
+        self.assertEqual(
+            [c.args for c in mock_imap.return_value.fetch.call_args_list],
+            [
+                (
+                    b"7",
+                    "(BODY.PEEK[HEADER.FIELDS (FROM TO DATE CC SUBJECT)] BODYSTRUCTURE)",
+                ),
+                (b"7", "(BODY.PEEK[1]<0.12>)"),
+            ],
+        )
+
+    def test_find_text_part_html_fallback(self):
+        bodystructure = parse_fetch_response(
+            [
+                b'1 (BODYSTRUCTURE (("TEXT" "HTML" ("CHARSET" "iso-8859-1") NIL NIL'
+                b' "QUOTED-PRINTABLE" 20 1 NIL NIL NIL)("TEXT" "PLAIN" NIL NIL NIL'
+                b' "7BIT" 5 1 NIL ("ATTACHMENT" ("FILENAME" "a.txt")) NIL) "MIXED"'
+                b' ("BOUNDARY" "b1") NIL NIL))'
+            ]
+        )[1][b"BODYSTRUCTURE"]
+        self.assertEqual(
+            find_text_part(bodystructure), ("1", b"QUOTED-PRINTABLE", "iso-8859-1")
+        )
+        self.assertEqual(
+            decode_body_part(b"caf=E9", b"QUOTED-PRINTABLE", "iso-8859-1"), "caf\xe9"
+        )
+
+    def mock_threaded_mailbox(self, mock_imap, capabilities):
+        def make_message(uid, subject, message_id, references=""):
+            message = EmailMessage()
+            message["From"] = MOCK_FROM
+            message["To"] = MOCK_TO
+            message["Date"] = MOCK_DATE
+            message["Subject"] = subject
+            message["Message-ID"] = message_id
+            if references:
+                message["In-Reply-To"] = references.split()[-1]
+                message["References"] = references
+            message.set_content(f"Body {uid}")
+            return message.as_bytes()
+
+        mailbox = {
+            1: make_message(1, "Plan", "<a@example.com>"),
+            2: make_message(2, "Lunch", "<b@example.com>"),
+            3: make_message(3, "Re: Plan", "<c@example.com>", "<a@example.com>"),
+            4: make_message(
+                4, "Re: Plan", "<d@example.com>", "<a@example.com> <c@example.com>"
+            ),
+            5: make_message(5, "Re: Lunch", "<e@example.com>", "<b@example.com>"),
+        }
+
+        def uid(command, *args):
+            if command == "THREAD":
+                return ("OK", [b"(1 3 4)(2 5)"])
+            if command == "SEARCH":
+                return ("OK", [b"1 2 3 4 5"])
+            uids = []
+            for item in args[0].split(b","):
+                first, _, last = item.partition(b":")
+                uids.extend(range(int(first), int(last or first) + 1))
+            if "HEADER.FIELDS" in args[1]:
+                return (
+                    "OK",
+                    [
+                        (
+                            b"%d (UID %d BODY[HEADER.FIELDS] {1}" % (u, u),
+                            mailbox[u].split(b"\n\n")[0] + b"\n\n",
+                        )
+                        for u in uids
+                    ]
+                    + [b")"],
+                )
+            return (
+                "OK",
+                [(b"%d (UID %d BODY[] {1}" % (u, u), mailbox[u]) for u in uids],
+            )
+
+        conn = mock_imap.return_value
+        conn.capabilities = capabilities
+        conn.uid.side_effect = uid
+        return conn
+
+    def assert_threads(self, conn):
+        with patch.dict(
+            os.environ,
+            {
+                "EMAIL_ADDRESS": MOCK_FROM,
+                "EMAIL_PASSWORD": MOCK_PWD,
+                "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+            },
+        ):
+            threads = read_email_threads("inbox", "ALL", 5, 1)
+
+        self.assertEqual(
+            [(t["Subject"], t["Email Count"]) for t in threads],
+            [("Plan", 3), ("Lunch", 2)],
+        )
+        plan, lunch = threads
+        self.assertEqual(
+            [e["Subject"] for e in plan["Emails"]], ["Plan", "Re: Plan", "Re: Plan"]
+        )
+        # Only the newest email of each conversation has its body
+        self.assertEqual(
+            [e.get("Message Body") for e in plan["Emails"] + lunch["Emails"]],
+            [None, None, "Body 4", None, "Body 5"],
+        )
+        body_fetches = [
+            c.args[2] for c in conn.uid.call_args_list if c.args[0] == "FETCH"
+        ]
+        self.assertEqual(body_fetches.count("(BODY.PEEK[])"), 1)
+        self.assertIn(
+            ("FETCH", b"4:5", "(BODY.PEEK[])"),
+            [c.args for c in conn.uid.call_args_list],
+        )
+
+    # Test conversations grouped by the server's THREAD extension
+    @patch("imaplib.IMAP4_SSL")
+    def test_read_email_threads_server_side(self, mock_imap):
+        conn = self.mock_threaded_mailbox(
+            mock_imap, ("IMAP4REV1", "THREAD=REFERENCES")
+        )
+        self.assert_threads(conn)
+        conn.uid.assert_any_call("THREAD", "REFERENCES", "UTF-8", "ALL")
+
+    # Test conversations grouped locally from the References headers
+    @patch("imaplib.IMAP4_SSL")
+    def test_read_email_threads_local(self, mock_imap):
+        conn = self.mock_threaded_mailbox(mock_imap, ("IMAP4REV1",))
+        self.assert_threads(conn)
+        # The headers fetched for grouping are reused for the collapsed emails
+        header_fetches = [
+            c.args for c in conn.uid.call_args_list if "HEADER" in str(c.args[-1])
+        ]
+        self.assertEqual(len(header_fetches), 1)
+
+    def test_parse_thread_response(self):
+        self.assertEqual(
+            parse_thread_response([b"(2)(3 6 (4 23)(44 7 96))"]),
+            [[2], [3, 4, 6, 7, 23, 44, 96]],
+        )
+        self.assertEqual(parse_thread_response([b"((3)(5))"]), [[3, 5]])
+        self.assertEqual(parse_thread_response([None]), [])
+
+    def test_group_by_references(self):
+        def headers(message_id, references=""):
+            msg = EmailMessage()
+            msg["Message-ID"] = message_id
+            if references:
+                msg["References"] = references
+            return msg
+
+        # Replies to a missing parent still belong to the same conversation
+        self.assertEqual(
+            group_by_references(
+                {
+                    7: headers("<x@example.com>", "<root@example.com>"),
+                    3: headers("<y@example.com>"),
+                    9: headers("<z@example.com>", "<root@example.com>"),
+                    4: EmailMessage(),
+                }
+            ),
+            [[3], [4], [7, 9]],
+        )
+
+    # Test that repeated reads are served from the local cache
+    @patch("imaplib.IMAP4_SSL")
+    def test_read_emails_with_cache(self, mock_imap):
+        def make_message(subject):
+            message = EmailMessage()
+            message["From"] = MOCK_FROM
+            message["To"] = MOCK_TO
+            message["Date"] = MOCK_DATE
+            message["Subject"] = subject
+            message.set_content(MOCK_CONTENT)
+            return message.as_bytes()
+
+        server = {"uidvalidity": 7, "modseq": 10, "flags": {41: b"", 42: b"\\Seen"}}
+
+        def select(folder):
+            return ("OK", [b"%d" % len(server["flags"])])
+
+        def response(code):
+            values = {
+                "UIDNEXT": max(server["flags"]) + 1,
+                "UIDVALIDITY": server["uidvalidity"],
+                "HIGHESTMODSEQ": server["modseq"],
+            }
+            return (code, [b"%d" % values[code]])
+
+        def uid(command, *args):
+            if command == "FETCH" and args[1].startswith("(FLAGS)"):
+                return (
+                    "OK",
+                    [
+                        b"%d (UID %d FLAGS (%s))" % (n, uid, flags)
+                        for n, (uid, flags) in enumerate(server["flags"].items(), 1)
+                    ],
+                )
+            if command == "FETCH":
+                uids = []
+                for item in args[0].split(b","):
+                    first, _, last = item.partition(b":")
+                    uids.extend(range(int(first), int(last or first) + 1))
+                return (
+                    "OK",
+                    [
+                        (b"1 (UID %d BODY[] {1}" % u, make_message(str(u)))
+                        for u in uids
+                    ],
+                )
+            if command == "SEARCH":
+                return ("OK", [b" ".join(b"%d" % u for u in server["flags"])])
+            return ("OK", [None])
+
+        conn = mock_imap.return_value
+        conn.capabilities = ("IMAP4REV1", "CONDSTORE")
+        conn.select.side_effect = select
+        conn.response.side_effect = response
+        conn.uid.side_effect = uid
+
+        with tempfile.TemporaryDirectory() as workspace, patch.dict(
+            os.environ,
+            {
+                "EMAIL_ADDRESS": MOCK_FROM,
+                "EMAIL_PASSWORD": MOCK_PWD,
+                "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+                "EMAIL_CACHE_PATH": os.path.join(workspace, "emails.db"),
+            },
+        ):
+            result = read_emails("inbox", "UNSEEN", 5, 1)
+            self.assertEqual([m["Subject"] for m in result], ["41"])
+            self.assertEqual(result[0]["Message Body"], MOCK_CONTENT)
+
+            # Unchanged folder: answered from the cache without SEARCH or FETCH
+            conn.uid.reset_mock()
+            self.assertEqual(read_emails("inbox", "UNSEEN", 5, 1), result)
+            conn.uid.assert_not_called()
+
+            # New email: only UIDs above the high-water mark are synced
+            server["flags"][43] = b""
+            server["modseq"] = 11
+            conn.uid.reset_mock()
+            result = read_emails("inbox", "ALL", 5, 1)
+            self.assertEqual([m["Subject"] for m in result], ["41", "42", "43"])
+            self.assertEqual(
+                [c.args[:2] for c in conn.uid.call_args_list if c.args[0] == "FETCH"],
+                [("FETCH", b"43:*"), ("FETCH", b"1:42"), ("FETCH", b"42:43")],
+            )
+
+            # UIDVALIDITY changed: the cache for the folder is dropped
+            server["uidvalidity"] = 8
+            conn.uid.reset_mock()
+            read_emails("inbox", "ALL", 5, 1)
+            self.assertIn(
+                ("FETCH", b"41:43", "(BODY.PEEK[])"),
+                [c.args for c in conn.uid.call_args_list],
+            )
+            get_email_cache().close()
+
+    def test_email_cache_search_flags(self):
+        with tempfile.TemporaryDirectory() as workspace:
+            cache = EmailCache(os.path.join(workspace, "emails.db"))
+            cache.store_flags(
+                "account", "inbox", 1, {1: [b"\\Seen"], 2: [], 3: [b"\\Flagged"]}
+            )
+            search = partial(cache.search_flags, "account", "inbox", 1)
+            self.assertEqual(search("ALL"), [b"1", b"2", b"3"])
+            self.assertEqual(search("unseen"), [b"2", b"3"])
+            self.assertEqual(search("FLAGGED"), [b"3"])
+            self.assertIsNone(search("RECENT"))
+
+            cache.retain("account", "inbox", 1, {2, 3})
+            self.assertEqual(cache.count("account", "inbox", 1), 2)
+            cache.close()
+
+    # Test that emails cached with a body cap are not returned for another one
+    def test_email_cache_fetch_mode(self):
+        with tempfile.TemporaryDirectory() as workspace:
+            cache = EmailCache(os.path.join(workspace, "emails.db"))
+            cache.store_messages(
+                "account", "inbox", 1, {1: {"Message Body": "Hel"}}, "partial:3"
+            )
+            get = partial(cache.get_messages, "account", "inbox", 1, [b"1"])
+            self.assertEqual(get("partial:3"), {1: {"Message Body": "Hel"}})
+            self.assertEqual(get("partial:0"), {})
+            self.assertEqual(get("full"), {})
+
+            cache.store_messages("account", "inbox", 1, {1: {"Message Body": "Hello"}})
+            self.assertEqual(get("full"), {1: {"Message Body": "Hello"}})
+            self.assertEqual(get("partial:3"), {})
+            cache.close()
+
+    def test_html_to_text(self):
+        html = (
+            "<!DOCTYPE html><html><head><style>p {}</style><script>var a;</script>"
+            "<title>T</title></head><body><!-- c --><p>a&amp;b&nbsp;x<br>y</p>"
+            "<![CDATA[z]]><?pi x?> 1 < 2 &lt;3<template>t</template></body></html>"
+        )
+        self.assertEqual(html_to_text(html), "Ta&b\xa0xyz 1 < 2 <3")
+        self.assertEqual(html_to_text("plain > text"), "plain > text")
+
+    def test_clean_email_body_plain_text(self):
+        self.assertEqual(clean_email_body(None), "")
+        self.assertEqual(
+            clean_email_body("Hi,\r\n\r\nsee  https://e.com/x\u2028 caf\xe9\n"),
+            "Hi,see  caf",
+        )
+
+    # Test reading several folders in parallel, merged by date
+    @patch("imaplib.IMAP4_SSL")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+        },
+    )
+    def test_read_emails_from_folders(self, mock_imap):
+        folders = {
+            "inbox": [
+                "Fri, 21 Apr 2023 10:00:00 -0000",
+                "Sun, 23 Apr 2023 10:00:00 -0000",
+            ],
+            "Sent": ["Sat, 22 Apr 2023 12:00:00 +0200"],
+            "Project": [],
+        }
+
+        fetched = []
+
+        def make_connection(server):
+            conn = MagicMock()
+            conn.select.side_effect = lambda folder: setattr(conn, "folder", folder)
+
+            def uid(command, *args):
+                dates = folders[conn.folder]
+                if command == "SEARCH":
+                    return "OK", [b" ".join(b"%d" % n for n in range(1, len(dates) + 1))]
+                uids = []
+                for item in args[0].split(b","):
+                    first, _, last = item.partition(b":")
+                    uids.extend(range(int(first), int(last or first) + 1))
+                data = []
+                for n in uids:
+                    message = EmailMessage()
+                    message["Date"] = dates[n - 1]
+                    if args[1].startswith("(BODY.PEEK[HEADER.FIELDS (DATE)])"):
+                        header = message.as_bytes()
+                        data.append((b"%d (UID %d BODY[HEADER.FIELDS (DATE)] {1}" % (n, n), header))
+                        continue
+                    fetched.append((conn.folder, n, args[1]))
+                    message["Subject"] = f"{conn.folder} {n}"
+                    message.set_content(MOCK_CONTENT)
+                    data.append((b"%d (UID %d RFC822 {1}" % (n, n), message.as_bytes()))
+                return "OK", data
+
+            conn.uid.side_effect = uid
+            return conn
+
+        mock_imap.side_effect = make_connection
+
+        with patch.dict(os.environ, {"EMAIL_MARK_AS_SEEN": "True"}):
+            result = read_emails_from_folders("inbox, Sent,Project", "ALL", 2, 1)
+        self.assertEqual(
+            [(m["Subject"], m["Folder"]) for m in result],
+            [("Sent 1", "Sent"), ("inbox 2", "inbox")],
+        )
+        # Only the emails of the page are fetched and marked as seen
+        self.assertEqual(
+            sorted(fetched), [("Sent", 1, "(RFC822)"), ("inbox", 2, "(RFC822)")]
+        )
+        result = read_emails_from_folders("inbox, Sent,Project", "ALL", 2, 2)
+        self.assertEqual([m["Subject"] for m in result], ["inbox 1"])
+        with self.assertRaises(ValueError):
+            read_emails_from_folders("inbox, Sent,Project", "ALL", 2, 3)
+        self.assertLessEqual(mock_imap.call_count, 3)
+
+        folders["inbox"] = []
+        folders["Sent"] = []
+        self.assertEqual(
+            read_emails_from_folders("inbox,Sent", "UNSEEN", 2, 1),
+            "There are no Emails in your folders `inbox, Sent` "
+            "when searching with imap command `UNSEEN`",
+        )
+
+    # Test that consecutive emails reuse one authenticated SMTP session
+    @patch("smtplib.SMTP", autospec=True)
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_SMTP_HOST": MOCK_SMTP_SERVER,
+            "EMAIL_SMTP_PORT": MOCK_SMTP_PORT,
+        },
+    )
+    def test_send_email_reuses_pooled_connection(self, mock_smtp):
+        send_email(MOCK_TO, MOCK_SUBJECT, MOCK_CONTENT)
+        send_email(MOCK_TO, MOCK_SUBJECT, MOCK_CONTENT)
+
+        mock_smtp.assert_called_once_with(MOCK_SMTP_SERVER, MOCK_SMTP_PORT)
+        mock_smtp.return_value.login.assert_called_once_with(MOCK_FROM, MOCK_PWD)
+        self.assertEqual(mock_smtp.return_value.send_message.call_count, 2)
+
+        smtp_pool.clear()
+        mock_smtp.return_value.quit.assert_called_once()
+
+    # Test that a disconnected SMTP session is replaced transparently
+    @patch("smtplib.SMTP")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_SMTP_HOST": MOCK_SMTP_SERVER,
+            "EMAIL_SMTP_PORT": MOCK_SMTP_PORT,
+        },
+    )
+    def test_send_email_reconnects_on_disconnect(self, mock_smtp):
+        stale, fresh = MagicMock(), MagicMock()
+        mock_smtp.side_effect = [stale, fresh]
+        stale.send_message.side_effect = smtplib.SMTPServerDisconnected()
+
+        result = send_email(MOCK_TO, MOCK_SUBJECT, MOCK_CONTENT)
+
+        assert result == f"Email was sent to {MOCK_TO}!"
+        fresh.login.assert_called_once_with(MOCK_FROM, MOCK_PWD)
+        fresh.send_message.assert_called_once()
+
+    # Test sending several emails with per-message status
+    @patch("smtplib.SMTP")
+    @patch.dict(
+        os.environ,
+        {
+            "EMAIL_ADDRESS": MOCK_FROM,
+            "EMAIL_PASSWORD": MOCK_PWD,
+            "EMAIL_SMTP_HOST": MOCK_SMTP_SERVER,
+            "EMAIL_SMTP_PORT": MOCK_SMTP_PORT,
+            "EMAIL_SMTP_MAX_CONNECTIONS": "2",
+        },
+    )
+    def test_send_emails(self, mock_smtp):
+        def send_message(msg):
+            if msg["To"] == "refused@example.com":
+                raise smtplib.SMTPRecipientsRefused({msg["To"]: (550, b"No")})
+
+        mock_smtp.return_value.send_message.side_effect = send_message
+
+        result = send_emails(
+            '[{"to": "a@example.com", "subject": "A", "body": "a"},'
+            ' ["refused@example.com", "B", "b"],'
+            ' {"to": "c@example.com", "subject": "C", "body": "c"}]'
+        )
+
+        self.assertEqual(
+            [(r["to"], r["status"]) for r in result],
+            [
+                ("a@example.com", "sent"),
+                ("refused@example.com", "error"),
+                ("c@example.com", "sent"),
+            ],
+        )
+        self.assertEqual(result[0]["result"], "Email was sent to a@example.com!")
+        self.assertEqual(mock_smtp.return_value.send_message.call_count, 3)
+        self.assertLessEqual(mock_smtp.call_count, 3)
+
+    @patch("time.sleep")
+    def test_rate_limiter(self, mock_sleep):
+        limiter = RateLimiter(2)
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertAlmostEqual(mock_sleep.call_args_list[-1].args[0], 1, places=1)
+
+    # Test that large attachments are streamed with bounded memory
+    def test_smtp_send_chunks_bounded_memory(self):
+        class FakeSMTP:
+            def __init__(self):
+                self.received = 0
+                self.tail = b""
+
+            def ehlo_or_helo_if_needed(self):
+                pass
+
+            def mail(self, from_addr):
+                return 250, b"OK"
+
+            def rcpt(self, to_addr):
+                return 250, b"OK"
+
+            def docmd(self, cmd):
+                return 354, b"Go ahead"
+
+            def send(self, data):
+                self.received += len(data)
+                self.tail = (self.tail + data)[-5:]
+
+            def getreply(self):
+                return 250, b"Queued"
+
+        attachment_size = 16 * 1024 * 1024
+        with tempfile.TemporaryDirectory() as workspace:
+            path = os.path.join(workspace, "large.bin")
+            with open(path, "wb") as fp:
+                for _ in range(attachment_size // (1024 * 1024)):
+                    fp.write(os.urandom(1024 * 1024))
+
+            message = EmailMessage()
+            message["From"] = MOCK_FROM
+            message["To"] = MOCK_TO
+            message["Subject"] = MOCK_SUBJECT
+            message.set_content(MOCK_CONTENT)
+            streamed = StreamedMimeMessage(
+                message, path, "application", "octet-stream", "large.bin"
+            )
+            smtp = FakeSMTP()
+
+            tracemalloc.start()
+            try:
+                smtp_send_chunks(smtp, MOCK_FROM, [MOCK_TO], streamed.chunks())
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertLess(peak, 1024 * 1024)
+        self.assertEqual(smtp.received, streamed.size + len(b".\r\n"))
+        self.assertEqual(smtp.tail, b"\r\n.\r\n")
+
+    def test_streamed_mime_message(self):
+        with tempfile.TemporaryDirectory() as workspace:
+            for attachment_size in (0, 1, 57, 58, 57 * 1024 + 1, 200000):
+                path = os.path.join(workspace, "file.bin")
+                attachment = os.urandom(attachment_size)
+                with open(path, "wb") as fp:
+                    fp.write(attachment)
+
+                message = EmailMessage()
+                message["From"] = MOCK_FROM
+                message["To"] = MOCK_TO
+                message["Subject"] = MOCK_SUBJECT
+                message.set_content(".leading dot\n")
+                streamed = StreamedMimeMessage(
+                    message, path, "application", "octet-stream", "file.bin"
+                )
+                data = b"".join(streamed.chunks())
+
+                self.assertEqual(len(data), streamed.size)
+                parsed = message_from_bytes(data)
+                text, part = parsed.get_payload()
+                self.assertEqual(text.get_payload(), ".leading dot\r\n")
+                self.assertEqual(part.get_filename(), "file.bin")
+                self.assertEqual(part.get_payload(decode=True), attachment)
+
+    def test_imap_append_chunks(self):
+        class FakeIMAP:
+            _encoding = "ascii"
+            abort = imaplib.IMAP4.abort
+
+            def __init__(self):
+                self.tagged_commands = {}
+                self.sent = b""
+
+            def _new_tag(self):
+                self.tagged_commands[b"A001"] = None
+                return b"A001"
+
+            def send(self, data):
+                self.sent += data
+
+            def _get_response(self):
+                return None  # continuation
+
+            def _command_complete(self, name, tag):
+                return "OK", [b"APPEND completed"]
+
+        conn = FakeIMAP()
+        result = imap_append_chunks(
+            conn, "Drafts", '"18-Oct-2026 10:00:00 +0000"', [b"a\r\n", b"bc"], 5
+        )
+
+        self.assertEqual(result, ("OK", [b"APPEND completed"]))
+        self.assertEqual(
+            conn.sent,
+            b'A001 APPEND Drafts "18-Oct-2026 10:00:00 +0000" {5}\r\na\r\nbc\r\n',
+        )
+
+    # Test that drafts with a large attachment are appended as a streamed literal
+    @patch("email_plugin.imap_append_chunks")
+    @patch("imaplib.IMAP4_SSL")
+    def test_send_emails_with_draft_mode_streamed(self, mock_imap, mock_append):
+        with tempfile.TemporaryDirectory() as workspace, patch.dict(
+            os.environ,
+            {
+                "EMAIL_ADDRESS": MOCK_FROM,
+                "EMAIL_PASSWORD": MOCK_PWD,
+                "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+                "EMAIL_DRAFT_MODE_WITH_FOLDER": MOCK_DRAFT_FOLDER,
+                "EMAIL_ATTACHMENT_STREAMING_THRESHOLD": "10",
+            },
+        ):
+            path = os.path.join(workspace, MOCK_ATTACHMENT_NAME)
+            with open(path, "wb") as fp:
+                fp.write(b"file_content" * 10)
+
+            result = send_email_with_attachment_internal(
+                MOCK_TO, MOCK_SUBJECT, MOCK_CONTENT, path, MOCK_ATTACHMENT_NAME
+            )
+
+            assert result == f"Email went to {MOCK_DRAFT_FOLDER}!"
+            mock_imap.return_value.append.assert_not_called()
+            conn, mailbox, _, chunks, size = mock_append.call_args.args
+            self.assertIs(conn, mock_imap.return_value)
+            self.assertEqual(mailbox, MOCK_DRAFT_FOLDER)
+            data = b"".join(chunks)
+            self.assertEqual(len(data), size)
+            self.assertIn(MOCK_ATTACHMENT_NAME.encode(), data)
+
+    def watch_local_server(self, capabilities, delay=0.2, uidnext=True):
+        server = self.imap_server = LocalImapServer(capabilities)
+        server.uidnext = uidnext
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+        with patch(
+            "imaplib.IMAP4_SSL", lambda host: imaplib.IMAP4("127.0.0.1", port)
+        ), patch.dict(
+            os.environ,
+            {
+                "EMAIL_ADDRESS": MOCK_FROM,
+                "EMAIL_PASSWORD": MOCK_PWD,
+                "EMAIL_IMAP_SERVER": MOCK_IMAP_SERVER,
+                "EMAIL_IDLE_POLL_INTERVAL": "0.05",
+            },
+        ):
+            self.assertEqual(watch_emails("inbox"), "Watching inbox for new emails")
+            self.assertEqual(get_new_emails(), "There are no new emails")
+            time.sleep(delay)
+            server.deliver()
+            server.deliver()
+            events = []
+            deadline = time.monotonic() + 5
+            while len(events) < 2 and time.monotonic() < deadline:
+                time.sleep(0.02)
+                events += mailbox_watcher.drain()
+        return events
+
+    # Test new mail notifications pushed with IDLE by a local IMAP server
+    def test_watch_emails_idle(self):
+        events = self.watch_local_server("IMAP4rev1 IDLE")
+        self.assertEqual(
+            events, [{"Folder": "inbox", "UID": 3}, {"Folder": "inbox", "UID": 4}]
+        )
+
+    # Test that IDLE outlasts quiet periods on the same connection
+    def test_watch_emails_idle_quiet_period(self):
+        events = self.watch_local_server("IMAP4rev1 IDLE", delay=2.5)
+        self.assertEqual(
+            events, [{"Folder": "inbox", "UID": 3}, {"Folder": "inbox", "UID": 4}]
+        )
+        self.assertEqual(self.imap_server.logins, 1)
+
+    # Test that the watcher finds the last UID on servers that omit UIDNEXT
+    def test_watch_emails_without_uidnext(self):
+        events = self.watch_local_server("IMAP4rev1 IDLE", uidnext=False)
+        self.assertEqual(
+            events, [{"Folder": "inbox", "UID": 3}, {"Folder": "inbox", "UID": 4}]
+        )
+        self.assertEqual(self.imap_server.logins, 1)
+
+    # Test the NOOP polling fallback for servers without IDLE
+    def test_watch_emails_polling(self):
+        events = self.watch_local_server("IMAP4rev1")
+        self.assertEqual(
+            events, [{"Folder": "inbox", "UID": 3}, {"Folder": "inbox", "UID": 4}]
+        )
+
+    # Test that IDLE sees an EXISTS response buffered with an earlier line
+    def test_imap_idle_buffered_exists(self):
+        server = LocalImapServer("IMAP4rev1 IDLE")
+        server.flag_updates = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        conn = imaplib.IMAP4("127.0.0.1", server.server_address[1])
+        self.addCleanup(conn.shutdown)
+        conn.login(MOCK_FROM, MOCK_PWD)
+        conn.select("inbox")
+
+        threading.Timer(0.3, server.deliver).start()
+        start = time.monotonic()
+        _imap_idle(conn, threading.Event(), 5)
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(conn.noop()[0], "OK")
+
+    def test_get_new_emails_not_watching(self):
+        self.assertEqual(
+            get_new_emails(),
+            "No folders are being watched, start watching them with watch_emails",
+        )
+
 if __name__ == "__main__":
     unittest.main()
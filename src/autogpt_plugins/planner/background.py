@@ -0,0 +1,88 @@
+"""Background planning cycles for the planner plugin."""
+import threading
+import time
+from typing import Callable, Optional
+
+
+class BackgroundPlanner:
+    """Runs planning cycles on a worker thread, one at a time.
+
+    A cycle requested while another is running is queued, and any further
+    requests are merged into it, since a cycle always plans from the latest plan
+    and tasks.
+    """
+
+    def __init__(self, run: Callable[[], str], snapshot: Callable[[], str]):
+        """
+        Args:
+            run (callable): Runs a planning cycle and returns the new plan.
+            snapshot (callable): Returns a fingerprint of what the plan is made
+                from, taken when a cycle starts to tell whether it is stale.
+        """
+        self.run = run
+        self.snapshot = snapshot
+        self.started_at: Optional[float] = None
+        self.completed_at: Optional[float] = None
+        self.completed_snapshot: Optional[str] = None
+        self.error: Optional[str] = None
+        self._running = False
+        self._pending = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def schedule(self) -> bool:
+        """Request a planning cycle, and return False if it is queued behind a running one."""
+        with self._lock:
+            if self._running:
+                self._pending = True
+                return False
+            self._running = True
+        threading.Thread(target=self._work, name="planner", daemon=True).start()
+        return True
+
+    def status(self) -> str:
+        """Describe whether the last completed plan is up to date."""
+        with self._lock:
+            running, started_at = self._running, self.started_at
+            completed_at, completed_snapshot, error = self.completed_at, self.completed_snapshot, self.error
+        now = time.time()
+        if running:
+            status = f"stale, a planning cycle started {now - started_at:.0f} seconds ago is running."
+        elif error is not None:
+            status = f"the last planning cycle failed: {error}"
+        elif completed_at is None:
+            return "Plan status: no planning cycle completed yet, use run_planning_cycle to update the plan."
+        elif completed_snapshot != self.snapshot():
+            status = "stale, the tasks changed since it was planned, use run_planning_cycle to update it."
+        else:
+            status = "up to date."
+        if completed_at is not None:
+            status += f" The plan was last updated {now - completed_at:.0f} seconds ago."
+        return "Plan status: " + status
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no cycle is running or queued, and return False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._running, timeout)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                self._pending = False
+                self.started_at = time.time()
+            try:
+                snapshot = self.snapshot()
+                self.run()
+            except Exception as e:
+                with self._lock:
+                    self.error = f"{type(e).__name__}: {e}"
+            else:
+                with self._lock:
+                    self.error = None
+                    self.completed_at = time.time()
+                    self.completed_snapshot = snapshot
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    self._idle.notify_all()
+                    return
@@ -0,0 +1,157 @@
+"""Incremental plan regeneration for the planner plugin.
+
+The plan is split into its markdown sections, and the sections and tasks are
+hashed after every planning cycle, so the next cycle only sends what changed
+since, and patches the sections the model returns back into the plan.
+"""
+import hashlib
+import json
+import os
+import re
+from typing import List, Optional, Tuple
+
+_HEADING = re.compile(r"^\s*#{1,6}\s")
+_CHECKLIST_ITEM = re.compile(r"^\s*[-*]\s+\[[ xX]\]", re.MULTILINE)
+_CODE_FENCE = re.compile(r"^```[\w-]*\n|\n?```$")
+
+# The text of the plan before its first heading
+PREAMBLE = ""
+
+
+def split_sections(plan: str) -> List[Tuple[str, str]]:
+    """Split a plan into (key, text) sections, each starting at a heading.
+
+    The key is the stripped heading line, numbered when a heading repeats. Text
+    before the first heading is the PREAMBLE section.
+    """
+    sections = []
+    heading, lines = PREAMBLE, []
+    for line in plan.splitlines(keepends=True):
+        if _HEADING.match(line):
+            if lines:
+                sections.append((heading, "".join(lines)))
+            heading, lines = line.strip(), []
+        lines.append(line)
+    if lines:
+        sections.append((heading, "".join(lines)))
+
+    keys = []
+    seen = {}
+    for heading, text in sections:
+        seen[heading] = seen.get(heading, 0) + 1
+        keys.append((heading if seen[heading] == 1 else f"{heading} ({seen[heading]})", text))
+    return keys
+
+
+def fingerprint(value) -> str:
+    """Return the hash of a section text or a task record."""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def plan_state(plan: str, tasks: dict) -> dict:
+    """Return the hashes of the sections of a plan and of the tasks."""
+    return {
+        "sections": {key: fingerprint(text) for key, text in split_sections(plan)},
+        "tasks": {task_id: fingerprint(task) for task_id, task in tasks.items()},
+    }
+
+
+def load_state(path: str) -> Optional[dict]:
+    """Return the state saved by the last planning cycle, or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        try:
+            state = json.load(f)
+        except json.JSONDecodeError:
+            return None
+    return state if isinstance(state, dict) and "sections" in state and "tasks" in state else None
+
+
+def save_state(path: str, plan: str, tasks: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(plan_state(plan, tasks), f)
+
+
+def find_changes(plan: str, tasks: dict, state: dict) -> Tuple[List[Tuple[str, str]], dict, List[str]]:
+    """Compare a plan and tasks to the state of the last cycle.
+
+    Returns:
+        tuple: The sections that changed, the tasks that changed and the ids of
+            the tasks that were removed. When tasks changed, the sections
+            tracking tasks with a checklist are returned as changed too.
+    """
+    changed_tasks = {
+        task_id: task for task_id, task in tasks.items()
+        if state["tasks"].get(task_id) != fingerprint(task)
+    }
+    removed_tasks = [task_id for task_id in state["tasks"] if task_id not in tasks]
+    changed_sections = [
+        (key, text) for key, text in split_sections(plan)
+        if state["sections"].get(key) != fingerprint(text)
+        or ((changed_tasks or removed_tasks) and _CHECKLIST_ITEM.search(text))
+    ]
+    return changed_sections, changed_tasks, removed_tasks
+
+
+def delta_prompt(plan: str, tasks: dict, changed_sections: List[Tuple[str, str]], changed_tasks: dict,
+                 removed_tasks: List[str]) -> str:
+    """Build the prompt asking for the sections of the plan that need updating.
+
+    Only the changed sections and tasks are sent in full, along with the outline
+    of the plan and the number of completed tasks.
+    """
+    changed_keys = {key for key, _ in changed_sections}
+    outline = "\n".join(
+        f"{key or '(text before the first heading)'}{' (shown below)' if key in changed_keys else ''}"
+        for key, _ in split_sections(plan)
+    )
+    completed = sum(1 for task in tasks.values() if task.get("completed"))
+    sections = "\n".join(text.rstrip("\n") for _, text in changed_sections) or "(none)"
+    return (
+        f"Outline of the current plan, in .md format:\n{outline}\n\n"
+        f"{completed} of {len(tasks)} tasks are completed. Tasks created or updated since the last revision:\n"
+        f"{json.dumps(changed_tasks)}\n"
+        f"Tasks removed since the last revision: {json.dumps(removed_tasks)}\n\n"
+        f"Sections of the plan that changed or track tasks:\n{sections}\n\n"
+        f"Update these sections given the task status, keep the .md format and track the tasks with a checklist. "
+        f"Return only the sections that need changes, each starting with its heading line unchanged. "
+        f"You may add new sections with new headings."
+    )
+
+
+def patch_plan(plan: str, update: str, changed_sections: List[Tuple[str, str]]) -> str:
+    """Replace the sections of a plan returned by the model, and append its new sections.
+
+    Text the model returns before its first heading only replaces the preamble
+    of the plan if the preamble was sent to it. A heading that repeats in the
+    plan is matched to the changed sections with that heading, in order.
+    """
+    update = _CODE_FENCE.sub("", update.strip())
+    sections = dict(split_sections(plan))
+    order = list(sections)
+    targets = {}
+    for key, text in changed_sections:
+        targets.setdefault(_heading(key, text), []).append(key)
+    for key, text in split_sections(update):
+        if key == PREAMBLE and PREAMBLE not in targets:
+            continue
+        if targets.get(_heading(key, text)):
+            key = targets[_heading(key, text)].pop(0)
+        # Keep the blank lines separating the section from the next one
+        separator = "\n"
+        if key in sections:
+            separator = sections[key][len(sections[key].rstrip("\n")):] or "\n"
+        else:
+            if order:
+                sections[order[-1]] = sections[order[-1]].rstrip("\n") + "\n\n"
+            order.append(key)
+        sections[key] = text.rstrip("\n") + separator
+    return "".join(sections[key] if sections[key].endswith("\n") else sections[key] + "\n" for key in order)
+
+
+def _heading(key: str, text: str) -> str:
+    """Return the heading line of a section, without the number of a repeated heading."""
+    return PREAMBLE if key == PREAMBLE else text.splitlines()[0].strip()
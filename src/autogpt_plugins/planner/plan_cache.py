@@ -0,0 +1,62 @@
+"""Content-addressed cache of the planner's chat completions."""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+
+class PlanCache:
+    """Stores the model's answers in the workspace, one file per request.
+
+    A request is identified by the hash of its messages, which hold the plan and
+    the tasks, and of the model, temperature and token limit, so identical
+    planning requests are answered without calling the model until the answer
+    is older than the TTL.
+    """
+
+    def __init__(self, directory: str, ttl: float):
+        """
+        Args:
+            directory (str): The directory of the cached answers.
+            ttl (float): Seconds an answer is reused for.
+        """
+        self.directory = directory
+        self.ttl = ttl
+
+    @staticmethod
+    def key(messages: list, model: str, max_tokens: int, temperature: float) -> str:
+        """Return the hash identifying a chat completion request."""
+        request = {"messages": messages, "model": model, "temperature": temperature, "max_tokens": max_tokens}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the answer to a request if it is cached and younger than the TTL."""
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created", 0) > self.ttl:
+            return None
+        return entry.get("answer")
+
+    def put(self, key: str, answer: str) -> None:
+        """Store the answer to a request, and remove the expired ones."""
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        fd, temporary_path = tempfile.mkstemp(prefix=".plan_", dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"created": now, "answer": answer}, f)
+        os.replace(temporary_path, self._path(key))
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") and now - entry.stat().st_mtime > self.ttl:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
@@ -1,5 +1,17 @@
-import json
 import os
+import threading
+
+from .background import BackgroundPlanner
+from .incremental import delta_prompt, fingerprint, find_changes, load_state, patch_plan, save_state
+from .plan_cache import PlanCache
+from .task_store import TaskStore
+
+# The task store of every workspace, the workspace being relative to the working directory
+_task_stores = {}
+_task_stores_lock = threading.Lock()
+
+# The background planner of every workspace, if PLANNER_BACKGROUND is True
+_background_planners = {}
 
 
 def check_plan():
@@ -27,121 +39,204 @@ def check_plan():
         print(f"{file_name} created.")
 
     with open(file_name, "r") as file:
-        return file.read()
+        plan = file.read()
 
+    if os.getenv('PLANNER_BACKGROUND', 'False').lower() == 'true':
+        return f"{plan}\n\n{get_background_planner().status()}"
+    return plan
 
-def update_plan():
-    """this function checks if the file plan.md exists, if it doesn't exist it gets created"""
+
+def update_plan(bypass_cache=None):
+    """this function improves plan.md, on a worker thread if PLANNER_BACKGROUND is True"""
+
+    if os.getenv('PLANNER_BACKGROUND', 'False').lower() == 'true':
+        if get_background_planner().schedule():
+            return "Planning cycle started in the background, use check_plan to read the plan once it is updated."
+        return "A planning cycle is already running, the plan will be updated again once it is done."
+
+    return update_plan_now(bypass_cache)
+
+
+def update_plan_now(bypass_cache=None):
+    """this function improves plan.md, sending only the changes since the last cycle if PLANNER_INCREMENTAL is True"""
 
     current_working_directory = os.getcwd()
     workdir = os.path.join(current_working_directory, 'auto_gpt_workspace', 'plan.md')
 
     file_name = workdir
+    state_file_name = os.path.join(current_working_directory, 'auto_gpt_workspace', 'plan_state.json')
+    incremental = os.getenv('PLANNER_INCREMENTAL', 'False').lower() == 'true'
 
     with open(file_name, 'r') as file:
         data = file.read()
 
-    response = generate_improved_plan(data)
-
-    with open(file_name, "w") as file:
+    tasks = load_tasks()
+    state = load_state(state_file_name) if incremental else None
+    if state is None:
+        response = generate_improved_plan(data, bypass_cache)
+    else:
+        changed_sections, changed_tasks, removed_tasks = find_changes(data, tasks, state)
+        if not changed_sections and not changed_tasks and not removed_tasks:
+            print(f"{file_name} is up to date.")
+            return data
+        update = generate_plan_update(delta_prompt(data, tasks, changed_sections, changed_tasks, removed_tasks),
+                                      bypass_cache)
+        response = patch_plan(data, update, changed_sections)
+
+    # Replace the plan at once, check_plan may be reading it from another thread
+    with open(file_name + ".tmp", "w") as file:
         file.write(response)
+    os.replace(file_name + ".tmp", file_name)
     print(f"{file_name} updated.")
 
+    if incremental:
+        save_state(state_file_name, response, tasks)
+
     return response
 
 
-def generate_improved_plan(prompt: str) -> str:
+def generate_improved_plan(prompt: str, bypass_cache=None) -> str:
     """Generate an improved plan using OpenAI's ChatCompletion functionality"""
 
-    import openai
-
     tasks = load_tasks()
 
-    model = os.getenv('PLANNER_MODEL', os.getenv('FAST_LLM_MODEL', 'gpt-3.5-turbo'))
-    max_tokens = os.getenv('PLANNER_TOKEN_LIMIT', os.getenv('FAST_TOKEN_LIMIT', 1500))
-    temperature = os.getenv('PLANNER_TEMPERATURE', os.getenv('TEMPERATURE', 0.5))
+    improved_plan = chat_completion(improved_plan_messages(prompt, tasks), bypass_cache)
 
-    # Call the OpenAI API for chat completion
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[
+    # The next cycle sends the improved plan itself, so if neither the plan nor the tasks change until then, it is
+    # answered with the same plan
+    cache = get_plan_cache()
+    if cache is not None:
+        cache.put(plan_cache_key(improved_plan_messages(improved_plan, tasks)), improved_plan)
+
+    return improved_plan
+
+
+def improved_plan_messages(prompt: str, tasks: dict) -> list:
+    return [
+        {
+            "role": "system",
+            "content": "You are an assistant that improves and adds crucial points to plans in .md format.",
+        },
+        {
+            "role": "user",
+            "content": f"Update the following plan given the task status below, keep the .md format:\n{prompt}\n"
+                       f"Include the current tasks in the improved plan, keep mind of their status and track them "
+                       f"with a checklist:\n{tasks}\n Revised version should comply with the contents of the "
+                       f"tasks at hand:",
+        },
+    ]
+
+
+def generate_plan_update(prompt: str, bypass_cache=None) -> str:
+    """Generate the updated sections of a plan from a prompt built by incremental.delta_prompt"""
+
+    return chat_completion(
+        [
             {
                 "role": "system",
-                "content": "You are an assistant that improves and adds crucial points to plans in .md format.",
-            },
-            {
-                "role": "user",
-                "content": f"Update the following plan given the task status below, keep the .md format:\n{prompt}\n"
-                           f"Include the current tasks in the improved plan, keep mind of their status and track them "
-                           f"with a checklist:\n{tasks}\n Revised version should comply with the contents of the "
-                           f"tasks at hand:",
+                "content": "You are an assistant that improves and adds crucial points to plans in .md format. "
+                           "You only return the sections of the plan you change.",
             },
+            {"role": "user", "content": prompt},
         ],
-        max_tokens=int(max_tokens),
-        n=1,
-        temperature=float(temperature),
+        bypass_cache,
     )
 
-    # Extract the improved plan from the response
-    improved_plan = response.choices[0].message.content.strip()
-    return improved_plan
 
+def chat_completion(messages: list, bypass_cache=None) -> str:
+    """Send messages to OpenAI's ChatCompletion with the planner's model settings and return the answer
 
-def create_task(task_id=None, task_description: str = None, status=False):
-    task = {"description": task_description, "completed": status}
-    tasks = load_tasks()
-    tasks[str(task_id)] = task
+    Answers are cached for PLANNER_CACHE_TTL seconds, see get_plan_cache. With bypass_cache, or
+    PLANNER_CACHE_BYPASS=True by default, the model is called anyway and its answer replaces the cached one.
+    """
 
-    current_working_directory = os.getcwd()
-    workdir = os.path.join(
-        current_working_directory, "auto_gpt_workspace", "tasks.json"
+    model, max_tokens, temperature = model_settings()
+
+    if bypass_cache is None:
+        bypass_cache = os.getenv('PLANNER_CACHE_BYPASS', 'False').lower() == 'true'
+    cache = get_plan_cache()
+    key = plan_cache_key(messages)
+    if cache is not None and not bypass_cache:
+        answer = cache.get(key)
+        if answer is not None:
+            return answer
+
+    import openai
+
+    # Call the OpenAI API for chat completion
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        n=1,
+        temperature=temperature,
     )
-    file_name = workdir
 
-    with open(file_name, "w") as f:
-        json.dump(tasks, f)
+    # Extract the answer from the response
+    answer = response.choices[0].message.content.strip()
+    if cache is not None:
+        cache.put(key, answer)
+    return answer
 
-    return tasks
 
+def model_settings():
+    """Return the model, token limit and temperature the planner uses"""
 
-def load_tasks() -> dict:
-    current_working_directory = os.getcwd()
-    workdir = os.path.join(
-        current_working_directory, "auto_gpt_workspace", "tasks.json"
-    )
-    file_name = workdir
+    model = os.getenv('PLANNER_MODEL', os.getenv('FAST_LLM_MODEL', 'gpt-3.5-turbo'))
+    max_tokens = os.getenv('PLANNER_TOKEN_LIMIT', os.getenv('FAST_TOKEN_LIMIT', 1500))
+    temperature = os.getenv('PLANNER_TEMPERATURE', os.getenv('TEMPERATURE', 0.5))
+    return model, int(max_tokens), float(temperature)
 
-    if not os.path.exists(file_name):
-        with open(file_name, "w") as f:
-            f.write("{}")
 
-    with open(file_name) as f:
-        try:
-            tasks = json.load(f)
-            if isinstance(tasks, list):
-                tasks = {}
-        except json.JSONDecodeError:
-            tasks = {}
+def get_plan_cache():
+    """Return the cache of the model's answers in auto_gpt_workspace/plan_cache, or None if PLANNER_CACHE_TTL is 0"""
 
-    return tasks
+    ttl = float(os.getenv('PLANNER_CACHE_TTL', 3600))
+    if ttl <= 0:
+        return None
+    return PlanCache(os.path.join(os.getcwd(), 'auto_gpt_workspace', 'plan_cache'), ttl)
 
 
-def update_task_status(task_id):
-    tasks = load_tasks()
+def plan_cache_key(messages: list) -> str:
+    return PlanCache.key(messages, *model_settings())
 
-    if str(task_id) not in tasks:
-        print(f"Task with ID {task_id} not found.")
-        return
 
-    tasks[str(task_id)]["completed"] = True
+def get_background_planner() -> BackgroundPlanner:
+    """Return the background planner of the current workspace, creating it if needed"""
+    workspace = os.path.join(os.getcwd(), "auto_gpt_workspace")
+    with _task_stores_lock:
+        planner = _background_planners.get(workspace)
+        if planner is None:
+            planner = BackgroundPlanner(update_plan_now, lambda: fingerprint(load_tasks()))
+            _background_planners[workspace] = planner
+    return planner
 
-    current_working_directory = os.getcwd()
-    workdir = os.path.join(
-        current_working_directory, "auto_gpt_workspace", "tasks.json"
-    )
-    file_name = workdir
 
-    with open(file_name, "w") as f:
-        json.dump(tasks, f)
+def get_task_store() -> TaskStore:
+    """Return the task store of the current workspace, opening it if needed"""
+    workspace = os.path.join(os.getcwd(), "auto_gpt_workspace")
+    with _task_stores_lock:
+        store = _task_stores.get(workspace)
+        if store is None:
+            store = TaskStore(os.path.join(workspace, "tasks.db"), os.path.join(workspace, "tasks.json"))
+            _task_stores[workspace] = store
+    return store
+
+
+def create_task(task_id=None, task_description: str = None, status=False):
+    store = get_task_store()
+    store.put(task_id, task_description, status)
+
+    return store.all()
+
+
+def load_tasks() -> dict:
+    return get_task_store().all()
+
+
+def update_task_status(task_id):
+    if not get_task_store().set_completed(task_id):
+        print(f"Task with ID {task_id} not found.")
+        return
 
     return f"Task with ID {task_id} has been marked as completed."
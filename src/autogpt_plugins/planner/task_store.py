@@ -0,0 +1,144 @@
+"""SQLite task store for the planner plugin."""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Optional
+
+
+class TaskStore:
+    """Keeps the planner's tasks in a SQLite database in WAL mode.
+
+    Every task is a row indexed by its id and status, so creating or completing
+    a task writes a single row, and every write is a transaction, so agents
+    sharing a workspace don't overwrite each other's tasks.
+
+    Reads are served from a copy of the tasks kept in memory, updated by this
+    process's writes and reloaded only once SQLite's data_version shows that
+    another connection changed the database.
+    """
+
+    def __init__(self, path: str, json_path: Optional[str] = None):
+        """
+        Args:
+            path (str): The SQLite database.
+            json_path (str): The tasks.json file. Its tasks are imported into a
+                new database, and it is rewritten after every change if
+                PLANNER_EXPORT_TASKS_JSON is True.
+        """
+        self.path = path
+        self.json_path = json_path
+        self.export_json = os.getenv("PLANNER_EXPORT_TASKS_JSON", "False").lower() == "true"
+        self._local = threading.local()
+
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks "
+                "(id TEXT PRIMARY KEY, description TEXT, completed INTEGER NOT NULL DEFAULT 0)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS tasks_completed ON tasks (completed)")
+            imported = connection.execute("PRAGMA user_version").fetchone()[0]
+            if not imported:
+                # Import the tasks of the JSON file the planner used before
+                for task_id, task in self._read_json().items():
+                    connection.execute(
+                        "INSERT OR IGNORE INTO tasks (id, description, completed) VALUES (?, ?, ?)",
+                        (task_id, task.get("description"), bool(task.get("completed"))),
+                    )
+                connection.execute("PRAGMA user_version = 1")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def put(self, task_id, description: Optional[str], completed: bool = False) -> None:
+        """Create a task, or replace the one with the same id."""
+        task_id = str(task_id)
+        self._write(
+            "INSERT INTO tasks (id, description, completed) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET description = excluded.description, completed = excluded.completed",
+            (task_id, description, bool(completed)),
+        )
+        tasks = getattr(self._local, "tasks", None)
+        if tasks is not None:
+            tasks[task_id] = {"description": description, "completed": bool(completed)}
+        self._export()
+
+    def set_completed(self, task_id, completed: bool = True) -> bool:
+        """Set the status of a task, and return False if there is no such task."""
+        task_id = str(task_id)
+        if not self._write("UPDATE tasks SET completed = ? WHERE id = ?", (bool(completed), task_id)):
+            return False
+        tasks = getattr(self._local, "tasks", None)
+        if tasks is not None and task_id in tasks:
+            tasks[task_id]["completed"] = bool(completed)
+        self._export()
+        return True
+
+    def get(self, task_id) -> Optional[dict]:
+        """Return a task, or None."""
+        task = self._load().get(str(task_id))
+        return dict(task) if task is not None else None
+
+    def all(self, completed: Optional[bool] = None) -> Dict[str, dict]:
+        """Return the tasks in the order they were created, all of them or those with a status."""
+        return {
+            task_id: dict(task)
+            for task_id, task in self._load().items()
+            if completed is None or task["completed"] == bool(completed)
+        }
+
+    def export(self, json_path: Optional[str] = None) -> None:
+        """Write the tasks to a JSON file in the format of tasks.json, replacing it at once."""
+        json_path = json_path or self.json_path
+        fd, temporary_path = tempfile.mkstemp(prefix=".tasks_", dir=os.path.dirname(os.path.abspath(json_path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.all(), f)
+        os.replace(temporary_path, json_path)
+
+    def _load(self) -> Dict[str, dict]:
+        """Return this thread's copy of the tasks, reloading it if another connection changed them."""
+        connection = self._connect()
+        # data_version changes when another connection commits, but not on this
+        # connection's own writes, which update the copy instead
+        data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+        tasks = getattr(self._local, "tasks", None)
+        if tasks is None or data_version != self._local.data_version:
+            rows = connection.execute("SELECT id, description, completed FROM tasks ORDER BY rowid")
+            tasks = {task_id: {"description": description, "completed": bool(done)} for task_id, description, done in rows}
+            self._local.tasks = tasks
+            self._local.data_version = data_version
+        return tasks
+
+    def _write(self, statement: str, parameters: tuple) -> int:
+        """Run a write in its own transaction and return the number of rows changed."""
+        return self._connect().execute(statement, parameters).rowcount
+
+    def _export(self) -> None:
+        if self.export_json and self.json_path:
+            self.export()
+
+    def _read_json(self) -> Dict[str, dict]:
+        if not self.json_path or not os.path.exists(self.json_path):
+            return {}
+        with open(self.json_path) as f:
+            try:
+                tasks = json.load(f)
+            except json.JSONDecodeError:
+                return {}
+        if not isinstance(tasks, dict):
+            return {}
+        return {str(task_id): task for task_id, task in tasks.items() if isinstance(task, dict)}
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection to the database."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
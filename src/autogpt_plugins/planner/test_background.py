@@ -0,0 +1,87 @@
+import threading
+import unittest
+try:
+    from .background import BackgroundPlanner
+except ImportError:
+    from background import BackgroundPlanner
+
+
+class TestBackgroundPlanner(unittest.TestCase):
+    def setUp(self):
+        self.tasks = "v1"
+        self.runs = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.planner = BackgroundPlanner(self.run_cycle, lambda: self.tasks)
+
+    def run_cycle(self):
+        self.runs += 1
+        self.started.set()
+        if not self.release.wait(5):
+            raise RuntimeError("not released")
+        return "plan"
+
+    def test_requests_during_a_cycle_are_merged(self):
+        """Test that the cycles requested while one is running are merged into a single queued cycle."""
+        self.release.clear()
+        self.assertTrue(self.planner.schedule())
+        self.assertTrue(self.started.wait(5))
+        self.assertFalse(self.planner.schedule())
+        self.assertFalse(self.planner.schedule())
+        self.assertFalse(self.planner.wait(0.05))
+
+        self.release.set()
+        self.assertTrue(self.planner.wait(5))
+        self.assertEqual(self.runs, 2)
+
+        # Once idle, a new request starts a cycle again
+        self.assertTrue(self.planner.schedule())
+        self.assertTrue(self.planner.wait(5))
+        self.assertEqual(self.runs, 3)
+
+    def test_status(self):
+        """Test that the status tells whether the plan is up to date, stale or being planned."""
+        self.assertIn("no planning cycle completed yet", self.planner.status())
+
+        self.planner.schedule()
+        self.assertTrue(self.planner.wait(5))
+        self.assertIn("up to date.", self.planner.status())
+
+        self.tasks = "v2"
+        self.assertIn("stale, the tasks changed since it was planned", self.planner.status())
+
+        self.release.clear()
+        self.started.clear()
+        self.planner.schedule()
+        self.assertTrue(self.started.wait(5))
+        self.assertIn("is running", self.planner.status())
+        self.release.set()
+        self.assertTrue(self.planner.wait(5))
+        self.assertIn("up to date.", self.planner.status())
+
+    def test_status_snapshot_taken_when_the_cycle_starts(self):
+        """Test that tasks changed while a cycle runs leave the plan stale."""
+        self.release.clear()
+        self.planner.schedule()
+        self.assertTrue(self.started.wait(5))
+        self.tasks = "v2"
+        self.release.set()
+        self.assertTrue(self.planner.wait(5))
+        self.assertIn("stale, the tasks changed", self.planner.status())
+
+    def test_failed_cycle(self):
+        """Test that a failed cycle is reported until a cycle succeeds."""
+        planner = BackgroundPlanner(lambda: 1 / 0, lambda: self.tasks)
+        planner.schedule()
+        self.assertTrue(planner.wait(5))
+        self.assertIn("the last planning cycle failed: ZeroDivisionError", planner.status())
+
+        planner.run = self.run_cycle
+        planner.schedule()
+        self.assertTrue(planner.wait(5))
+        self.assertIn("up to date.", planner.status())
+
+
+if __name__ == "__main__":
+    unittest.main()
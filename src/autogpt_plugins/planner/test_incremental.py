@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import unittest
+try:
+    from .incremental import PREAMBLE, delta_prompt, find_changes, load_state, patch_plan, plan_state, save_state, \
+        split_sections
+except ImportError:
+    from incremental import PREAMBLE, delta_prompt, find_changes, load_state, patch_plan, plan_state, save_state, \
+        split_sections
+
+PLAN = "Intro\n\n# Goals\nShip it\n\n# Tasks\n- [ ] 1: Write\n"
+TASKS = {"1": {"description": "Write", "completed": False}}
+SECTIONS = dict(split_sections(PLAN))
+
+
+class TestIncremental(unittest.TestCase):
+    def test_split_sections(self):
+        """Test that a plan is split at its headings, and repeated headings are numbered."""
+        self.assertEqual(split_sections("Intro\n# A\nx\n\n## B\ny\n# A\nz"),
+                         [(PREAMBLE, "Intro\n"), ("# A", "# A\nx\n\n"), ("## B", "## B\ny\n"), ("# A (2)", "# A\nz")])
+        self.assertEqual(split_sections(""), [])
+
+    def test_find_changes(self):
+        """Test that only the changed sections and tasks are found, along with the checklists when tasks changed."""
+        state = plan_state(PLAN, TASKS)
+        self.assertEqual(find_changes(PLAN, TASKS, state), ([], {}, []))
+
+        plan = PLAN.replace("Ship it", "Ship it soon")
+        self.assertEqual(find_changes(plan, TASKS, state), ([("# Goals", "# Goals\nShip it soon\n\n")], {}, []))
+
+        tasks = {"1": {"description": "Write", "completed": True}, "2": {"description": "Test", "completed": False}}
+        self.assertEqual(find_changes(PLAN, tasks, state), ([("# Tasks", "# Tasks\n- [ ] 1: Write\n")], tasks, []))
+        self.assertEqual(find_changes(PLAN, {}, state), ([("# Tasks", "# Tasks\n- [ ] 1: Write\n")], {}, ["1"]))
+
+    def test_find_changes_with_duplicate_headings(self):
+        """Test that a change to one of several sections with the same heading only returns that section."""
+        plan = "# Notes\na\n\n# Notes\nb\n"
+        state = plan_state(plan, {})
+        self.assertEqual(find_changes("# Notes\na\n\n# Notes\nc\n", {}, state),
+                         ([("# Notes (2)", "# Notes\nc\n")], {}, []))
+
+    def test_save_and_load_state(self):
+        """Test that the state is saved, and that a missing or invalid state file is ignored."""
+        with tempfile.TemporaryDirectory() as workspace:
+            path = os.path.join(workspace, "plan_state.json")
+            self.assertIsNone(load_state(path))
+            save_state(path, PLAN, TASKS)
+            self.assertEqual(load_state(path), plan_state(PLAN, TASKS))
+
+            for invalid in ("{not json", json.dumps({"sections": {}}), json.dumps([1])):
+                with open(path, "w") as f:
+                    f.write(invalid)
+                self.assertIsNone(load_state(path))
+
+    def test_delta_prompt(self):
+        """Test that the prompt holds the outline of the plan and only the changed sections and tasks."""
+        changed_sections = [("# Tasks", "# Tasks\n- [ ] 1: Write\n")]
+        tasks = {"1": {"description": "Write", "completed": True}, "2": {"description": "Test", "completed": False}}
+        prompt = delta_prompt(PLAN, tasks, changed_sections, {"2": tasks["2"]}, ["3"])
+
+        self.assertIn("(text before the first heading)\n# Goals\n# Tasks (shown below)\n", prompt)
+        self.assertIn("1 of 2 tasks are completed", prompt)
+        self.assertIn(json.dumps({"2": tasks["2"]}), prompt)
+        self.assertIn('Tasks removed since the last revision: ["3"]', prompt)
+        self.assertIn("- [ ] 1: Write", prompt)
+        self.assertNotIn("Ship it", prompt)
+
+    def test_patch_plan_replaces_sections(self):
+        """Test that the returned sections replace those of the plan, keeping the blank lines between sections."""
+        update = "# Goals\nShip it today"
+        self.assertEqual(patch_plan(PLAN, update, [("# Goals", SECTIONS["# Goals"])]),
+                         "Intro\n\n# Goals\nShip it today\n\n# Tasks\n- [ ] 1: Write\n")
+
+    def test_patch_plan_preamble(self):
+        """Test that the text before the first heading only replaces the preamble if the preamble was sent."""
+        update = "Here is the update:\n# Goals\nShip it today\n"
+        self.assertEqual(patch_plan(PLAN, update, [("# Goals", SECTIONS["# Goals"])]),
+                         "Intro\n\n# Goals\nShip it today\n\n# Tasks\n- [ ] 1: Write\n")
+        changed_sections = [(PREAMBLE, SECTIONS[PREAMBLE]), ("# Goals", SECTIONS["# Goals"])]
+        self.assertEqual(patch_plan(PLAN, "New intro\n# Goals\nShip it today\n", changed_sections),
+                         "New intro\n\n# Goals\nShip it today\n\n# Tasks\n- [ ] 1: Write\n")
+
+    def test_patch_plan_code_fence(self):
+        """Test that the code fence the model may wrap its answer in is removed."""
+        update = "```markdown\n# Tasks\n- [x] 1: Write\n```"
+        self.assertEqual(patch_plan(PLAN, update, [("# Tasks", SECTIONS["# Tasks"])]),
+                         "Intro\n\n# Goals\nShip it\n\n# Tasks\n- [x] 1: Write\n")
+
+    def test_patch_plan_appends_new_sections(self):
+        """Test that sections with new headings are appended to the plan."""
+        self.assertEqual(patch_plan(PLAN, "# Risks\nNone", [("# Goals", SECTIONS["# Goals"])]),
+                         "Intro\n\n# Goals\nShip it\n\n# Tasks\n- [ ] 1: Write\n\n# Risks\nNone\n")
+
+    def test_patch_plan_duplicate_headings(self):
+        """Test that a returned heading that repeats in the plan replaces the changed section with that heading."""
+        plan = "# Notes\na\n\n# Notes\nb\n"
+        changed_sections = [("# Notes (2)", "# Notes\nb\n")]
+        self.assertEqual(patch_plan(plan, "# Notes\nc", changed_sections), "# Notes\na\n\n# Notes\nc\n")
+
+        changed_sections = [("# Notes", "# Notes\na\n\n"), ("# Notes (2)", "# Notes\nb\n")]
+        self.assertEqual(patch_plan(plan, "# Notes\nc\n# Notes\nd", changed_sections), "# Notes\nc\n\n# Notes\nd\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+try:
+    from .plan_cache import PlanCache
+    from .planner import chat_completion
+except ImportError:
+    from plan_cache import PlanCache
+    chat_completion = None
+
+MESSAGES = [{"role": "user", "content": "Plan"}]
+
+
+class TestPlanCache(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.workspace.name, "plan_cache")
+
+    def tearDown(self):
+        self.workspace.cleanup()
+
+    def test_key(self):
+        """Test that the key changes with the messages and with every model setting."""
+        key = PlanCache.key(MESSAGES, "gpt-3.5-turbo", 1500, 0.5)
+        self.assertEqual(key, PlanCache.key([dict(MESSAGES[0])], "gpt-3.5-turbo", 1500, 0.5))
+        self.assertNotEqual(key, PlanCache.key([{"role": "user", "content": "Other"}], "gpt-3.5-turbo", 1500, 0.5))
+        self.assertNotEqual(key, PlanCache.key(MESSAGES, "gpt-4", 1500, 0.5))
+        self.assertNotEqual(key, PlanCache.key(MESSAGES, "gpt-3.5-turbo", 500, 0.5))
+        self.assertNotEqual(key, PlanCache.key(MESSAGES, "gpt-3.5-turbo", 1500, 0.0))
+
+    def test_ttl_expiry(self):
+        """Test that answers are only returned until they are older than the TTL, and then removed."""
+        cache = PlanCache(self.directory, 60)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "plan a")
+        self.assertEqual(cache.get("a"), "plan a")
+
+        with patch("time.time", return_value=time.time() + 61):
+            self.assertIsNone(cache.get("a"))
+
+        # Storing an answer removes the expired ones
+        expired = time.time() - 61
+        os.utime(os.path.join(self.directory, "a.json"), (expired, expired))
+        cache.put("b", "plan b")
+        self.assertEqual(sorted(os.listdir(self.directory)), ["b.json"])
+
+    def test_invalid_entry(self):
+        """Test that an unreadable entry is a miss."""
+        cache = PlanCache(self.directory, 60)
+        os.makedirs(self.directory)
+        with open(os.path.join(self.directory, "a.json"), "w") as f:
+            f.write("{not json")
+        self.assertIsNone(cache.get("a"))
+
+    @unittest.skipIf(chat_completion is None, "the planner is imported as a package")
+    def test_chat_completion_bypass(self):
+        """Test that cached answers are reused, unless the cache is bypassed, which replaces the cached answer."""
+        openai = MagicMock()
+        openai.ChatCompletion.create.side_effect = [
+            MagicMock(choices=[MagicMock(message=MagicMock(content=f" answer {n} "))]) for n in range(1, 4)
+        ]
+        cwd = os.getcwd()
+        os.chdir(self.workspace.name)
+        try:
+            with patch.dict(sys.modules, {"openai": openai}), patch.dict(os.environ, {"PLANNER_CACHE_TTL": "60"}):
+                self.assertEqual(chat_completion(MESSAGES), "answer 1")
+                self.assertEqual(chat_completion(MESSAGES), "answer 1")
+                self.assertEqual(chat_completion(MESSAGES, bypass_cache=True), "answer 2")
+                self.assertEqual(chat_completion(MESSAGES), "answer 2")
+                with patch.dict(os.environ, {"PLANNER_CACHE_BYPASS": "True"}):
+                    self.assertEqual(chat_completion(MESSAGES), "answer 3")
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(openai.ChatCompletion.create.call_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+try:
+    from .task_store import TaskStore
+except ImportError:
+    from task_store import TaskStore
+
+
+class TestTaskStore(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.workspace.name, "tasks.db")
+        self.json_path = os.path.join(self.workspace.name, "tasks.json")
+
+    def tearDown(self):
+        self.workspace.cleanup()
+
+    def write_json(self, tasks):
+        with open(self.json_path, "w") as f:
+            json.dump(tasks, f)
+
+    def read_json(self):
+        with open(self.json_path) as f:
+            return json.load(f)
+
+    def test_imports_tasks_json_once(self):
+        """Test that the tasks of tasks.json are imported into a new database, and only into a new one."""
+        self.write_json({"1": {"description": "Write", "completed": False},
+                         "2": {"description": "Test", "completed": True},
+                         "3": "not a task"})
+        store = TaskStore(self.db_path, self.json_path)
+
+        self.assertEqual(store.all(), {"1": {"description": "Write", "completed": False},
+                                       "2": {"description": "Test", "completed": True}})
+
+        self.write_json({"4": {"description": "Ignored", "completed": False}})
+        self.assertNotIn("4", TaskStore(self.db_path, self.json_path).all())
+
+    def test_ignores_invalid_tasks_json(self):
+        """Test that a tasks.json that is not a JSON object is not imported."""
+        with open(self.json_path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(TaskStore(self.db_path, self.json_path).all(), {})
+
+    def test_put_replaces_in_creation_order(self):
+        """Test that replacing a task keeps its place in the order the tasks were created."""
+        store = TaskStore(self.db_path)
+        store.put(1, "First")
+        store.put(2, "Second")
+        store.put(1, "First, revised", completed=True)
+
+        self.assertEqual(list(store.all()), ["1", "2"])
+        self.assertEqual(store.get(1), {"description": "First, revised", "completed": True})
+        self.assertEqual(store.all(completed=False), {"2": {"description": "Second", "completed": False}})
+
+        # Another store on the same database sees the same tasks in the same order
+        self.assertEqual(list(TaskStore(self.db_path).all()), ["1", "2"])
+
+    def test_set_completed(self):
+        """Test that the status of a task is set, and that a missing task is reported."""
+        store = TaskStore(self.db_path)
+        store.put("a", "Task")
+
+        self.assertTrue(store.set_completed("a"))
+        self.assertTrue(store.get("a")["completed"])
+        self.assertFalse(store.set_completed("missing"))
+        self.assertIsNone(store.get("missing"))
+        self.assertEqual(list(store.all()), ["a"])
+
+    def test_sees_writes_of_other_connections(self):
+        """Test that the copy of the tasks in memory is reloaded after another connection wrote to the database."""
+        store = TaskStore(self.db_path)
+        other = TaskStore(self.db_path)
+        store.put(1, "Task")
+        self.assertEqual(other.all(), {"1": {"description": "Task", "completed": False}})
+
+        other.set_completed(1)
+        self.assertTrue(store.get(1)["completed"])
+
+    def test_reloads_only_after_writes_of_other_connections(self):
+        """Test that the tasks are only read from the database again once data_version changed."""
+        store = TaskStore(self.db_path)
+        other = TaskStore(self.db_path)
+        store.put(1, "Task")
+        store.all()
+        statements = []
+        store._connect().set_trace_callback(statements.append)
+
+        store.all()
+        store.get(1)
+        store.put(2, "Own task")
+        self.assertEqual(list(store.all()), ["1", "2"])
+        self.assertFalse([statement for statement in statements if statement.startswith("SELECT")])
+
+        other.put(3, "Other task")
+        self.assertEqual(list(store.all()), ["1", "2", "3"])
+        self.assertEqual(len([statement for statement in statements if statement.startswith("SELECT")]), 1)
+
+    def test_export_only_when_enabled(self):
+        """Test that tasks.json is only rewritten after every change if PLANNER_EXPORT_TASKS_JSON is True."""
+        with patch.dict(os.environ, {"PLANNER_EXPORT_TASKS_JSON": "False"}):
+            store = TaskStore(self.db_path, self.json_path)
+        store.put(1, "Task")
+        self.assertFalse(os.path.exists(self.json_path))
+
+        # It can still be exported on demand
+        store.export()
+        self.assertEqual(self.read_json(), {"1": {"description": "Task", "completed": False}})
+
+        with patch.dict(os.environ, {"PLANNER_EXPORT_TASKS_JSON": "True"}):
+            store = TaskStore(self.db_path, self.json_path)
+        store.put(2, "Other task")
+        store.set_completed(1)
+        self.assertEqual(self.read_json(), {"1": {"description": "Task", "completed": True},
+                                            "2": {"description": "Other task", "completed": False}})
+        self.assertEqual([name for name in os.listdir(self.workspace.name) if name.startswith(".tasks_")], [])
+
+
+if __name__ == "__main__":
+    unittest.main()